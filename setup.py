@@ -1,9 +1,12 @@
 # Setup File for compiling Cython File
 
-from distutils.core import setup
+from glob import glob
+from setuptools import setup
 from Cython.Build import cythonize
 
 setup(
-    ext_modules = cythonize("volumerender_cfunction.pyx"),
-    compiler_directives={'language_level' : "3"}
+    name = "volumerender",
+    py_modules = sorted(name[:-3] for name in glob("volumerender*.py")),
+    ext_modules = cythonize("volumerender_cfunction.pyx", compiler_directives={'language_level' : "3"}),
+    entry_points = {'console_scripts': ['volumerender = volumerender_cli:main']}
 )
@@ -18,7 +18,657 @@ def test_datacube_file():
 
 def test_transferFunction():
     r, g, b, a = transferFunction(np.array([1, 2, 3]))
-    assert 0 <= r.all() <= 1
-    assert 0 <= g.all() <= 1
-    assert 0 <= b.all() <= 1
-    assert 0 <= a.all() <= 1
\ No newline at end of file
+    # g(3) is 1 plus the other bands' tails, one ulp above 1 after rounding
+    one = 1 + 4*np.finfo(np.float64).eps
+    assert np.all((0 <= r) & (r <= one))
+    assert np.all((0 <= g) & (g <= one))
+    assert np.all((0 <= b) & (b <= one))
+    assert np.all((0 <= a) & (a <= one))
+
+def test_preintegrated_matches_dense():
+    from volumerender_core import composite
+    from volumerender_preintegrated import preintegrate, render_preintegrated
+    rng = np.random.default_rng(0)
+    camera_grid = np.exp(rng.uniform(-4, 10, size=(16, 8, 8)))
+    table = preintegrate(length=1.0, Nsub=1, Nbins=4096)
+    image = render_preintegrated(camera_grid, table)
+    assert np.allclose(image, composite(camera_grid), atol=2e-2)
+
+
+def test_preintegrated_with_fewer_steps():
+    from volumerender_core import camera_points, composite, datacube_points
+    from volumerender_sampling import sample_uniform
+    from volumerender_preintegrated import preintegrate, render_preintegrated
+    n, N, Nsteps = 32, 24, 16
+    X, Y, Z = np.meshgrid(*datacube_points((n, n, n)), indexing='ij')
+    datacube = np.exp(10 - 14*(X**2 + Y**2 + Z**2)/(n/2)**2)
+    dense = composite(sample_uniform(datacube, camera_points(N, 0.3), (N, N, N)))
+    sparse = sample_uniform(datacube, camera_points(N, 0.3, Nsteps), (Nsteps, N, N))
+    image = render_preintegrated(sparse, preintegrate(length=(N-1)/(Nsteps-1)))
+    error = np.sqrt(np.mean((image - dense)**2))
+    naive = np.sqrt(np.mean((composite(sparse) - dense)**2))
+    assert error < 0.03
+    assert error < naive
+
+
+def test_camera_orbit_matches_main():
+    from volumerender_core import rotation_x, view_points
+    from volumerender_camera import orbit
+    for i, camera in enumerate(orbit(4, width=12, Nsteps=8)):
+        R = rotation_x(np.pi/2 * i / 4)
+        assert np.allclose(camera.matrix, R)
+        assert np.allclose(camera.points(), view_points(R, 12, 8), atol=1e-4)
+
+
+def test_clipped_sampling_fills_outside():
+    from scipy.interpolate import interpn
+    from volumerender_core import datacube_points
+    from volumerender_camera import Camera
+    from volumerender_clip import sample_clipped
+    rng = np.random.default_rng(1)
+    datacube = np.exp(rng.normal(size=(16, 16, 16)))
+    camera = Camera.from_angle(0.7, 24, Nsteps=20)
+    expected = interpn(datacube_points(datacube.shape), datacube, camera.points(),
+                       bounds_error=False, fill_value=0.0).reshape(camera.shape)
+    assert np.allclose(sample_clipped(datacube, camera), expected)
+
+
+def test_workspace_matches_composite_without_allocating():
+    import tracemalloc
+    from volumerender_core import Workspace, composite
+    rng = np.random.default_rng(2)
+    camera_grid = np.exp(rng.uniform(-4, 10, size=(12, 32, 32)))
+    workspace = Workspace()
+    assert np.array_equal(workspace.composite(camera_grid), composite(camera_grid))
+    tracemalloc.start()
+    workspace.composite(camera_grid)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert workspace.frame_allocations == 0
+    assert peak < camera_grid[0].nbytes
+
+
+@pytest.fixture
+def cube_file(tmp_path):
+    def write(datacube, name='cube.hdf5'):
+        filename = str(tmp_path / name)
+        with h5py.File(filename, 'w') as f:
+            f['density'] = datacube
+        return filename
+    return write
+
+
+def test_distributed_matches_single_process(cube_file):
+    from volumerender_camera import Camera
+    from volumerender_clip import render_clipped
+    from volumerender_distributed import render_distributed
+    rng = np.random.default_rng(3)
+    datacube = np.exp(rng.normal(size=(16, 16, 16)))
+    filename = cube_file(datacube)
+    camera = Camera.from_angle(2.0, 12, Nsteps=10)
+    image = render_distributed(filename, camera, processes=4)
+    assert np.allclose(image, render_clipped(datacube, camera))
+    with pytest.raises(ValueError, match='power-of-two'):
+        render_distributed(filename, camera, processes=3)
+    with pytest.raises(ValueError):
+        render_distributed(filename, camera, processes=4, interpolationMethod='bogus')
+
+
+def test_gaussian_transfer_function():
+    from volumerender_core import GaussianTransferFunction, DEFAULT_TRANSFER, Workspace, composite
+    x = np.linspace(-6, 12, 101)
+    for expected, actual in zip(transferFunction(x), DEFAULT_TRANSFER(x)):
+        assert np.allclose(actual, expected, rtol=1e-12, atol=1e-15)
+    assert GaussianTransferFunction() == DEFAULT_TRANSFER
+    assert hash(GaussianTransferFunction()) == hash(DEFAULT_TRANSFER)
+
+    single = GaussianTransferFunction([2.0], [0.5], [[1.0], [0.5], [0.25], [0.1]])
+    r, g, b, a = single(x)
+    assert np.allclose(a, 0.1*np.exp(-(x - 2.0)**2/0.5))
+    assert single != DEFAULT_TRANSFER
+    with pytest.raises(ValueError):
+        GaussianTransferFunction([1.0, 2.0], [1.0], [[1.0, 1.0]]*4)
+
+    camera_grid = np.exp(np.random.default_rng(4).uniform(-4, 10, size=(6, 5, 5)))
+    assert np.allclose(Workspace(transfer=single).composite(camera_grid), composite(camera_grid, single))
+    with pytest.raises(TypeError):
+        Workspace(transfer=transferFunction)
+
+
+def test_projection_modes():
+    from scipy.interpolate import interpn
+    from volumerender_core import camera_points, datacube_points
+    from volumerender_camera import Camera
+    from volumerender_projection import MODES, project_camera, axis_projection
+    rng = np.random.default_rng(5)
+    datacube = np.exp(rng.normal(size=(32, 32, 32)))
+    camera_grid = interpn(datacube_points(datacube.shape), datacube, camera_points(22, 0.3)).reshape((22, 22, 22))
+    for mode in MODES:
+        expected = getattr(np, mode)(camera_grid, axis=0)
+        assert np.allclose(project_camera(datacube, Camera.from_angle(0.3, 22), mode), expected)
+        # Rays clipped to the volume ignore the samples outside it
+        projection = project_camera(datacube, Camera.from_angle(0.7, 40), mode)
+        assert projection.shape == (40, 40) and projection.min() >= 0
+    assert axis_projection(datacube) is axis_projection(datacube)
+    assert np.allclose(axis_projection(datacube, 'max', 2), datacube.max(axis=2))
+    # A camera looking along a datacube axis on the voxel grid reduces the datacube directly
+    from volumerender_camera import quaternion_axis_angle
+    from volumerender_clip import volume_bounds
+    datacube = np.exp(rng.normal(size=(24, 20, 28)))
+    camera = Camera(quaternion_axis_angle((0.0, 0.0, 1.0), -np.pi/2), width=28, height=20, Nsteps=24, depth=24)
+    qi = np.clip(camera.points(), *volume_bounds(datacube.shape))
+    camera_grid = interpn(datacube_points(datacube.shape), datacube, qi).reshape(camera.shape)
+    for mode in MODES:
+        projection = project_camera(datacube, camera, mode)
+        assert np.allclose(projection, getattr(np, mode)(camera_grid, axis=0), rtol=1e-4)
+        assert np.array_equal(projection, getattr(np, mode)(datacube, axis=0)[::-1])
+    assert np.array_equal(project_camera(datacube, camera.cropped((2, 9, 3, 11))), project_camera(datacube, camera)[2:9, 3:11])
+
+
+def test_uniform_samplers_match_interpn():
+    from volumerender_core import camera_points, datacube_points, sample
+    from volumerender_sampling import sample_uniform, sample_nearest
+    rng = np.random.default_rng(6)
+    datacube = np.exp(rng.normal(size=(20, 24, 28)))
+    qi = camera_points(16, 0.4)
+    for method in ('nearest', 'linear'):
+        expected = sample(datacube_points(datacube.shape), datacube, qi, (16, 16, 16), method)
+        assert np.allclose(sample_uniform(datacube, qi, (16, 16, 16), method), expected)
+    codes = rng.integers(0, 256, size=datacube.shape, dtype=np.uint8)
+    assert sample_nearest(codes, qi).dtype == np.uint8
+
+
+def test_quantized_round_trip(tmp_path):
+    from volumerender_core import camera_points, composite, datacube_points
+    from volumerender_sampling import sample_uniform
+    from volumerender_quantized import quantize, quantize_file, quantized_file, load_quantized, transfer_table, render_quantized
+    n = 24
+    X, Y, Z = np.meshgrid(*datacube_points((n, n, n)), indexing='ij')
+    logs = 10 - 14*(X**2 + Y**2 + Z**2)/(n/2)**2
+    datacube = np.exp(logs)
+    datacube[:, :, :4] = 0
+    filename = str(tmp_path / 'cube.hdf5')
+    with h5py.File(filename, 'w') as f:
+        f['density'] = datacube
+
+    qi = camera_points(16, 0.4)
+    dense = composite(sample_uniform(datacube, qi, (16, 16, 16), 'nearest'))
+    for bits, dtype, tolerance in ((8, np.uint8, 5e-2), (16, np.uint16, 1.5e-3)):
+        name = quantize_file(filename, bits)
+        with h5py.File(filename, 'r') as f:
+            assert list(f) == ['density']
+        with h5py.File(quantized_file(filename), 'r') as f:
+            assert f[name].attrs['bits'] == bits
+        codes, scale, offset = load_quantized(quantized_file(filename), bits)
+        assert codes.dtype == dtype
+        # Empty voxels keep the reserved, transparent code 0
+        assert np.all(codes[:, :, :4] == 0) and codes[:, :, 4:].min() >= 1
+        table = transfer_table(scale, offset, 2**bits)
+        assert np.all(table[0] == 0)
+        image = render_quantized(codes, table, qi, (16, 16, 16), 'nearest')
+        assert np.abs(image - dense).max() < tolerance
+
+    # Linear interpolation of codes is linear in log-density
+    codes, scale, offset = quantize(np.exp(logs), 16)
+    image = render_quantized(codes, transfer_table(scale, offset, 2**16), qi, (16, 16, 16), 'linear')
+    assert np.abs(image - composite(np.exp(sample_uniform(logs, qi, (16, 16, 16))))).max() < 1.5e-3
+
+    with pytest.raises(ValueError):
+        quantize(np.zeros((4, 4, 4)))
+
+
+def test_profiler_records_one_stage_per_frame(tmp_path):
+    import json
+    from volumerender_core import composite
+    from volumerender_camera import Camera, sample_camera
+    from volumerender_pipeline import render_frame
+    from volumerender_profile import Profiler, NULL_PROFILER, _NULL_STAGE
+    rng = np.random.default_rng(9)
+    datacube = np.exp(rng.normal(size=(16, 16, 16)))
+    profiler = Profiler(memory=True)
+    for frame, angle in enumerate((0.3, 1.2)):
+        profiler.frame = frame
+        camera = Camera.from_angle(angle, 12, Nsteps=10)
+        image = render_frame(datacube, camera, profiler=profiler)
+        assert np.allclose(image, composite(sample_camera(datacube, camera)))
+    profiler.close()
+
+    stages = ['grid', 'sample', 'classify', 'composite']
+    assert [(r['frame'], r['stage']) for r in profiler.records] == [(f, s) for f in (0, 1) for s in stages]
+    assert all(r['wall'] >= 0 and r['peak_bytes'] >= 0 for r in profiler.records)
+    summary = profiler.summary()
+    assert list(summary) == stages and all(total['calls'] == 2 for total in summary.values())
+
+    profiler.to_json(str(tmp_path / 'profile.json'))
+    with open(tmp_path / 'profile.json') as f:
+        assert len(json.load(f)['records']) == 8
+    trace = json.loads(profiler.to_chrome_trace())
+    assert len(trace['traceEvents']) == 8
+    assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in trace['traceEvents'])
+
+    assert NULL_PROFILER.stage('sample') is _NULL_STAGE
+    assert Profiler(enabled=False).stage('sample') is _NULL_STAGE
+
+
+def test_vectorized_chunks_match_and_fit_budget():
+    import tracemalloc
+    from scipy.interpolate import interpn
+    from volumerender_core import camera_points, datacube_points
+    from volumerender_vectorized import chunk_plan, make_buffers, render_view
+    rng = np.random.default_rng(10)
+    datacube = np.exp(rng.normal(size=(64, 64, 64)))
+    points = datacube_points(datacube.shape)
+    N, angle, budget = 44, 0.3, 4 << 20
+    for method in ('nearest', 'linear'):
+        with np.errstate(divide='ignore'):
+            x = np.log(interpn(points, datacube, camera_points(N, angle), method=method).reshape((N, N, N)))
+        r, g, b, a = transferFunction(x)
+        expected = np.stack([np.sum(a*c, 0) for c in (r, g, b)], axis=-1)
+
+        chunks = chunk_plan(N, budget, method)
+        assert len(chunks) > 1
+        tracemalloc.start()
+        buffers = make_buffers(N, chunks[0][1] - chunks[0][0])
+        image = render_view(points, datacube, angle, N, method, chunks, buffers)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert np.allclose(image, expected, rtol=1e-12, atol=1e-15)
+        assert peak <= budget
+
+
+def test_streamed_bricks_match_clipped(cube_file, monkeypatch):
+    from volumerender_camera import Camera
+    from volumerender_clip import render_clipped
+    from volumerender_bricks import brick_grid, render_streamed
+    rng = np.random.default_rng(11)
+    datacube = np.exp(rng.uniform(-4, 10, size=(18, 18, 18)))
+    filename = cube_file(datacube)
+    # 17 cells per axis: four full bricks of 4 and an uneven one of 1
+    assert len(brick_grid(datacube.shape, 4)) == 5**3
+    for camera in (Camera.from_angle(0.7, 16, Nsteps=14), Camera.from_angle(2.3, 16, Nsteps=14, fov=50.0)):
+        image = render_streamed(filename, camera, brick=4, prefetch=3)
+        assert np.allclose(image, render_clipped(datacube, camera), atol=1e-12)
+
+    # A failing frame stops the reader thread instead of leaving it blocked with the file open
+    import threading
+    import volumerender_bricks
+    def fail(*args, **kwargs):
+        raise RuntimeError('composite failed')
+    monkeypatch.setattr(volumerender_bricks, 'composite_brick', fail)
+    before = set(threading.enumerate())
+    with pytest.raises(RuntimeError):
+        render_streamed(filename, Camera.from_angle(0.7, 16), brick=4, prefetch=1)
+    assert set(threading.enumerate()) <= before
+
+
+def test_time_series_matches_single_frames(cube_file, tmp_path):
+    from volumerender_core import composite, encode_png
+    from volumerender_camera import Camera, sample_camera
+    from volumerender_timeseries import render_series
+    rng = np.random.default_rng(12)
+    cubes = [np.exp(rng.uniform(-4, 10, size=(16, 16, 16))) for _ in range(3)]
+    files = [cube_file(cube, 'datacube_%04d.hdf5' % s) for s, cube in enumerate(cubes)]
+    cameras = [Camera.from_angle(0.3, 12), Camera.from_angle(1.1, 14, Nsteps=10)]
+    output = str(tmp_path / 'frame_{snapshot}_{frame}.png')
+
+    written = render_series(str(tmp_path / 'datacube_*.hdf5'), cameras, output)
+    assert len(written) == 6
+    for s, cube in enumerate(cubes):
+        for i, camera in enumerate(cameras):
+            with open(output.format(snapshot=s, frame=i), 'rb') as f:
+                assert f.read() == encode_png(composite(sample_camera(cube, camera)))
+
+    import threading
+    before = set(threading.enumerate())
+    files.append(cube_file(np.ones((8, 8, 8)), 'datacube_0003.hdf5'))
+    with pytest.raises(ValueError, match='has shape'):
+        render_series(files, cameras, output)
+    # A frame that fails to write stops the prefetch thread too
+    with pytest.raises(OSError):
+        render_series(files, cameras, str(tmp_path / 'missing' / 'frame_{snapshot}_{frame}.png'))
+    assert set(threading.enumerate()) <= before
+
+
+def test_recompositor_reuses_samples():
+    from volumerender_core import composite, GaussianTransferFunction
+    from volumerender_camera import orbit, sample_camera
+    from volumerender_incremental import Recompositor
+    rng = np.random.default_rng(13)
+    datacube = np.exp(rng.uniform(-4, 10, size=(16, 16, 16)))
+    cameras = orbit(2, width=12)
+    other = GaussianTransferFunction([2.0], [0.5], [[1.0], [0.5], [0.25], [0.1]])
+
+    recompositor = Recompositor(datacube, cameras)
+    images = recompositor.render()
+    assert (recompositor.cache.hits, recompositor.cache.misses) == (0, 2)
+    for image, camera in zip(images, cameras):
+        assert np.allclose(image, composite(sample_camera(datacube, camera)), atol=1e-5)
+    images = recompositor.render(other)
+    assert (recompositor.cache.hits, recompositor.cache.misses) == (2, 2)
+    for image, camera in zip(images, cameras):
+        assert np.allclose(image, composite(sample_camera(datacube, camera), other), atol=1e-5)
+
+    # Room for one view only: the two views keep evicting each other
+    view_bytes = 12**3 * 4
+    small = Recompositor(datacube, cameras, memory_limit=view_bytes + view_bytes//2)
+    small.render()
+    small.render(other)
+    assert (small.cache.hits, small.cache.misses) == (0, 4)
+    assert len(small.cache.entries) == 1 and small.cache.nbytes == view_bytes
+
+    # Another datacube, or a new version of the same one, is resampled
+    cache = recompositor.cache
+    brighter = datacube * 10
+    assert np.allclose(cache.get(brighter, cameras[0]), np.log(sample_camera(brighter, cameras[0])), atol=1e-5)
+    datacube *= 10
+    assert np.allclose(cache.get(datacube, cameras[0], version=1), cache.get(brighter, cameras[0]), atol=1e-5)
+    assert cache.hits == 2 and cache.misses == 5
+
+
+def test_render_server_coalesces_and_caches(cube_file):
+    import asyncio
+    from volumerender_camera import Camera
+    from volumerender_clip import render_clipped
+    from volumerender_core import encode_png
+    from volumerender_server import RenderServer
+    rng = np.random.default_rng(7)
+    datacube = np.exp(rng.uniform(-4, 10, size=(16, 16, 16)))
+    server = RenderServer(cube_file(datacube), workers=2)
+
+    async def get(port, path):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(('GET ' + path + ' HTTP/1.1\r\nHost: localhost\r\n\r\n').encode())
+        response = await reader.read()
+        writer.close()
+        head, body = response.split(b'\r\n\r\n', 1)
+        return int(head.split()[1]), body
+
+    async def run():
+        listener = await server.start(port=0)
+        port = listener.sockets[0].getsockname()[1]
+        path = '/render?angle=0.5&N=12&Nsteps=10'
+        first = await asyncio.gather(get(port, path), get(port, path))
+        again = await get(port, path)
+        bad = [await get(port, '/render?' + query)
+               for query in ('method=cubic', 'tf=5', 'tf=[1]', 'fov=200', 'fov=-10', 'N=0')]
+        listener.close()
+        return first, again, bad
+
+    try:
+        # A hung worker pool fails the test instead of blocking the suite
+        first, again, bad = asyncio.run(asyncio.wait_for(run(), timeout=120))
+    finally:
+        server.close()
+    expected = encode_png(render_clipped(datacube, Camera.from_angle(0.5, 12, Nsteps=10)))
+    assert [status for status, _ in first] == [200, 200] and again[0] == 200
+    assert all(body == expected for _, body in first + [again])
+    assert [status for status, _ in bad] == [400]*6
+    assert server.rendered == 1 and server.coalesced == 1 and server.cache.hits == 1
+
+
+def test_cli_imports_lazily_and_renders(cube_file, tmp_path):
+    import subprocess
+    import sys
+    from volumerender_core import composite, encode_png
+    from volumerender_camera import Camera, sample_camera
+    from volumerender_cli import main as cli, import_time
+    code = ('import sys, volumerender_cli, volumerender, volumerender_vectorized, volumerender_camera; '
+            'print(sorted(m for m in ("scipy", "h5py", "matplotlib", "line_profiler") if m in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == '[]'
+    assert 0 < import_time('volumerender_cli', repeat=1) < 5
+
+    rng = np.random.default_rng(14)
+    datacube = np.exp(rng.uniform(-4, 10, size=(16, 16, 16)))
+    filename = cube_file(datacube)
+    for backend in ('numpy', 'bricks'):
+        output = str(tmp_path / (backend + '.png'))
+        cli(['render', '--input', filename, '-N', '12', '--Nsteps', '10', '--angle', '0.5',
+             '--backend', backend, '--brick', '4', '--output', output])
+        with open(output, 'rb') as f:
+            data = f.read()
+        camera = Camera.from_angle(0.5, 12, Nsteps=10)
+        assert data == encode_png(composite(sample_camera(datacube, camera)))
+
+
+def test_jobs_resume_from_checkpoint(cube_file, tmp_path):
+    import json
+    from volumerender_core import composite, encode_png
+    from volumerender_jobs import run_jobs, manifest_cameras, load_manifest, completed_frames, split_tasks
+    from volumerender_camera import sample_camera
+    rng = np.random.default_rng(15)
+    cubes = [np.exp(rng.uniform(-4, 10, size=(16, 16, 16))) for _ in range(2)]
+    for i, datacube in enumerate(cubes):
+        cube_file(datacube, 'snap%d.hdf5' % i)
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps({
+        'volumes': 'snap*.hdf5', 'cameras': {'orbit': {'frames': 3}},
+        'camera': {'width': 12, 'Nsteps': 10}, 'output': 'out/{volume}_{frame}.png'}))
+
+    loaded = load_manifest(str(manifest))
+    checkpoint = loaded['checkpoint']
+    (tmp_path / 'out').mkdir()
+    with open(checkpoint, 'w') as f:
+        f.write(json.dumps({'volume': loaded['volumes'][0], 'frame': 1, 'seconds': 0.0}) + '\n{"volu')
+
+    result = run_jobs(str(manifest), workers=4)
+    assert result['rendered'] == 5 and result['skipped'] == 1 and result['fps'] > 0
+    assert not (tmp_path / 'out' / 'snap0_1.png').exists()
+    cameras = manifest_cameras(loaded)
+    for i, datacube in enumerate(cubes):
+        for frame in range(3):
+            if (i, frame) != (0, 1):
+                data = (tmp_path / 'out' / ('snap%d_%d.png' % (i, frame))).read_bytes()
+                assert data == encode_png(composite(sample_camera(datacube, cameras[frame])))
+    assert len(completed_frames(checkpoint)) == 6
+
+    result = run_jobs(str(manifest))
+    assert result['rendered'] == 0 and result['skipped'] == 6
+    # Fewer volumes than workers: frames of a volume are shared out among workers
+    assert split_tasks([(0, [0, 2, 3, 4, 5, 6, 7])], 3) == [(0, [0, 2]), (0, [3, 4]), (0, [5, 6, 7])]
+    assert split_tasks([(0, [0, 1]), (1, [5])], 4) == [(0, [0]), (0, [1]), (1, [5])]
+    assert split_tasks([(0, [0, 1]), (1, [5])], 1) == [(0, [0, 1]), (1, [5])]
+
+
+def test_morton_layout_matches_linear_layout():
+    from volumerender_morton import BrickedVolume, morton_code, sample_camera, distinct_blocks
+    from volumerender_camera import Camera, quaternion_axis_angle
+    from volumerender_clip import sample_clipped
+    assert list(morton_code(np.array([0, 0, 0, 1, 1]), np.array([0, 0, 1, 0, 1]), np.array([0, 1, 0, 0, 1]))) == [0, 1, 2, 4, 7]
+    rng = np.random.default_rng(16)
+    datacube = np.exp(rng.uniform(-4, 10, size=(20, 18, 13)))
+    volume = BrickedVolume(datacube, 4)
+    assert np.array_equal(volume.to_array(), datacube)
+    camera = Camera(quaternion_axis_angle((0.3, 1.0, 0.2), 0.7), width=12, Nsteps=10)
+    for method in ('nearest', 'linear'):
+        expected = sample_clipped(datacube, camera, method)
+        assert np.array_equal(sample_camera(volume, camera, method), expected)
+        assert np.array_equal(sample_camera(volume, camera, method, tile=5), expected)
+    with pytest.raises(ValueError):
+        BrickedVolume(datacube, 6)
+    assert distinct_blocks(np.arange(16), itemsize=8, window=8, block=64) == 1.0
+
+
+def test_chunked_conversion_round_trip(cube_file, tmp_path):
+    from volumerender_core import load_datacube
+    from volumerender_chunked import convert, read_chunked, chunk_ranges
+    rng = np.random.default_rng(17)
+    datacube = np.exp(rng.uniform(-4, 10, size=(20, 18, 13)))
+    filename = cube_file(datacube)
+    for compression in ('gzip', 'lzf', None):
+        converted = str(tmp_path / ('%s.hdf5' % compression))
+        convert(filename, converted, chunk=8, compression=compression)
+        out = np.empty_like(datacube)
+        assert read_chunked(converted, threads=3, out=out) is out
+        assert np.array_equal(out, datacube)
+        assert np.array_equal(load_datacube(converted), datacube)
+        chunk_min, chunk_max, chunks = chunk_ranges(converted)
+        assert chunks == (8, 8, 8) and chunk_min.shape == (3, 3, 2)
+        assert chunk_min[2, 1, 1] == datacube[16:, 8:16, 8:].min()
+        assert chunk_max[0, 2, 0] == datacube[:8, 16:, :8].max()
+    with pytest.raises(ValueError):
+        read_chunked(converted, out=np.empty((2, 2, 2)))
+
+
+def test_gradient_shading(cube_file):
+    import os
+    from volumerender_core import composite
+    from volumerender_camera import Camera
+    from volumerender_clip import sample_clipped
+    from volumerender_shading import gradient_volume, load_gradient, gradient_file, render_shaded
+    x = np.linspace(-8, 8, 16)
+    normals, magnitude = gradient_volume(np.exp(0.5*x)[:,None,None] * np.ones((16, 12, 10)))
+    assert normals.dtype == np.int8 and magnitude.dtype == np.float16
+    assert np.all(normals[..., 0] == 127) and np.all(normals[..., 1:] == 0)
+    assert np.allclose(magnitude, 0.5, rtol=1e-3)
+
+    rng = np.random.default_rng(18)
+    datacube = np.exp(rng.uniform(-4, 10, size=(16, 16, 16)))
+    filename = cube_file(datacube)
+    gradient = load_gradient(filename)
+    assert os.path.exists(gradient_file(filename))
+    cached = load_gradient(filename)
+    assert all(np.array_equal(a, b) for a, b in zip(gradient, cached))
+
+    camera = Camera.from_angle(0.5, 12, Nsteps=10)
+    plain = composite(sample_clipped(datacube, camera))
+    unlit = render_shaded(datacube, gradient, camera, ambient=1.0, diffuse=0.0, specular=0.0)
+    assert np.allclose(unlit, plain)
+    lit = render_shaded(datacube, gradient, camera, light=(1.0, 1.0, 0.0))
+    assert lit.shape == plain.shape and not np.allclose(lit, plain)
+
+
+def test_region_of_interest(cube_file, tmp_path):
+    from volumerender_camera import Camera
+    from volumerender_clip import render_clipped
+    from volumerender_bricks import render_streamed
+    from volumerender_roi import box_window, render_roi, full_image
+    from volumerender_cli import main as cli
+    rng = np.random.default_rng(19)
+    datacube = np.exp(rng.uniform(-4, 10, size=(16, 16, 16)))
+    for options in ({}, {'fov': 40.0}):
+        camera = Camera.from_angle(0.5, 12, Nsteps=10, **options)
+        window = camera.cropped((2, 9, 3, 11))
+        assert window.shape == (10, 7, 8) and window.frame == (12, 12)
+        assert all(np.array_equal(a, b[2:9, 3:11]) for a, b in zip(window.rays(), camera.rays()))
+        full = render_clipped(datacube, camera)
+        assert np.allclose(render_roi(datacube, window)[0], full[2:9, 3:11], rtol=1e-12, atol=0)
+
+        box = ((-4.0, -2.0, -5.0), (3.0, 6.0, 1.0))
+        clipped = render_clipped(datacube, camera, box=box)
+        image, fitted = render_roi(datacube, camera, box)
+        assert fitted == box_window(camera, box, datacube.shape) and image.shape[:2] != (12, 12)
+        assert np.allclose(full_image(image, fitted, camera.frame), clipped, rtol=1e-12, atol=0)
+        assert not np.allclose(clipped, full)
+        assert np.allclose(render_streamed(cube_file(datacube), camera, brick=4, box=box), clipped)
+    with pytest.raises(ValueError):
+        box_window(camera, ((20.0, 20.0, 20.0), (30.0, 30.0, 30.0)), datacube.shape)
+    with pytest.raises(ValueError):
+        camera.cropped((0, 13, 0, 5))
+
+    output = str(tmp_path / 'roi.png')
+    cli(['render', '--input', cube_file(datacube), '-N', '12', '--Nsteps', '10', '--angle', '0.5',
+         '--window', '2,9,3,11', '--output', output])
+
+
+def test_multifield_single_pass(tmp_path):
+    from volumerender_core import GaussianTransferFunction, DEFAULT_TRANSFER
+    from volumerender_camera import Camera
+    from volumerender_clip import render_clipped
+    from volumerender_multifield import Field, load_fields, render_fields
+    rng = np.random.default_rng(20)
+    density = np.exp(rng.uniform(-4, 10, size=(16, 16, 16)))
+    potential = rng.uniform(-1, 1, size=(16, 16, 16))
+    filename = str(tmp_path / 'fields.hdf5')
+    with h5py.File(filename, 'w') as f:
+        f['density'] = density
+        f['potential'] = potential
+    fields = [Field('density'), Field('potential', GaussianTransferFunction([0.5], [0.05], [[0.2], [0.4], [1.0], [0.3]]), log=False)]
+    volumes = load_fields(filename, fields)
+    camera = Camera.from_angle(0.5, 12, Nsteps=10)
+
+    images = render_fields(volumes, fields, camera, combine=False)
+    assert np.allclose(images[0], render_clipped(density, camera, transfer=DEFAULT_TRANSFER))
+    assert np.allclose(images[1], render_fields([potential], fields[1:], camera, combine=False)[0])
+    assert np.allclose(render_fields(volumes[:1], fields[:1], camera), images[0])
+    combined = render_fields(volumes, fields, camera)
+    assert combined.shape == (12, 12, 3) and not np.allclose(combined, images[0])
+    with pytest.raises(ValueError):
+        render_fields([density, potential[:8]], fields, camera)
+
+
+def test_autotune_picks_and_applies_backend(cube_file, tmp_path, monkeypatch, capsys):
+    from volumerender_core import composite, encode_png
+    from volumerender_camera import Camera, sample_camera, uses_slab_path
+    from volumerender_clip import sample_clipped
+    from volumerender_cli import main as cli
+    from volumerender_autotune import calibrate, save_tuning, load_tuning, candidates
+    monkeypatch.setenv('VOLUMERENDER_TUNING', str(tmp_path / 'tuning.json'))
+    configs = candidates(180, cpus=2)
+    assert ('numpy', {'workers': 2}) in configs and ('numpy', {'path': 'clip'}) in configs
+    assert ('distributed', {'processes': 2}) in configs and all(backend != 'vectorized' for backend, _ in configs)
+
+    entry = calibrate(8, frames=1, configs=[('numpy', {'workers': 1}), ('numpy', {'path': 'clip'}), ('bricks', {'brick': 4})])
+    results = {(result['backend'], str(result['options'])): result for result in entry['candidates']}
+    assert results[('numpy', '{}')]['error_max'] == 0 and results[('numpy', "{'workers': 1}")]['error_max'] == 0
+    assert results[('numpy', "{'path': 'clip'}")]['accepted'] and results[('bricks', "{'brick': 4}")]['accepted']
+    assert entry['backend'] in ('numpy', 'bricks')
+    save_tuning(8, entry)
+    save_tuning(64, {'backend': 'bricks', 'options': {'brick': 4}})
+    assert load_tuning(10)['backend'] == entry['backend'] and load_tuning(50)['options'] == {'brick': 4}
+
+    rng = np.random.default_rng(23)
+    datacube = np.exp(rng.uniform(-4, 10, size=(16, 16, 16)))
+    output = str(tmp_path / 'tuned.png')
+    cli(['render', '--input', cube_file(datacube), '-N', '64', '--Nsteps', '10', '--angle', '0.5', '--output', output])
+    assert "Using the tuned bricks backend {'brick': 4}" in capsys.readouterr().out
+    with open(output, 'rb') as f:
+        assert f.read() == encode_png(composite(sample_camera(datacube, Camera.from_angle(0.5, 64, Nsteps=10))))
+    camera = Camera.from_angle(0.25, 8)
+    cli(['render', '--input', cube_file(datacube), '-N', '8', '--angle', '0.25', '--output', output,
+         '--backend', 'numpy', '--workers', '1', '--path', 'clip'])
+    with open(output, 'rb') as f:
+        assert f.read() == encode_png(composite(sample_camera(datacube, camera, path='clip')))
+    assert uses_slab_path(camera, datacube.shape)
+    assert np.array_equal(sample_camera(datacube, camera, path='clip'), sample_clipped(datacube, camera))
+    assert np.allclose(sample_camera(datacube, camera, workers=1), sample_clipped(datacube, camera), rtol=1e-4)
+
+
+def test_conformance_suite_within_tolerances():
+    from volumerender_core import transferFunction
+    from volumerender_conformance import run_suite, check, tolerance, reference_transfer, volume_size, BACKENDS, VOLUMES
+    x = np.linspace(-10, 15, 101)
+    assert all(np.array_equal(mine, theirs) for mine, theirs in zip(reference_transfer(x), transferFunction(x)))
+    assert volume_size(16) % 2 == 1 and volume_size(16) >= 16*np.sqrt(2)
+
+    results = run_suite(16, volumes=('noise', 'shell'), angles=(0.0, np.pi/4))
+    assert {(entry['backend'], entry['method'], entry['volume']) for entry in results} == \
+        {(backend, method, volume) for backend in ('reference',) + BACKENDS for method in ('linear', 'nearest')
+         for volume in ('noise', 'shell')}
+    assert check(results) == []
+    # Approximate backends have a max bound per volume that a real regression can exceed
+    assert tolerance('quantized', 'nearest', 'noise')[0] < 0.1 and tolerance('quantized', 'linear', 'smooth')[0] < 0.6
+    assert all(tolerance(backend, method, volume)[0] < 1.0 for backend in BACKENDS
+               for method in ('linear', 'nearest') for volume in VOLUMES)
+    worse = [dict(entry, max=entry['max'] + 0.05) if entry['backend'] == 'quantized' else entry for entry in results]
+    assert [failure.split(':')[0] for failure in check(worse)] == ['quantized (nearest, noise)', 'quantized (nearest, shell)']
+    exact = [entry for entry in results if entry['backend'] in ('numpy', 'workspace', 'chunked')]
+    assert all(entry['max'] < 1e-9 for entry in exact)
+    assert all(entry['max'] == 0 for entry in exact if entry['method'] == 'nearest')
+    failures = check(results, dict((key, (0.0, 0.0)) for key in BACKENDS))
+    assert any(failure.startswith('bricks (linear, noise)') for failure in failures)
+    assert not any(failure.startswith('numpy (nearest') for failure in failures)
+
+
+def test_sample_slabs_matches_interpn_on_ties():
+    from scipy.interpolate import interpn
+    from volumerender_core import datacube_points, camera_points, rotation_x
+    from volumerender_slab import sample_slabs
+    rng = np.random.default_rng(24)
+    # An even side puts many samples of the pi/4 view exactly halfway between voxels
+    datacube = rng.uniform(0, 1, size=(24, 24, 24))
+    for angle in (np.pi/4, 0.3):
+        for method in ('nearest', 'linear'):
+            expected = interpn(datacube_points(datacube.shape), datacube, camera_points(16, angle), method=method)
+            camera_grid = sample_slabs(datacube, rotation_x(angle), 16, None, method, workers=2)
+            assert np.allclose(camera_grid, expected.reshape((16, 16, 16)), rtol=0, atol=1e-13)
@@ -1,9 +1,7 @@
 import numpy as np
-import matplotlib.pyplot as plt
 from timeit import default_timer as timer
-import h5py as h5
-from scipy.interpolate import interpn
-from line_profiler import LineProfiler
+from volumerender_core import Workspace
+from volumerender_projection import axis_projection
 
 """
 Create Your Own Volume Rendering (With Python)
@@ -24,6 +22,10 @@ def transferFunction(x):
 
 def main(N):
 	""" Volume Rendering """
+	# Heavy imports are deferred so importing this module stays cheap
+	import h5py as h5
+	import matplotlib.pyplot as plt
+	from scipy.interpolate import interpn
 	
 	# Load Datacube
 	f = h5.File('datacube.hdf5', 'r')
@@ -40,6 +42,7 @@ def main(N):
 	Nangles = 10
 	# Intialise 1D empty array of size Nangles
 	average = np.zeros(Nangles)
+	workspace = Workspace()
 
 	for i in range(Nangles):
 		start = timer()
@@ -57,17 +60,12 @@ def main(N):
 		# Interpolate onto Camera Grid
 		camera_grid = interpn(points, datacube, qi, method='linear').reshape((N,N,N))
 		
-		# Do Volume Rendering
-		image = np.zeros((camera_grid.shape[1],camera_grid.shape[2],3))
-	
-		for dataslice in camera_grid:
-			r,g,b,a = transferFunction(np.log(dataslice))
-			image[:,:,0] = a*r + (1-a)*image[:,:,0]
-			image[:,:,1] = a*g + (1-a)*image[:,:,1]
-			image[:,:,2] = a*b + (1-a)*image[:,:,2]
+		# Do Volume Rendering -- all per-slice temporaries live in the workspace
+		image = workspace.composite(camera_grid)
 
 		end = timer()
 		print(f"Time to render scene {i+1}: {end - start} seconds")
+		print(f"Buffers allocated for scene {i+1}: {workspace.frame_allocations}")
 		# Add to average
 		average[i] = end - start
 
@@ -91,7 +89,7 @@ def main(N):
 	# Plot Simple Projection -- for Comparison
 	plt.figure(figsize=(4,4), dpi=80)
 	
-	plt.imshow(np.log(np.mean(datacube,0)), cmap = 'viridis')
+	plt.imshow(np.log(axis_projection(datacube, 'mean')), cmap = 'viridis')
 	plt.clim(-5, 5)
 	plt.axis('off')
 	
@@ -103,6 +101,8 @@ def main(N):
 
 # Profile the main function using the LineProfiler
 def profile_line_profiler():
+    from line_profiler import LineProfiler
+
     profiler = LineProfiler()
     profiler.add_function(main)
     profiler.run('main()')
@@ -0,0 +1,199 @@
+# Autotuning
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import importlib.util
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_autotune
+#  Picks the fastest rendering backend and its parameters for this host.
+#  Short calibration renders of a synthetic cube at the target resolution are
+#  timed for every candidate configuration of the CLI backends; candidates
+#  whose images differ from the numpy backend's are rejected. The winner is
+#  stored per resolution in a per-host JSON file, which volumerender_cli reads
+#  when --backend is not given:
+#
+#      python volumerender_cli.py autotune -N 180
+#      python volumerender_cli.py render -N 180     # uses the tuned backend
+#
+#  Like volumerender_cli, this module imports only the standard library up
+#  front, so reading the tuning costs nothing.
+
+## Optional accelerator packages that are probed and reported.
+ACCELERATORS = ('numba', 'torch')
+
+
+## @brief Per-host tuning file.
+#  @return $VOLUMERENDER_TUNING, or ~/.config/volumerender/tuning-<host>.json.
+def tuning_file():
+	if os.environ.get('VOLUMERENDER_TUNING'):
+		return os.environ['VOLUMERENDER_TUNING']
+	return os.path.join(os.path.expanduser('~'), '.config', 'volumerender', 'tuning-' + socket.gethostname() + '.json')
+
+
+## @brief Tuned configuration for a resolution.
+#  @param N Image resolution.
+#  @param filename Tuning file, defaults to tuning_file().
+#  @return Entry with 'backend' and 'options' for the tuned resolution closest to N, or None.
+def load_tuning(N, filename=None):
+	try:
+		with open(filename or tuning_file()) as f:
+			entries = json.load(f)['entries']
+	except (OSError, ValueError, KeyError):
+		return None
+	if not entries:
+		return None
+	closest = min(entries, key=lambda key: abs(int(key) - N))
+	return entries[closest]
+
+
+## @brief Stores the tuned configuration of a resolution, keeping the others.
+#  @param N Image resolution.
+#  @param entry Entry from calibrate().
+#  @param filename Tuning file, defaults to tuning_file().
+def save_tuning(N, entry, filename=None):
+	filename = filename or tuning_file()
+	try:
+		with open(filename) as f:
+			tuning = json.load(f)
+	except (OSError, ValueError):
+		tuning = {}
+	tuning['host'] = socket.gethostname()
+	tuning.setdefault('entries', {})[str(N)] = entry
+	directory = os.path.dirname(filename)
+	if directory:
+		os.makedirs(directory, exist_ok=True)
+	with open(filename + '.part', 'w') as f:
+		json.dump(tuning, f, indent=1)
+	os.replace(filename + '.part', filename)
+
+
+## @brief Availability of the optional accelerator packages.
+#  No backend in this tree uses them yet; they are reported so a tuning file
+#  records what the host could offer.
+#  @return Dict of package name to 'installed' or 'not installed'.
+def accelerators():
+	return {name: 'installed' if importlib.util.find_spec(name) else 'not installed' for name in ACCELERATORS}
+
+
+def _powers_of_two(limit):
+	return [1 << k for k in range(limit.bit_length())]
+
+
+## @brief Candidate configurations for a resolution.
+#  The numpy backend is tried with 1, 2, 4, ... slab sampler threads and with
+#  clipped rays instead of the slab path. The vectorized backend is left out:
+#  it resamples with interpn on the unclipped grid, so its images never match
+#  the numpy backend's closely enough to be accepted.
+#  @param N Image resolution.
+#  @param cpus Number of CPUs, defaults to os.cpu_count().
+#  @return List of (backend, options) with options named like the CLI arguments.
+def candidates(N, cpus=None):
+	cpus = min(cpus or os.cpu_count() or 1, 16)
+	configs = [('numpy', {'workers': workers}) for workers in _powers_of_two(cpus)]
+	configs += [('numpy', {'path': 'clip'})]
+	configs += [('bricks', {'brick': brick}) for brick in (32, 64, 128) if brick < N] or [('bricks', {'brick': max(2, N//2)})]
+	configs += [('distributed', {'processes': processes}) for processes in _powers_of_two(cpus)]
+	return configs
+
+
+## @brief Smooth synthetic density cube spanning the transfer function's bands.
+#  @param size Cube side in voxels.
+#  @return float64 array of shape (size, size, size).
+def synthetic_cube(size):
+	import numpy as np
+
+	x = np.linspace(-np.pi, np.pi, size)
+	X, Y, Z = np.meshgrid(x, x, x, indexing='ij')
+	return np.exp(3.0 + 6.0*np.sin(2*X)*np.cos(1.5*Y) + 2.0*np.sin(Z))
+
+
+## @brief Times every candidate on a synthetic cube and picks the fastest correct one.
+#  The cube is N*sqrt(2) voxels wide, like datacube.hdf5 (256) for N=180, so
+#  every view of main() lies inside it.
+#  @param N Image resolution to tune for.
+#  @param frames Calibration frames per candidate (orbit about x).
+#  @param configs Candidates from candidates(), by default all of them.
+#  @param tolerance Largest accepted difference from the numpy backend's images.
+#  @param method Interpolation method.
+#  @return Entry with the chosen 'backend' and 'options', and every candidate's result.
+def calibrate(N=180, frames=2, configs=None, tolerance=1e-4, method='linear'):
+	import numpy as np
+	import h5py as h5
+	from timeit import default_timer as timer
+	from volumerender_camera import orbit
+	from volumerender_cli import make_renderer, BACKEND_DEFAULTS
+
+	configs = configs or candidates(N)
+	cameras = orbit(frames, width=N)
+	results = []
+	reference = None
+
+	with tempfile.TemporaryDirectory(prefix='volumerender_') as directory:
+		filename = os.path.join(directory, 'synthetic.hdf5')
+		with h5.File(filename, 'w') as f:
+			f['density'] = synthetic_cube(int(np.ceil(N*np.sqrt(2))) + 1)
+
+		for backend, options in [('numpy', {})] + [config for config in configs if config != ('numpy', {})]:
+			args = argparse.Namespace(input=filename, dataset='density', method=method, backend=backend, N=N,
+			                          shading=False, box=None, **BACKEND_DEFAULTS)
+			vars(args).update(options)
+			result = {'backend': backend, 'options': options}
+			try:
+				start = timer()
+				renderer = make_renderer(args)
+				result['setup'] = timer() - start
+				seconds = []
+				images = []
+				for camera in cameras:
+					start = timer()
+					images.append(renderer(camera))
+					seconds.append(timer() - start)
+			except Exception as error:
+				result['error'] = repr(error)
+				print(f"{backend} {options}: failed, {error!r}")
+				results.append(result)
+				continue
+
+			result['seconds'] = float(np.mean(seconds))
+			if reference is None:
+				reference = images
+			result['error_max'] = float(max(np.max(np.abs(image - expected)) for image, expected in zip(images, reference)))
+			result['accepted'] = result['error_max'] <= tolerance
+			print(f"{backend} {options}: {result['seconds']:.4f} s per frame, setup {result['setup']:.4f} s, "
+			      f"max difference {result['error_max']:.3g}" + ('' if result['accepted'] else ' (rejected)'))
+			results.append(result)
+
+	best = min((r for r in results if r.get('accepted')), key=lambda r: r['seconds'])
+	return {'backend': best['backend'], 'options': best['options'], 'seconds': best['seconds'], 'N': N,
+	        'frames': frames, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+	        'cpus': os.cpu_count(), 'accelerators': accelerators(), 'candidates': results}
+
+
+## @brief Tunes a resolution and stores the result.
+#  @param N Image resolution.
+#  @param frames Calibration frames per candidate.
+#  @param filename Tuning file, defaults to tuning_file().
+#  @return Entry from calibrate().
+def main(N=180, frames=2, filename=None):
+	""" Volume Rendering """
+
+	entry = calibrate(N, frames)
+	save_tuning(N, entry, filename)
+	print(f"Best for N={N}: {entry['backend']} {entry['options']} ({entry['seconds']:.4f} s per frame)")
+	print(f"Accelerators: {entry['accelerators']}")
+	print(f"Saved to {filename or tuning_file()}")
+	return entry
+
+if __name__== "__main__":
+	main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,285 @@
+# Out-of-core Brick Streaming
+import queue
+import threading
+import numpy as np
+import h5py as h5
+from timeit import default_timer as timer
+from volumerender_core import transferFunction, datacube_points, grid_index, sample, save_image
+from volumerender_camera import orbit
+from volumerender_clip import ray_box_intersection, clip_bounds
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_bricks
+#  Renders datacubes that do not fit in memory. f['density'] is split into
+#  bricks that are sorted front to back for the camera and streamed from the
+#  HDF5 file by a prefetch thread; each brick's samples are composited front to
+#  back into the image. Only the bricks in flight are resident, however large
+#  the volume is.
+
+
+## @brief Splits a volume into bricks.
+#  Bricks partition the cells of the grid; each one also holds the shared layer
+#  of voxels on its upper faces, so trilinear interpolation never leaves it.
+#  @param shape Shape (Nx, Ny, Nz) of the datacube.
+#  @param brick Brick edge length in cells.
+#  @return List of ((i0, j0, k0), (i1, j1, k1)) inclusive voxel ranges.
+def brick_grid(shape, brick=64):
+	starts = [range(0, max(n-1, 1), brick) for n in shape]
+	bricks = []
+	for i0 in starts[0]:
+		for j0 in starts[1]:
+			for k0 in starts[2]:
+				lo = (i0, j0, k0)
+				hi = tuple(min(s + brick, n - 1) for s, n in zip(lo, shape))
+				bricks.append((lo, hi))
+	return bricks
+
+
+## @brief World-space box of a brick on the datacube_points() grid.
+#  @param lo Lower voxel index of the brick.
+#  @param hi Upper voxel index of the brick (inclusive).
+#  @param shape Shape of the datacube.
+#  @return Tuple (lo, hi) of box corners.
+def brick_box(lo, hi, shape):
+	n = np.array(shape, dtype=np.float64)
+	spacing = n/(n-1)
+	return -n/2 + np.array(lo)*spacing, -n/2 + np.array(hi)*spacing
+
+
+## @brief Which sample positions fall in the cells of a brick.
+#  A brick owns the cells from lo up to hi; the upper face is only owned where
+#  it is also the face of the volume, so every sample has exactly one owner.
+#  @param u Fractional voxel indices of shape (3, M) from grid_index().
+#  @param lo Lower voxel index of the brick.
+#  @param hi Upper voxel index of the brick (inclusive).
+#  @param shape Shape of the datacube.
+#  @return Boolean array of shape (3, M), per axis.
+def owns(u, lo, hi, shape):
+	lo = np.array(lo)[:,np.newaxis]
+	hi = np.array(hi)[:,np.newaxis]
+	last = (np.array(shape) - 1)[:,np.newaxis]
+	return (u >= lo) & ((u < hi) | ((hi == last) & (u <= hi)))
+
+
+## @brief Bricks hit by a camera, ordered front to back.
+#  Bricks are sorted by the depth of their centre along the view direction
+#  (exact for orthographic cameras), or by distance from the eye in perspective.
+#  @param camera Camera from volumerender_camera.
+#  @param shape Shape of the datacube.
+#  @param brick Brick edge length in cells.
+#  @param box World-space clipping box (lo, hi); bricks outside it are left out.
+#  @return List of (lo, hi) brick ranges.
+def visible_bricks(camera, shape, brick=64, box=None):
+	origins, directions, t_near, t_far = camera.rays()
+	clip_lo, clip_hi = clip_bounds(shape, box)
+	visible = []
+	for lo, hi in brick_grid(shape, brick):
+		box_lo, box_hi = brick_box(lo, hi, shape)
+		if np.any(np.maximum(box_lo, clip_lo) > np.minimum(box_hi, clip_hi)):
+			continue
+		t_enter, t_exit = ray_box_intersection(origins, directions, np.maximum(box_lo, clip_lo), np.minimum(box_hi, clip_hi))
+		if np.any(np.maximum(t_enter, t_near) <= np.minimum(t_exit, t_far)):
+			centre = (box_lo + box_hi)/2
+			if camera.perspective:
+				depth = np.linalg.norm(centre - origins[0,0])
+			else:
+				depth = np.dot(centre, directions[0,0])
+			visible.append((depth, lo, hi))
+	visible.sort(key=lambda item: item[0])
+	return [(lo, hi) for _, lo, hi in visible]
+
+
+## @brief Reads bricks from an HDF5 dataset in a background thread.
+#  At most `prefetch` bricks wait in the queue, so the reader never gets more
+#  than that far ahead of the renderer. Use it as a context manager (or call
+#  close()) so the thread stops and closes the file when rendering stops early.
+class BrickReader:
+	## @brief Starts reading.
+	#  @param filename HDF5 file.
+	#  @param dataset Dataset name.
+	#  @param bricks Brick ranges in the order they will be consumed.
+	#  @param prefetch Number of bricks read ahead.
+	def __init__(self, filename, dataset, bricks, prefetch=2):
+		self.queue = queue.Queue(maxsize=max(1, prefetch))
+		self.stop = threading.Event()
+		self.thread = threading.Thread(target=self._run, args=(filename, dataset, bricks), daemon=True)
+		self.thread.start()
+
+	def _put(self, item):
+		while not self.stop.is_set():
+			try:
+				self.queue.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def _run(self, filename, dataset, bricks):
+		try:
+			with h5.File(filename, 'r') as f:
+				dset = f[dataset]
+				for lo, hi in bricks:
+					data = dset[lo[0]:hi[0]+1, lo[1]:hi[1]+1, lo[2]:hi[2]+1]
+					if not self._put((lo, hi, data)):
+						return
+		except Exception as error:
+			self._put(error)
+			return
+		self._put(None)
+
+	def __iter__(self):
+		while True:
+			item = self.queue.get()
+			if item is None:
+				return
+			if isinstance(item, Exception):
+				raise item
+			yield item
+
+	## @brief Stops the reader, drops the bricks read ahead and waits for the file to close.
+	def close(self):
+		self.stop.set()
+		while self.thread.is_alive():
+			try:
+				while True:
+					self.queue.get_nowait()
+			except queue.Empty:
+				pass
+			self.thread.join(0.1)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+## @brief Composites one brick's samples front to back.
+#  @param C Accumulated premultiplied RGB of shape (height, width, 3), updated in place.
+#  @param T Transmittance of shape (height, width), updated in place.
+#  @param camera Camera from volumerender_camera.
+#  @param data Brick densities, including the shared upper layer.
+#  @param lo Lower voxel index of the brick.
+#  @param hi Upper voxel index of the brick (inclusive).
+#  @param shape Shape of the whole datacube.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param transfer Transfer function mapping log-density to RGBA.
+#  @param box World-space clipping box (lo, hi); samples outside it are transparent.
+def composite_brick(C, T, camera, data, lo, hi, shape, interpolationMethod='linear', transfer=transferFunction, box=None):
+	origins, directions, t_near, t_far = camera.rays()
+	box_lo, box_hi = brick_box(lo, hi, shape)
+	pad = 1e-6*np.max(np.abs(box_hi - box_lo))
+	box_lo, box_hi = box_lo - pad, box_hi + pad
+	if box is not None:
+		clip_lo, clip_hi = clip_bounds(shape, box)
+		box_lo, box_hi = np.maximum(box_lo, clip_lo), np.minimum(box_hi, clip_hi)
+	t_enter, t_exit = ray_box_intersection(origins, directions, box_lo, box_hi)
+	t_enter = np.maximum(t_enter, t_near)
+	t_exit = np.minimum(t_exit, t_far)
+	hit = t_enter <= t_exit
+	if not np.any(hit):
+		return
+
+	# Sample k sits at t_near + (1 - k/(Nsteps-1))*(t_far - t_near); walk k downwards (front to back)
+	span = (t_far - t_near).astype(np.float64)
+	last = camera.Nsteps - 1
+	k_front = np.ceil(((1 - (t_enter - t_near)/span)*last)[hit].max())
+	k_back = np.floor(((1 - (t_exit - t_near)/span)*last)[hit].min())
+	ks = np.arange(min(int(k_front), last), max(int(k_back), 0) - 1, -1)
+	if len(ks) == 0:
+		return
+	t = t_near + (1 - ks[:,np.newaxis,np.newaxis]/last)*span
+	candidate = hit & (t >= t_enter) & (t <= t_exit)
+
+	_, i, j = np.nonzero(candidate)
+	qi = origins[i,j] + t[candidate][:,np.newaxis]*directions[i,j]
+
+	# Keep the samples whose cell belongs to this brick, so shared faces are sampled once
+	u = grid_index(np.clip(qi, *brick_box((0,0,0), tuple(n-1 for n in shape), shape)), shape)
+	owned = np.all(owns(u, lo, hi, shape), axis=0)
+	candidate[candidate] = owned
+	qi = qi[owned]
+	if len(qi) == 0:
+		return
+
+	points = tuple(axis[l:h+1] for axis, l, h in zip(datacube_points(shape), lo, hi))
+	values = sample(points, data, np.clip(qi, [p[0] for p in points], [p[-1] for p in points]), (len(qi),), interpolationMethod)
+	with np.errstate(divide='ignore'):
+		r,g,b,a = transfer(np.log(values))
+
+	# np.nonzero walks the mask in C order, i.e. front-most k first
+	offsets = np.concatenate([[0], np.cumsum(candidate.sum(axis=(1,2)))])
+	for n in range(len(ks)):
+		s = slice(offsets[n], offsets[n+1])
+		if s.start == s.stop:
+			continue
+		_, pi, pj = np.nonzero(candidate[n:n+1])
+		weight = T[pi,pj]*a[s]
+		C[pi,pj,0] += weight*r[s]
+		C[pi,pj,1] += weight*g[s]
+		C[pi,pj,2] += weight*b[s]
+		T[pi,pj] *= 1 - a[s]
+
+
+## @brief Renders one view by streaming bricks from the HDF5 file.
+#  Samples outside the volume are transparent, as in volumerender_clip.
+#  @param filename HDF5 file.
+#  @param camera Camera from volumerender_camera.
+#  @param dataset Dataset name.
+#  @param brick Brick edge length in cells.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param prefetch Number of bricks read ahead by the reader thread.
+#  @param transfer Transfer function mapping log-density to RGBA.
+#  @param box World-space clipping box (lo, hi); only the bricks it overlaps are read.
+#  @return RGB image of shape (height, width, 3).
+def render_streamed(filename, camera, dataset='density', brick=64, interpolationMethod='linear', prefetch=2, transfer=transferFunction, box=None):
+	with h5.File(filename, 'r') as f:
+		shape = f[dataset].shape
+
+	C = np.zeros((camera.height, camera.width, 3))
+	T = np.ones((camera.height, camera.width))
+	bricks = visible_bricks(camera, shape, brick, box)
+	with BrickReader(filename, dataset, bricks, prefetch) as reader:
+		for lo, hi, data in reader:
+			composite_brick(C, T, camera, data, lo, hi, shape, interpolationMethod, transfer, box)
+	return C
+
+
+## @brief Volume rendering streamed brick by brick from datacube.hdf5.
+#  @param Nangles Number of angles for camera rotation.
+#  @param N Image resolution (pixels per side).
+#  @param brick Brick edge length in cells.
+#  @param interpolationMethod Method used for data interpolation.
+#  @return Total rendering time in seconds.
+def main(Nangles=10, N=180, brick=64, interpolationMethod='linear'):
+	""" Volume Rendering """
+
+	average = np.zeros(Nangles)
+
+	for i, camera in enumerate(orbit(Nangles, width=N)):
+		print('Rendering Scene ' + str(i+1) + ' of ' + str(Nangles) + '.\n')
+		start = timer()
+
+		image = render_streamed('datacube.hdf5', camera, brick=brick, interpolationMethod=interpolationMethod)
+
+		end = timer()
+		print(f"Time to render scene {i+1}: {end - start} seconds")
+		average[i] = end - start
+
+		save_image(image, 'volumerender' + str(i) + '.png')
+
+	print(f"Mean rendering time: {np.mean(average)} seconds")
+	print(f"Standard deviation of rendering time: {np.std(average)} seconds")
+	print(f"Max rendering time: {np.max(average)} seconds")
+	print(f"Min rendering time: {np.min(average)} seconds")
+
+	return np.sum(average)
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,255 @@
+# General Camera Model
+import numpy as np
+from timeit import default_timer as timer
+from volumerender_core import load_datacube, composite, save_image
+from volumerender_slab import is_x_rotation, sample_slabs
+from volumerender_clip import inside_volume, sample_clipped
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_camera
+#  Camera with an arbitrary orientation (unit quaternion), orthographic or
+#  perspective projection and an image size independent of the number of
+#  samples per ray. Ray parameters are precomputed per pixel as float32 arrays.
+#
+#  Camera frame: image rows run along local x, image columns along local z and
+#  the viewer sits on the +y side looking towards -y. The identity camera with
+#  width=N, Nsteps=N reproduces the camera grid of main() at angle 0.
+
+
+## @brief Unit quaternions (w, x, y, z) for rotations about an axis.
+#  @param axis Rotation axis (3 components).
+#  @param angles Scalar or array of angles in radians.
+#  @return Array of shape angles.shape + (4,).
+def quaternion_axis_angle(axis, angles):
+	axis = np.asarray(axis, dtype=np.float64)
+	axis = axis / np.linalg.norm(axis)
+	half = 0.5*np.asarray(angles, dtype=np.float64)
+	return np.concatenate([np.cos(half)[...,np.newaxis], np.sin(half)[...,np.newaxis]*axis], axis=-1)
+
+
+## @brief Hamilton product of (batches of) quaternions.
+#  @param p Quaternions of shape (..., 4).
+#  @param q Quaternions of shape (..., 4).
+#  @return p*q of shape (..., 4).
+def quaternion_multiply(p, q):
+	pw, px, py, pz = np.moveaxis(np.asarray(p, dtype=np.float64), -1, 0)
+	qw, qx, qy, qz = np.moveaxis(np.asarray(q, dtype=np.float64), -1, 0)
+	return np.stack([pw*qw - px*qx - py*qy - pz*qz,
+	                 pw*qx + px*qw + py*qz - pz*qy,
+	                 pw*qy - px*qz + py*qw + pz*qx,
+	                 pw*qz + px*qy - py*qx + pz*qw], axis=-1)
+
+
+## @brief Rotation matrices of (batches of) quaternions.
+#  @param q Quaternions of shape (..., 4), normalised on the fly.
+#  @return Matrices of shape (..., 3, 3).
+def quaternion_to_matrix(q):
+	q = np.asarray(q, dtype=np.float64)
+	q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+	w, x, y, z = np.moveaxis(q, -1, 0)
+	R = np.stack([1 - 2*(y*y + z*z), 2*(x*y - w*z),     2*(x*z + w*y),
+	              2*(x*y + w*z),     1 - 2*(x*x + z*z), 2*(y*z - w*x),
+	              2*(x*z - w*y),     2*(y*z + w*x),     1 - 2*(x*x + y*y)], axis=-1)
+	return R.reshape(q.shape[:-1] + (3, 3))
+
+
+class Camera:
+	## @brief Creates a camera.
+	#  @param orientation Unit quaternion (w, x, y, z) rotating the camera frame into the volume.
+	#  @param width Image width in pixels (columns).
+	#  @param height Image height in pixels (rows), defaults to width.
+	#  @param Nsteps Samples per ray, defaults to width.
+	#  @param extent World size covered by the image rows, defaults to height (one voxel per pixel).
+	#  @param depth World length of the sampled ray segment, defaults to extent.
+	#  @param fov Vertical field of view in degrees, None for orthographic.
+	#  @param distance Distance of the eye from the centre (perspective only), defaults to 2*extent.
+	#  @param window Pixel window (row0, row1, col0, col1) of the height x width image to
+	#  render, or None for all of it. Only the window's rays are generated; width and
+	#  height become the window's size and frame keeps the full image's.
+	def __init__(self, orientation=(1.0, 0.0, 0.0, 0.0), width=180, height=None, Nsteps=None, extent=None, depth=None, fov=None, distance=None, window=None):
+		q = np.asarray(orientation, dtype=np.float64)
+		self.orientation = q / np.linalg.norm(q)
+		self.width = int(width)
+		self.height = int(width if height is None else height)
+		self.Nsteps = int(self.width if Nsteps is None else Nsteps)
+		self.extent = float(self.height if extent is None else extent)
+		self.depth = float(self.extent if depth is None else depth)
+		self.fov = fov
+		self.distance = float(2*self.extent if distance is None else distance)
+		## Size (height, width) of the full image.
+		self.frame = (self.height, self.width)
+		self.window = None
+		if window is not None:
+			row0, row1, col0, col1 = (int(w) for w in window)
+			if not (0 <= row0 < row1 <= self.height and 0 <= col0 < col1 <= self.width):
+				raise ValueError("window " + str(tuple(window)) + " is empty or outside the " + str(self.frame) + " image")
+			self.window = (row0, row1, col0, col1)
+			self.height = row1 - row0
+			self.width = col1 - col0
+		self._rays = None
+
+	## @brief Creates the camera main() uses for a given angle about x.
+	#  @param angle Rotation angle in radians.
+	#  @param N Image resolution and samples per ray.
+	#  @return Camera.
+	@classmethod
+	def from_angle(cls, angle, N=180, **kwargs):
+		return cls(quaternion_axis_angle((1.0, 0.0, 0.0), angle), width=N, **kwargs)
+
+	## @brief The same camera restricted to a pixel window of the full image.
+	#  @param window Pixel window (row0, row1, col0, col1) of the full image, or None.
+	#  @return Camera.
+	def cropped(self, window):
+		height, width = self.frame
+		return Camera(self.orientation, width, height, self.Nsteps, self.extent, self.depth, self.fov, self.distance, window)
+
+	## @brief Rotation matrix of the camera.
+	@property
+	def matrix(self):
+		return quaternion_to_matrix(self.orientation)
+
+	## @brief True for a perspective camera.
+	@property
+	def perspective(self):
+		return self.fov is not None
+
+	## @brief Shape (Nsteps, height, width) of the camera grid.
+	@property
+	def shape(self):
+		return (self.Nsteps, self.height, self.width)
+
+	## @brief Per-pixel ray parameters, computed once and cached.
+	#  Samples of a ray are origin + t*direction for t in [t_near, t_far].
+	#  @return Tuple (origins, directions, t_near, t_far) of float32 arrays with
+	#  shapes (height, width, 3), (height, width, 3), (height, width), (height, width).
+	def rays(self):
+		if self._rays is not None:
+			return self._rays
+
+		R = self.matrix
+		height, width = self.frame
+		row0, row1, col0, col1 = self.window or (0, height, 0, width)
+		half_w = self.extent/2 * width/height
+		u = np.linspace(-self.extent/2, self.extent/2, height)[row0:row1]
+		v = np.linspace(-half_w, half_w, width)[col0:col1]
+		lu, lv = np.meshgrid(u, v, indexing='ij')
+
+		if self.perspective:
+			scale = np.tan(np.radians(self.fov)/2) / (self.extent/2)
+			local = np.stack([lu*scale, -np.ones_like(lu), lv*scale], axis=-1)
+			local /= np.linalg.norm(local, axis=-1, keepdims=True)
+			directions = local @ R.T
+			origins = np.broadcast_to(R[:,1]*self.distance, directions.shape)
+			# Depth range measured along the optical axis
+			cos = -local[...,1]
+			t_near = (self.distance - self.depth/2) / cos
+			t_far = (self.distance + self.depth/2) / cos
+		else:
+			local = np.stack([lu, np.full_like(lu, self.depth/2), lv], axis=-1)
+			origins = local @ R.T
+			directions = np.broadcast_to(-R[:,1], origins.shape)
+			t_near = np.zeros(lu.shape)
+			t_far = np.full(lu.shape, self.depth)
+
+		self._rays = (np.ascontiguousarray(origins, dtype=np.float32),
+		              np.ascontiguousarray(directions, dtype=np.float32),
+		              t_near.astype(np.float32),
+		              t_far.astype(np.float32))
+		return self._rays
+
+	## @brief Query points of the camera grid, back to front along axis 0.
+	#  @return Query points of shape (Nsteps*height*width, 3).
+	def points(self):
+		origins, directions, t_near, t_far = self.rays()
+		k = np.linspace(1.0, 0.0, self.Nsteps)[:,np.newaxis,np.newaxis]
+		t = t_near + k*(t_far.astype(np.float64) - t_near)
+		qi = origins + t[...,np.newaxis]*directions
+		return qi.reshape((-1, 3))
+
+
+## @brief Cameras orbiting about an axis, generated in one batch.
+#  The defaults reproduce the views of main(): angle = pi/2 * i / Nangles about x.
+#  @param Nframes Number of cameras.
+#  @param axis Orbit axis.
+#  @param start First angle in radians.
+#  @param stop Last angle in radians (excluded).
+#  @param base Orientation the orbit is applied to.
+#  @param kwargs Further Camera arguments (width, Nsteps, fov, ...).
+#  @return List of Cameras.
+def orbit(Nframes, axis=(1.0, 0.0, 0.0), start=0.0, stop=np.pi/2, base=(1.0, 0.0, 0.0, 0.0), **kwargs):
+	angles = np.linspace(start, stop, Nframes, endpoint=False)
+	orientations = quaternion_multiply(quaternion_axis_angle(axis, angles), base)
+	return [Camera(q, **kwargs) for q in orientations]
+
+
+## @brief Checks whether a camera can use the per-slab fast path.
+#  That is an orthographic camera rotating about x with the default framing,
+#  whose whole grid lies inside the volume.
+#  @param camera Camera.
+#  @param shape Shape of the datacube.
+#  @param interpolationMethod Method used for data interpolation.
+#  @return True if sample_slabs() applies.
+def uses_slab_path(camera, shape, interpolationMethod='linear'):
+	standard = camera.window is None and camera.width == camera.height and camera.extent == camera.width \
+		and camera.depth == camera.extent
+	return not camera.perspective and standard and interpolationMethod in ('nearest', 'linear') \
+		and is_x_rotation(camera.matrix, 1e-9) and inside_volume(camera, shape)
+
+
+## @brief Resamples the datacube onto a camera grid.
+#  Uses the per-slab fast path where it applies; every other camera is
+#  clipped to the volume and samples outside it are transparent.
+#  @param datacube The density datacube.
+#  @param camera Camera.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param workers Number of threads of the per-slab path, defaults to os.cpu_count().
+#  @param path 'slab' to use the per-slab path where it applies, 'clip' to always clip.
+#  @return Camera grid of shape camera.shape, back to front along axis 0.
+def sample_camera(datacube, camera, interpolationMethod='linear', workers=None, path='slab'):
+	if path not in ('slab', 'clip'):
+		raise ValueError("path must be 'slab' or 'clip', got " + repr(path))
+	if path == 'slab' and uses_slab_path(camera, datacube.shape, interpolationMethod):
+		return sample_slabs(datacube, camera.matrix, camera.width, camera.Nsteps, interpolationMethod, workers)
+	return sample_clipped(datacube, camera, interpolationMethod)
+
+
+## @brief Volume rendering along a batch of cameras.
+#  @param cameras List of Cameras, defaults to the orbit of main().
+#  @param interpolationMethod Method used for data interpolation.
+#  @return Total rendering time in seconds.
+def main(cameras=None, interpolationMethod='linear'):
+	""" Volume Rendering """
+
+	datacube = load_datacube()
+	if cameras is None:
+		cameras = orbit(10, width=180)
+
+	average = np.zeros(len(cameras))
+
+	for i, camera in enumerate(cameras):
+		print('Rendering Scene ' + str(i+1) + ' of ' + str(len(cameras)) + '.\n')
+		start = timer()
+
+		image = composite(sample_camera(datacube, camera, interpolationMethod))
+
+		end = timer()
+		print(f"Time to render scene {i+1}: {end - start} seconds")
+		average[i] = end - start
+
+		save_image(image, 'volumerender' + str(i) + '.png')
+
+	print(f"Mean rendering time: {np.mean(average)} seconds")
+	print(f"Standard deviation of rendering time: {np.std(average)} seconds")
+	print(f"Max rendering time: {np.max(average)} seconds")
+	print(f"Min rendering time: {np.min(average)} seconds")
+
+	return np.sum(average)
+
+if __name__== "__main__":
+	main()
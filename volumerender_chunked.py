@@ -0,0 +1,240 @@
+# Chunked Compressed Datacubes
+import os
+import zlib
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_chunked
+#  Converts datacube.hdf5 into a chunked, compressed copy and reads it back in
+#  parallel. Chunks are cubes aligned with the bricks of volumerender_bricks
+#  (64 cells by default), and the minimum and maximum of every chunk are stored
+#  next to the dataset as <dataset>_chunk_min and <dataset>_chunk_max.
+#
+#  For gzip (with or without shuffle) the reader fetches the raw chunks with
+#  read_direct_chunk and inflates them in a thread pool; zlib releases the GIL,
+#  so decompression runs in parallel and writes straight into the output
+#  buffer. Other filters (lzf, blosc, zstd) are decoded by HDF5 one chunk at a
+#  time. load_datacube() uses this reader for any chunked dataset.
+
+## Compression filters accepted by convert(); 'blosc' and 'zstd' need the hdf5plugin package.
+COMPRESSIONS = ('gzip', 'lzf', 'blosc', 'zstd')
+
+# HDF5 filters the reader decodes itself
+_FILTER_DEFLATE = 1
+_FILTER_SHUFFLE = 2
+
+
+## @brief Dataset creation options of a compression filter.
+#  @param compression One of COMPRESSIONS, or None for no compression.
+#  @param level Compression level, or None for the filter's default.
+#  @return Keyword arguments for h5py's create_dataset.
+#  @throws ImportError if blosc or zstd is requested without hdf5plugin.
+def compression_options(compression='gzip', level=None):
+	if compression is None:
+		return {}
+	if compression == 'gzip':
+		return {'compression': 'gzip', 'compression_opts': 4 if level is None else level, 'shuffle': True}
+	if compression == 'lzf':
+		return {'compression': 'lzf', 'shuffle': True}
+	if compression in ('blosc', 'zstd'):
+		try:
+			import hdf5plugin
+		except ImportError:
+			raise ImportError(compression + " compression needs the hdf5plugin package") from None
+		if compression == 'blosc':
+			return dict(hdf5plugin.Blosc(cname='zstd', clevel=5 if level is None else level, shuffle=hdf5plugin.Blosc.SHUFFLE))
+		return dict(hdf5plugin.Zstd(clevel=3 if level is None else level))
+	raise ValueError("unknown compression " + repr(compression) + ", expected one of " + str(COMPRESSIONS))
+
+
+## @brief Compressions usable here.
+#  @return Tuple of the COMPRESSIONS entries whose filters are available.
+def available_compressions():
+	available = []
+	for compression in COMPRESSIONS:
+		try:
+			compression_options(compression)
+		except ImportError:
+			continue
+		available.append(compression)
+	return tuple(available)
+
+
+## @brief Slices of the chunks of a dataset.
+#  @param shape Dataset shape.
+#  @param chunks Chunk shape.
+#  @return List of tuples of slices, in C order of the chunks.
+def chunk_slices(shape, chunks):
+	starts = np.meshgrid(*[np.arange(0, n, c) for n, c in zip(shape, chunks)], indexing='ij')
+	return [tuple(slice(s, min(s + c, n)) for s, c, n in zip(start, chunks, shape))
+	        for start in zip(*[s.ravel() for s in starts])]
+
+
+## @brief Writes a chunked, compressed copy of a dataset.
+#  The source is read one layer of chunks at a time.
+#  @param source Source HDF5 file.
+#  @param destination HDF5 file to create.
+#  @param dataset Dataset name.
+#  @param chunk Chunk edge length in voxels.
+#  @param compression One of COMPRESSIONS, or None.
+#  @param level Compression level, or None for the filter's default.
+#  @return Tuple (chunk_min, chunk_max) of per-chunk extrema, also stored in the file.
+def convert(source, destination, dataset='density', chunk=64, compression='gzip', level=None):
+	import h5py as h5
+
+	options = compression_options(compression, level)
+	with h5.File(source, 'r') as fin, h5.File(destination, 'w') as fout:
+		src = fin[dataset]
+		shape = src.shape
+		chunks = tuple(min(chunk, n) for n in shape)
+		grid = tuple(-(-n // c) for n, c in zip(shape, chunks))
+		dst = fout.create_dataset(dataset, shape, dtype=src.dtype, chunks=chunks, **options)
+		chunk_min = np.empty(grid, dtype=src.dtype)
+		chunk_max = np.empty(grid, dtype=src.dtype)
+
+		starts = [np.arange(0, n, c) for n, c in zip(shape[1:], chunks[1:])]
+		for ci in range(grid[0]):
+			layer = slice(ci*chunks[0], min((ci+1)*chunks[0], shape[0]))
+			data = src[layer]
+			dst[layer] = data
+			for reduce, out in ((np.minimum, chunk_min), (np.maximum, chunk_max)):
+				plane = reduce.reduce(data, axis=0)
+				out[ci] = reduce.reduceat(reduce.reduceat(plane, starts[0], axis=0), starts[1], axis=1)
+
+		fout[dataset + '_chunk_min'] = chunk_min
+		fout[dataset + '_chunk_max'] = chunk_max
+	return chunk_min, chunk_max
+
+
+## @brief Per-chunk extrema stored by convert().
+#  @param filename HDF5 file.
+#  @param dataset Dataset name.
+#  @return Tuple (chunk_min, chunk_max, chunks) where chunks is the chunk shape.
+def chunk_ranges(filename, dataset='density'):
+	import h5py as h5
+
+	with h5.File(filename, 'r') as f:
+		return f[dataset + '_chunk_min'][()], f[dataset + '_chunk_max'][()], f[dataset].chunks
+
+
+# Filter codes of a dataset's pipeline if the reader can decode them all, else None
+def _pipeline(dset):
+	plist = dset.id.get_create_plist()
+	filters = [plist.get_filter(i)[0] for i in range(plist.get_nfilters())]
+	if all(code in (_FILTER_DEFLATE, _FILTER_SHUFFLE) for code in filters):
+		return filters
+	return None
+
+
+# Undoes the filters of one raw chunk
+def _decode(raw, filter_mask, filters, dtype, chunks):
+	for index in reversed(range(len(filters))):
+		if filter_mask & (1 << index):
+			continue
+		if filters[index] == _FILTER_DEFLATE:
+			raw = zlib.decompress(raw)
+		else:
+			raw = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, -1).T.tobytes()
+	return np.frombuffer(raw, dtype=dtype).reshape(chunks)
+
+
+## @brief Reads a chunked dataset, decompressing chunks in parallel.
+#  @param dset Open h5py dataset.
+#  @param threads Number of threads, defaults to os.cpu_count().
+#  @param out Buffer of the dataset's shape and dtype to read into, or None to allocate one.
+#  @return The filled buffer.
+def read_dataset(dset, threads=None, out=None):
+	if out is None:
+		out = np.empty(dset.shape, dtype=dset.dtype)
+	elif out.shape != dset.shape or out.dtype != dset.dtype:
+		raise ValueError("out must have shape " + str(dset.shape) + " and dtype " + str(dset.dtype))
+	if dset.chunks is None:
+		dset.read_direct(out)
+		return out
+
+	filters = _pipeline(dset)
+	dtype = dset.dtype
+
+	def read_chunk(selection):
+		if filters is None:
+			dset.read_direct(out, selection, selection)
+			return
+		offset = tuple(s.start for s in selection)
+		if dset.id.get_chunk_info_by_coord(offset).byte_offset is None:
+			out[selection] = dset.fillvalue
+			return
+		filter_mask, raw = dset.id.read_direct_chunk(offset)
+		block = _decode(raw, filter_mask, filters, dtype, dset.chunks)
+		out[selection] = block[tuple(slice(0, s.stop - s.start) for s in selection)]
+
+	with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as pool:
+		for _ in pool.map(read_chunk, chunk_slices(dset.shape, dset.chunks)):
+			pass
+	return out
+
+
+## @brief Reads a chunked dataset from a file, decompressing chunks in parallel.
+#  @param filename HDF5 file.
+#  @param dataset Dataset name.
+#  @param threads Number of threads, defaults to os.cpu_count().
+#  @param out Buffer to read into, or None to allocate one.
+#  @return The datacube.
+def read_chunked(filename, dataset='density', threads=None, out=None):
+	import h5py as h5
+
+	with h5.File(filename, 'r') as f:
+		return read_dataset(f[dataset], threads, out)
+
+
+## @brief Converts datacube.hdf5 with every available compression and times the loads.
+#  @param filename Source HDF5 file.
+#  @param dataset Dataset name.
+#  @param chunk Chunk edge length in voxels.
+#  @param threads Number of reader threads, defaults to os.cpu_count().
+#  @return Dict of (file bytes, serial load seconds, parallel load seconds) per compression.
+def main(filename='datacube.hdf5', dataset='density', chunk=64, threads=None):
+	""" Volume Rendering """
+
+	import h5py as h5
+
+	start = timer()
+	with h5.File(filename, 'r') as f:
+		datacube = np.array(f[dataset])
+	print(f"{filename}: {os.path.getsize(filename)} bytes, monolithic load {timer() - start} seconds")
+	results = {}
+
+	with tempfile.TemporaryDirectory(prefix='volumerender_') as directory:
+		for compression in available_compressions():
+			converted = os.path.join(directory, compression + '.hdf5')
+			start = timer()
+			convert(filename, converted, dataset, chunk, compression)
+			print(f"{compression}: converted in {timer() - start} seconds")
+
+			start = timer()
+			read_chunked(converted, dataset, threads=1)
+			serial = timer() - start
+
+			out = np.empty_like(datacube)
+			start = timer()
+			read_chunked(converted, dataset, threads, out)
+			parallel = timer() - start
+
+			assert np.array_equal(out, datacube)
+			size = os.path.getsize(converted)
+			print(f"{compression}: {size} bytes ({size/os.path.getsize(filename):.2f} of the original), "
+			      f"load {serial} seconds on 1 thread, {parallel} seconds in parallel")
+			results[compression] = (size, serial, parallel)
+
+	return results
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,352 @@
+# Command-line Interface
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_cli
+#  Single entry point for the renderers:
+#
+#      python volumerender_cli.py render --angle 0.3 -N 180 --output view.png
+#      python volumerender_cli.py orbit --frames 10 --backend bricks
+#      python volumerender_cli.py project --mode max --angle 0.3
+#      python volumerender_cli.py bench --frames 3 --imports
+#      python volumerender_cli.py jobs manifest.json --workers 4
+#      python volumerender_cli.py autotune -N 180
+#      python volumerender_cli.py conformance -N 48
+#
+#  Only the standard library is imported up front. NumPy, the renderer
+#  modules and their backends (h5py, scipy, multiprocessing workers, ...) are
+#  imported when a subcommand needs them, so `--help` and argument errors
+#  return immediately. Without --backend, the configuration stored by
+#  `autotune` for this host (see volumerender_autotune) is used, else numpy.
+
+## Rendering backends, each implemented by an existing module.
+BACKENDS = ('numpy', 'bricks', 'distributed', 'vectorized')
+
+## Backend options and their defaults when neither the command line nor the tuning sets them.
+BACKEND_DEFAULTS = {'brick': 64, 'processes': 4, 'memory_budget': None, 'workers': None, 'path': 'slab'}
+
+## Modules whose import time `bench --imports` measures.
+IMPORT_BENCHMARK = ('volumerender_cli', 'volumerender_core', 'volumerender_camera', 'volumerender',
+                    'volumerender_vectorized', 'volumerender_projection', 'volumerender_server')
+
+
+## @brief Builds a renderer for the chosen backend.
+#  @param args Parsed arguments with input, dataset, N, method, backend, brick, processes,
+#  memory_budget, workers, path, shading and box.
+#  @return Function mapping a Camera to an RGB image.
+def make_renderer(args):
+	if args.shading:
+		if args.backend != 'numpy' or args.box is not None:
+			raise ValueError("--shading needs the numpy backend and no --box")
+		from volumerender_core import load_datacube
+		from volumerender_shading import load_gradient, render_shaded
+		datacube = load_datacube(args.input, args.dataset)
+		gradient = load_gradient(args.input, args.dataset, datacube)
+		return lambda camera: render_shaded(datacube, gradient, camera, args.method)
+	if args.backend == 'numpy' and args.box is not None:
+		from volumerender_core import load_datacube
+		from volumerender_clip import render_clipped
+		datacube = load_datacube(args.input, args.dataset)
+		return lambda camera: render_clipped(datacube, camera, args.method, box=args.box)
+	if args.backend == 'numpy':
+		from volumerender_core import load_datacube, composite
+		from volumerender_camera import sample_camera
+		datacube = load_datacube(args.input, args.dataset)
+		return lambda camera: composite(sample_camera(datacube, camera, args.method, args.workers, args.path))
+	if args.backend == 'bricks':
+		from volumerender_bricks import render_streamed
+		return lambda camera: render_streamed(args.input, camera, args.dataset, args.brick, args.method, box=args.box)
+	if args.box is not None:
+		raise ValueError("--box needs the numpy or bricks backend")
+	if args.backend == 'distributed':
+		from volumerender_distributed import render_distributed
+		return lambda camera: render_distributed(args.input, camera, args.processes, args.dataset, args.method)
+	if args.backend == 'vectorized':
+		return _vectorized_renderer(args)
+	raise ValueError("unknown backend " + repr(args.backend))
+
+
+def _vectorized_renderer(args):
+	import math
+	from volumerender_core import load_datacube, datacube_points
+	from volumerender_slab import is_x_rotation
+	from volumerender_vectorized import chunk_plan, make_buffers, render_view
+	datacube = load_datacube(args.input, args.dataset)
+	points = datacube_points(datacube.shape)
+	chunks = chunk_plan(args.N, args.memory_budget, args.method)
+	buffers = make_buffers(args.N, max(stop - start for start, stop in chunks))
+
+	def render(camera):
+		if camera.perspective or camera.window is not None or camera.shape != (args.N,)*3 \
+				or camera.extent != args.N or not is_x_rotation(camera.matrix, 1e-9):
+			raise ValueError("the vectorized backend only renders the N x N x N views about x of main()")
+		angle = 2*math.atan2(camera.orientation[1], camera.orientation[0])
+		return render_view(points, datacube, angle, args.N, args.method, chunks, buffers)
+	return render
+
+
+## @brief Fills in the backend and its options from the host's tuning.
+#  Only applies when no --backend was given; --shading and --box keep numpy.
+#  Options given on the command line win over tuned ones.
+#  @param args Parsed arguments, updated in place.
+def apply_tuning(args):
+	if args.backend is None and not args.shading and args.box is None:
+		from volumerender_autotune import load_tuning
+		entry = load_tuning(args.N)
+		if entry is not None:
+			args.backend = entry['backend']
+			for name, value in entry['options'].items():
+				if getattr(args, name, None) is None:
+					setattr(args, name, value)
+			print(f"Using the tuned {args.backend} backend {entry['options']}")
+	if args.backend is None:
+		args.backend = 'numpy'
+	for name, value in BACKEND_DEFAULTS.items():
+		if getattr(args, name, None) is None:
+			setattr(args, name, value)
+
+
+## @brief Camera keyword arguments shared by the subcommands.
+def camera_options(args):
+	return {'Nsteps': args.Nsteps, 'fov': args.fov}
+
+
+## @brief Restricts a camera to the --window, or to the window covering the --box.
+def region(args, camera):
+	if args.window is not None:
+		return camera.cropped(args.window)
+	if args.box is not None:
+		from volumerender_roi import box_window
+		import h5py as h5
+		with h5.File(args.input, 'r') as f:
+			shape = f[args.dataset].shape
+		return camera.cropped(box_window(camera, args.box, shape))
+	return camera
+
+
+def _numbers(count, kind):
+	def parse(text):
+		values = [kind(v) for v in text.split(',')]
+		if len(values) != count:
+			raise argparse.ArgumentTypeError("expected " + str(count) + " comma-separated numbers")
+		return values
+	return parse
+
+
+def _write_png(image, filename):
+	from volumerender_core import encode_png
+	with open(filename, 'wb') as f:
+		f.write(encode_png(image))
+	print('Wrote ' + filename)
+
+
+def _render(args):
+	from volumerender_camera import Camera
+	renderer = make_renderer(args)
+	_write_png(renderer(region(args, Camera.from_angle(args.angle, args.N, **camera_options(args)))), args.output)
+
+
+def _orbit(args):
+	from volumerender_camera import orbit
+	renderer = make_renderer(args)
+	cameras = orbit(args.frames, start=args.start, stop=args.stop, width=args.N, **camera_options(args))
+	for i, camera in enumerate(cameras):
+		print('Rendering Scene ' + str(i+1) + ' of ' + str(len(cameras)) + '.')
+		_write_png(renderer(region(args, camera)), args.output.format(frame=i))
+
+
+def _project(args):
+	from volumerender_core import load_datacube
+	from volumerender_projection import axis_projection, project_camera, projection_image
+	datacube = load_datacube(args.input, args.dataset)
+	if args.axis is not None:
+		projection = axis_projection(datacube, args.mode, args.axis)
+	else:
+		from volumerender_camera import Camera
+		camera = Camera.from_angle(args.angle, args.N, **camera_options(args))
+		projection = project_camera(datacube, camera, args.mode, args.method)
+	_write_png(projection_image(projection), args.output)
+
+
+def _autotune(args):
+	from volumerender_autotune import main as autotune
+	autotune(args.N, args.frames, args.config)
+
+
+def _conformance(args):
+	from volumerender_conformance import main as conformance, BACKENDS as CONFORMANCE_BACKENDS
+	if conformance(args.N, tuple(args.backends or CONFORMANCE_BACKENDS), tuple(args.methods or ('linear', 'nearest'))):
+		sys.exit(1)
+
+
+def _jobs(args):
+	from volumerender_jobs import run_jobs
+	run_jobs(args.manifest, args.workers)
+
+
+## @brief Time to import a module in a fresh interpreter.
+#  @param module Module name, importable from this directory.
+#  @param repeat Number of fresh interpreters; the fastest is reported.
+#  @return Seconds spent in the import statement.
+def import_time(module, repeat=3):
+	code = 'import time; start = time.perf_counter(); import ' + module + '; print(time.perf_counter() - start)'
+	directory = os.path.dirname(os.path.abspath(__file__))
+	times = []
+	for _ in range(repeat):
+		output = subprocess.run([sys.executable, '-c', code], cwd=directory, capture_output=True, text=True, check=True)
+		times.append(float(output.stdout.split()[-1]))
+	return min(times)
+
+
+## @brief Appends a benchmark result to a JSON-lines file.
+#  @param filename File to append to.
+#  @param kind 'imports' or 'render'.
+#  @param results Dict of measurements.
+def record_benchmark(filename, kind, results):
+	entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': socket.gethostname(),
+	         'python': sys.version.split()[0], 'kind': kind, 'results': results}
+	with open(filename, 'a') as f:
+		f.write(json.dumps(entry) + '\n')
+
+
+def _bench(args):
+	if args.imports:
+		results = {}
+		for module in IMPORT_BENCHMARK:
+			results[module] = import_time(module, args.repeat)
+			print(f"import {module}: {results[module]*1000:.1f} ms")
+		if args.record:
+			record_benchmark(args.record, 'imports', results)
+		return
+
+	import numpy as np
+	from timeit import default_timer as timer
+	from volumerender_camera import orbit
+
+	start = timer()
+	renderer = make_renderer(args)
+	setup = timer() - start
+	print(f"Setup ({args.backend}): {setup} seconds")
+
+	cameras = orbit(args.frames, width=args.N, **camera_options(args))
+	average = np.zeros(len(cameras))
+	for i, camera in enumerate(cameras):
+		camera = region(args, camera)
+		start = timer()
+		renderer(camera)
+		average[i] = timer() - start
+		print(f"Time to render scene {i+1}: {average[i]} seconds")
+
+	print(f"Mean rendering time: {np.mean(average)} seconds")
+	print(f"Standard deviation of rendering time: {np.std(average)} seconds")
+	print(f"Max rendering time: {np.max(average)} seconds")
+	print(f"Min rendering time: {np.min(average)} seconds")
+	if args.record:
+		record_benchmark(args.record, 'render', {'backend': args.backend, 'N': args.N, 'method': args.method,
+		                                         'setup': setup, 'frames': average.tolist()})
+
+
+## @brief Builds the argument parser.
+#  @return argparse.ArgumentParser.
+def make_parser():
+	parser = argparse.ArgumentParser(prog='volumerender', description='Volume rendering of datacube.hdf5')
+	commands = parser.add_subparsers(dest='command', required=True)
+
+	def common(sub, backend=True):
+		sub.add_argument('--input', default='datacube.hdf5', help='HDF5 file')
+		sub.add_argument('--dataset', default='density', help='dataset name')
+		sub.add_argument('-N', type=int, default=180, help='image resolution (pixels per side)')
+		sub.add_argument('--Nsteps', type=int, default=None, help='samples per ray (default N)')
+		sub.add_argument('--method', default='linear', choices=('nearest', 'linear'), help='interpolation method')
+		sub.add_argument('--fov', type=float, default=None, help='perspective field of view in degrees')
+		if backend:
+			sub.add_argument('--backend', default=None, choices=BACKENDS, help='default: the tuned backend, else numpy')
+			sub.add_argument('--brick', type=int, default=None, help='brick size (bricks backend, default 64)')
+			sub.add_argument('--processes', type=int, default=None, help='worker processes (distributed backend, default 4)')
+			sub.add_argument('--memory-budget', type=int, default=None, help='bytes per slab (vectorized backend, default one slab)')
+			sub.add_argument('--workers', type=int, default=None, help='threads of the per-slab sampler (numpy backend, default all CPUs)')
+			sub.add_argument('--path', default=None, choices=('slab', 'clip'),
+			                 help='slab: per-slab sampler for views about x, clip: always clip rays (numpy backend, default slab)')
+			sub.add_argument('--shading', action='store_true', help='gradient shading with a cached gradient (numpy backend)')
+			sub.add_argument('--window', type=_numbers(4, int), default=None, metavar='ROW0,ROW1,COL0,COL1',
+			                 help='render only this pixel window of the image')
+			sub.add_argument('--box', type=_numbers(6, float), default=None, metavar='X0,Y0,Z0,X1,Y1,Z1',
+			                 help='world-space clipping box (numpy or bricks backend)')
+
+	render = commands.add_parser('render', help='render one view')
+	common(render)
+	render.add_argument('--angle', type=float, default=0.0, help='rotation about x in radians')
+	render.add_argument('--output', default='volumerender.png')
+	render.set_defaults(run=_render)
+
+	orbit = commands.add_parser('orbit', help='render views along an orbit about x')
+	common(orbit)
+	orbit.add_argument('--frames', type=int, default=10)
+	orbit.add_argument('--start', type=float, default=0.0)
+	orbit.add_argument('--stop', type=float, default=1.5707963267948966)
+	orbit.add_argument('--output', default='volumerender{frame}.png', help='file pattern with {frame}')
+	orbit.set_defaults(run=_orbit)
+
+	project = commands.add_parser('project', help='maximum, minimum or average projection')
+	common(project, backend=False)
+	project.add_argument('--mode', default='max', choices=('max', 'min', 'mean'))
+	project.add_argument('--angle', type=float, default=0.0, help='rotation about x in radians')
+	project.add_argument('--axis', type=int, default=None, choices=(0, 1, 2), help='project along a datacube axis instead')
+	project.add_argument('--output', default='projection.png')
+	project.set_defaults(run=_project)
+
+	bench = commands.add_parser('bench', help='time renders, or module imports with --imports')
+	common(bench)
+	bench.add_argument('--frames', type=int, default=3)
+	bench.add_argument('--imports', action='store_true', help='time module imports in fresh interpreters')
+	bench.add_argument('--repeat', type=int, default=3, help='fresh interpreters per import timing')
+	bench.add_argument('--record', default=None, help='append the results to this JSON-lines file')
+	bench.set_defaults(run=_bench)
+
+	autotune = commands.add_parser('autotune', help='time the backends on a synthetic cube and store the fastest for this host')
+	autotune.add_argument('-N', type=int, default=180, help='image resolution to tune for')
+	autotune.add_argument('--frames', type=int, default=2, help='calibration frames per configuration')
+	autotune.add_argument('--config', default=None, help='tuning file (default $VOLUMERENDER_TUNING or ~/.config/volumerender/)')
+	autotune.set_defaults(run=_autotune)
+
+	conformance = commands.add_parser('conformance', help='compare every backend with the original renderer on synthetic volumes')
+	conformance.add_argument('-N', type=int, default=48, help='image resolution')
+	conformance.add_argument('--backend', dest='backends', action='append', default=None, help='backend or mode to check, repeatable (default all)')
+	conformance.add_argument('--method', dest='methods', action='append', default=None, choices=('linear', 'nearest'),
+	                         help='interpolation method, repeatable (default both)')
+	conformance.set_defaults(run=_conformance)
+
+	jobs = commands.add_parser('jobs', help='run a resumable batch of renders from a JSON manifest')
+	jobs.add_argument('manifest', help='manifest file (see volumerender_jobs)')
+	jobs.add_argument('--workers', type=int, default=None, help='worker processes (default from the manifest)')
+	jobs.set_defaults(run=_jobs)
+
+	return parser
+
+
+## @brief Runs the command line.
+#  @param argv Arguments, defaults to sys.argv[1:].
+def main(argv=None):
+	""" Volume Rendering """
+
+	args = make_parser().parse_args(argv)
+	if getattr(args, 'box', None) is not None:
+		args.box = (args.box[:3], args.box[3:])
+	if hasattr(args, 'backend'):
+		apply_tuning(args)
+	args.run(args)
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,158 @@
+# Ray-Volume Intersection Clipping
+import numpy as np
+from volumerender_core import composite, transferFunction
+from volumerender_sampling import sample_uniform
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_clip
+#  Clips every ray of a camera to its entry/exit interval against the volume
+#  bounding box, computed analytically per pixel, so samples outside the
+#  datacube are never interpolated. Samples outside the volume take a defined
+#  fill density instead of depending on interpn's bounds_error; the default
+#  fill of 0 is empty space (log(0) = -inf gives zero opacity).
+
+
+## @brief Bounding box of the datacube grid from datacube_points().
+#  @param shape Shape (Nx, Ny, Nz) of the datacube.
+#  @return Tuple (lo, hi) of the box corners.
+def volume_bounds(shape):
+	n = np.array(shape, dtype=np.float64)
+	return -n/2, n/2
+
+
+## @brief Box that rays are clipped to: the volume, optionally restricted to a world-space box.
+#  @param shape Shape (Nx, Ny, Nz) of the datacube.
+#  @param box Tuple (lo, hi) of world-space corners, or None.
+#  @return Tuple (lo, hi); empty (some lo > hi) if the box misses the volume.
+def clip_bounds(shape, box=None):
+	lo, hi = volume_bounds(shape)
+	if box is not None:
+		lo = np.maximum(lo, np.asarray(box[0], dtype=np.float64))
+		hi = np.minimum(hi, np.asarray(box[1], dtype=np.float64))
+	return lo, hi
+
+
+## @brief Entry and exit parameters of rays through an axis-aligned box (slab method).
+#  @param origins Ray origins of shape (..., 3).
+#  @param directions Ray directions of shape (..., 3).
+#  @param lo Lower box corner.
+#  @param hi Upper box corner.
+#  @return Tuple (t_enter, t_exit); rays missing the box have t_enter > t_exit.
+def ray_box_intersection(origins, directions, lo, hi):
+	origins = np.asarray(origins, dtype=np.float64)
+	directions = np.asarray(directions, dtype=np.float64)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		inv = 1.0/directions
+		t0 = (lo - origins)*inv
+		t1 = (hi - origins)*inv
+	# Rays parallel to a slab are inside it for all t, or for none
+	parallel = directions == 0
+	outside = parallel & ((origins < lo) | (origins > hi))
+	t_min = np.where(parallel, np.where(outside, np.inf, -np.inf), np.minimum(t0, t1))
+	t_max = np.where(parallel, np.where(outside, -np.inf, np.inf), np.maximum(t0, t1))
+	t_enter = np.max(t_min, axis=-1)
+	t_exit = np.min(t_max, axis=-1)
+	return t_enter, t_exit
+
+
+## @brief Per-pixel sampled interval of a camera, clipped to the volume.
+#  @param camera Camera from volumerender_camera.
+#  @param shape Shape of the datacube.
+#  @param box World-space clipping box (lo, hi), or None for the whole volume.
+#  @return Tuple (t_enter, t_exit) of shape (height, width).
+def clip_rays(camera, shape, box=None):
+	origins, directions, t_near, t_far = camera.rays()
+	t_enter, t_exit = ray_box_intersection(origins, directions, *clip_bounds(shape, box))
+	return np.maximum(t_near, t_enter), np.minimum(t_far, t_exit)
+
+
+## @brief Checks whether every sample of a camera lies inside the volume.
+#  @param camera Camera from volumerender_camera.
+#  @param shape Shape of the datacube.
+#  @return True if no clipping is needed.
+def inside_volume(camera, shape):
+	origins, directions, t_near, t_far = camera.rays()
+	t_enter, t_exit = ray_box_intersection(origins, directions, *volume_bounds(shape))
+	return bool(np.all(t_enter <= t_near) and np.all(t_exit >= t_far))
+
+
+## @brief Ray parameters of the samples of a camera that lie inside the volume.
+#  @param camera Camera from volumerender_camera.
+#  @param shape Shape of the datacube.
+#  @param box World-space clipping box (lo, hi), or None for the whole volume.
+#  @return Tuple (inside, qi): boolean mask of shape camera.shape and the query
+#  points of the True entries, in C order.
+def clipped_points(camera, shape, box=None):
+	origins, directions, t_near, t_far = camera.rays()
+	t_enter, t_exit = clip_rays(camera, shape, box)
+
+	k = np.linspace(1.0, 0.0, camera.Nsteps)[:,np.newaxis,np.newaxis]
+	t = t_near + k*(t_far.astype(np.float64) - t_near)
+	inside = (t >= t_enter) & (t <= t_exit)
+
+	_, i, j = np.nonzero(inside)
+	qi = origins[i,j] + t[inside][:,np.newaxis]*directions[i,j]
+	# Guard against rounding just outside the box at the entry/exit points
+	lo, hi = volume_bounds(shape)
+	np.clip(qi, lo, hi, out=qi)
+	return inside, qi
+
+
+## @brief Camera grid holding the interpolated inside samples and the fill elsewhere.
+#  @param datacube The density datacube.
+#  @param camera Camera from volumerender_camera.
+#  @param inside Mask from clipped_points().
+#  @param qi Query points from clipped_points().
+#  @param interpolationMethod Method used for data interpolation.
+#  @param fill_value Density of samples outside the volume.
+#  @param out Camera grid of shape camera.shape to fill, e.g. reused across frames.
+#  @return Camera grid of shape camera.shape.
+def sample_inside(datacube, camera, inside, qi, interpolationMethod='linear', fill_value=0.0, out=None):
+	if out is None:
+		camera_grid = np.full(camera.shape, fill_value, dtype=np.float64)
+	else:
+		camera_grid = out
+		camera_grid.fill(fill_value)
+	if len(qi):
+		camera_grid[inside] = sample_uniform(datacube, qi, (len(qi),), interpolationMethod)
+	return camera_grid
+
+
+## @brief Resamples the datacube onto a camera grid, skipping samples outside it.
+#  @param datacube The density datacube.
+#  @param camera Camera from volumerender_camera.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param fill_value Density of samples outside the volume (0 is transparent).
+#  @param box World-space clipping box (lo, hi); samples outside it also take the fill.
+#  @return Camera grid of shape camera.shape, back to front along axis 0.
+def sample_clipped(datacube, camera, interpolationMethod='linear', fill_value=0.0, box=None):
+	inside, qi = clipped_points(camera, datacube.shape, box)
+	return sample_inside(datacube, camera, inside, qi, interpolationMethod, fill_value)
+
+
+## @brief Renders a camera view with clipped rays.
+#  With the transparent fill, slices that contain no sample inside the volume
+#  leave the image unchanged and are not composited.
+#  @param datacube The density datacube.
+#  @param camera Camera from volumerender_camera.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param fill_value Density of samples outside the volume (0 is transparent).
+#  @param transfer Transfer function mapping log-density to RGBA.
+#  @param box World-space clipping box (lo, hi); samples outside it also take the fill.
+#  @return RGB image of shape (height, width, 3).
+def render_clipped(datacube, camera, interpolationMethod='linear', fill_value=0.0, transfer=transferFunction, box=None):
+	inside, qi = clipped_points(camera, datacube.shape, box)
+	camera_grid = sample_inside(datacube, camera, inside, qi, interpolationMethod, fill_value)
+
+	if fill_value == 0.0:
+		occupied = np.flatnonzero(inside.any(axis=(1,2)))
+		if len(occupied) == 0:
+			return np.zeros((camera.height, camera.width, 3))
+		camera_grid = camera_grid[occupied[0]:occupied[-1]+1]
+	return composite(camera_grid, transfer)
@@ -0,0 +1,375 @@
+# Cross-backend Conformance
+import os
+import tempfile
+import numpy as np
+import h5py as h5
+from timeit import default_timer as timer
+from volumerender_camera import Camera
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_conformance
+#  Golden-image conformance suite. Fixed synthetic volumes are rendered from
+#  fixed cameras by reference_render(), a copy of the rendering loop of
+#  volumerender_original.py (interpn, transferFunction, back-to-front
+#  compositing, clipping to [0, 1]), and by every backend and mode of this
+#  tree. Each backend's worst max and RMS error over the views of each volume
+#  is checked against TOLERANCES, so a change that makes a backend drift from
+#  the original fails:
+#
+#      python volumerender_cli.py conformance -N 48
+#
+#  Exact backends differ from the reference by rounding only. The
+#  approximate ones (pre-integration with half the samples, 8-bit
+#  quantization, the additive vectorized compositing) have tolerances per
+#  volume a little above the errors they have today, for N up to 64, so
+#  they may not get worse.
+
+## Synthetic volumes rendered by the suite.
+VOLUMES = ('smooth', 'noise', 'shell')
+
+## Rotation angles about x of the suite's cameras, as in main() with Nangles=4.
+ANGLES = (0.0, np.pi/8, np.pi/4, 3*np.pi/8)
+
+## Backends and modes compared with the reference.
+BACKENDS = ('numpy', 'clipped', 'workspace', 'pipeline', 'incremental', 'multifield', 'roi', 'morton', 'chunked',
+            'bricks', 'distributed', 'vectorized', 'preintegrated', 'quantized')
+
+## Largest accepted (max, RMS) error against the reference over the cameras
+#  of one volume, keyed by backend, (backend, method) or (backend, method,
+#  volume); see tolerance(). Backends that sample along the float32 rays of
+#  volumerender_camera instead of the reference's float64 grid are within
+#  ~1e-4 for 'linear'. The approximate backends have an entry per volume, a
+#  little above the worst error measured for N from 16 to 64.
+TOLERANCES = {
+	'numpy':                                    (1e-9, 1e-10),
+	'workspace':                                (1e-9, 1e-10),
+	'pipeline':                                 (1e-9, 1e-10),
+	'chunked':                                  (1e-9, 1e-10),
+	'incremental':                              (1e-6, 2e-7),
+	'clipped':                                  (1e-9, 1e-10),
+	'multifield':                               (1e-9, 1e-10),
+	'roi':                                      (1e-9, 1e-10),
+	'morton':                                   (1e-9, 1e-10),
+	'bricks':                                   (1e-9, 1e-10),
+	'distributed':                              (1e-9, 1e-10),
+	('clipped', 'linear'):                      (2e-4, 5e-6),
+	('multifield', 'linear'):                   (2e-4, 5e-6),
+	('roi', 'linear'):                          (2e-4, 5e-6),
+	('morton', 'linear'):                       (2e-4, 5e-6),
+	('bricks', 'linear'):                       (2e-4, 5e-6),
+	('distributed', 'linear'):                  (2e-4, 5e-6),
+	('vectorized', 'linear', 'smooth'):         (0.99, 0.31),
+	('vectorized', 'linear', 'noise'):          (0.91, 0.53),
+	('vectorized', 'linear', 'shell'):          (0.77, 0.31),
+	('vectorized', 'nearest', 'smooth'):        (0.99, 0.31),
+	('vectorized', 'nearest', 'noise'):         (0.86, 0.37),
+	('vectorized', 'nearest', 'shell'):         (0.87, 0.28),
+	('preintegrated', 'linear', 'smooth'):      (0.33, 0.08),
+	('preintegrated', 'linear', 'noise'):       (0.81, 0.24),
+	('preintegrated', 'linear', 'shell'):       (0.63, 0.12),
+	('preintegrated', 'nearest', 'smooth'):     (0.46, 0.092),
+	('preintegrated', 'nearest', 'noise'):      (0.95, 0.32),
+	('preintegrated', 'nearest', 'shell'):      (0.94, 0.23),
+	('quantized', 'linear', 'smooth'):          (0.54, 0.12),
+	('quantized', 'linear', 'noise'):           (0.98, 0.47),
+	('quantized', 'linear', 'shell'):           (0.61, 0.14),
+	('quantized', 'nearest', 'smooth'):         (0.07, 0.0066),
+	('quantized', 'nearest', 'noise'):          (0.03, 0.0072),
+	('quantized', 'nearest', 'shell'):          (0.03, 0.0052),
+}
+
+
+## @brief Stored tolerance of a backend, interpolation method and volume.
+#  The most specific entry wins: (backend, method, volume), then
+#  (backend, method), then backend.
+#  @param backend One of BACKENDS.
+#  @param method Interpolation method.
+#  @param volume One of VOLUMES.
+#  @param tolerances Dict like TOLERANCES, defaults to it.
+#  @return Tuple (max, RMS).
+def tolerance(backend, method, volume, tolerances=None):
+	tolerances = TOLERANCES if tolerances is None else tolerances
+	for key in ((backend, method, volume), (backend, method), backend):
+		if key in tolerances:
+			return tolerances[key]
+	raise KeyError("no tolerance for " + repr((backend, method, volume)))
+
+
+## @brief Transfer function of volumerender_original.py.
+#  @param x Log-density values.
+#  @return Tuple of RGBA color components.
+def reference_transfer(x):
+	r = 1.0*np.exp( -(x - 9.0)**2/1.0 ) +  0.1*np.exp( -(x - 3.0)**2/0.1 ) +  0.1*np.exp( -(x - -3.0)**2/0.5 )
+	g = 1.0*np.exp( -(x - 9.0)**2/1.0 ) +  1.0*np.exp( -(x - 3.0)**2/0.1 ) +  0.1*np.exp( -(x - -3.0)**2/0.5 )
+	b = 0.1*np.exp( -(x - 9.0)**2/1.0 ) +  0.1*np.exp( -(x - 3.0)**2/0.1 ) +  1.0*np.exp( -(x - -3.0)**2/0.5 )
+	a = 0.6*np.exp( -(x - 9.0)**2/1.0 ) +  0.1*np.exp( -(x - 3.0)**2/0.1 ) + 0.01*np.exp( -(x - -3.0)**2/0.5 )
+
+	return r,g,b,a
+
+
+## @brief Renders one view exactly as volumerender_original.py does.
+#  Kept independent of volumerender_core on purpose, so the suite also
+#  catches changes to the shared helpers.
+#  @param datacube The density datacube, at least N*sqrt(2) voxels wide.
+#  @param angle Rotation angle of the camera about x in radians.
+#  @param N Image resolution (pixels per side).
+#  @param interpolationMethod Method used for data interpolation.
+#  @return RGB image of shape (N, N, 3), clipped to [0, 1].
+def reference_render(datacube, angle, N, interpolationMethod='linear'):
+	from scipy.interpolate import interpn
+
+	# Datacube Grid
+	Nx, Ny, Nz = datacube.shape
+	x = np.linspace(-Nx/2, Nx/2, Nx)
+	y = np.linspace(-Ny/2, Ny/2, Ny)
+	z = np.linspace(-Nz/2, Nz/2, Nz)
+	points = (x, y, z)
+
+	# Camera Grid / Query Points -- rotate camera view
+	c = np.linspace(-N/2, N/2, N)
+	qx, qy, qz = np.meshgrid(c,c,c)
+	qxR = qx
+	qyR = qy * np.cos(angle) - qz * np.sin(angle)
+	qzR = qy * np.sin(angle) + qz * np.cos(angle)
+	qi = np.array([qxR.ravel(), qyR.ravel(), qzR.ravel()]).T
+
+	# Interpolate onto Camera Grid
+	camera_grid = interpn(points, datacube, qi, method=interpolationMethod).reshape((N,N,N))
+
+	# Do Volume Rendering
+	image = np.zeros((camera_grid.shape[1],camera_grid.shape[2],3))
+
+	for dataslice in camera_grid:
+		with np.errstate(divide='ignore'):
+			r,g,b,a = reference_transfer(np.log(dataslice))
+		image[:,:,0] = a*r + (1-a)*image[:,:,0]
+		image[:,:,1] = a*g + (1-a)*image[:,:,1]
+		image[:,:,2] = a*b + (1-a)*image[:,:,2]
+
+	return np.clip(image,0.0,1.0)
+
+
+## @brief Side of the synthetic volumes for a resolution.
+#  Like datacube.hdf5 (256) for N=180, every rotated view lies inside the
+#  volume. The side is odd so the centre is a voxel: with an even side, the
+#  centre samples of the pi/4 view lie exactly halfway between voxels and
+#  'nearest' picks either one depending on the last bit of the coordinates.
+def volume_size(N):
+	return (int(np.ceil(N*np.sqrt(2))) + 1) | 1
+
+
+## @brief One of the fixed synthetic volumes.
+#  @param name One of VOLUMES: 'smooth' (broad structure across all transfer
+#  function bands), 'noise' (log-uniform voxel noise) or 'shell' (a sharp
+#  bright shell around a dimmer core).
+#  @param size Cube side in voxels.
+#  @return Positive float64 datacube of shape (size, size, size).
+def synthetic_volume(name, size):
+	x = np.linspace(-1.0, 1.0, size)
+	X, Y, Z = np.meshgrid(x, x, x, indexing='ij')
+	if name == 'smooth':
+		return np.exp(3.0 + 6.0*np.sin(2*np.pi*X)*np.cos(1.5*np.pi*Y) + 2.0*np.sin(np.pi*Z))
+	if name == 'noise':
+		return np.exp(np.random.default_rng(2020).uniform(-4, 10, size=(size, size, size)))
+	if name == 'shell':
+		radius = np.sqrt(X**2 + Y**2 + Z**2)
+		return np.exp(-3.0 + 6.0*(radius < 0.3) + 12.0*np.exp(-((radius - 0.5)/0.03)**2))
+	raise ValueError("unknown volume " + repr(name) + ", expected one of " + str(VOLUMES))
+
+
+## @brief Builds a renderer for a backend or mode.
+#  @param backend One of BACKENDS.
+#  @param filename HDF5 file holding the datacube as 'density'.
+#  @param datacube The same datacube, already loaded.
+#  @param N Image resolution.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param directory Directory for derived files (e.g. the chunked copy).
+#  @return Function mapping a Camera to an RGB image, or to (image, window)
+#  for renderers of part of the view.
+def make_renderer(backend, filename, datacube, N, interpolationMethod='linear', directory=None):
+	from volumerender_core import composite
+	from volumerender_camera import sample_camera
+	if backend == 'numpy':
+		return lambda camera: composite(sample_camera(datacube, camera, interpolationMethod))
+	if backend == 'clipped':
+		from volumerender_clip import render_clipped
+		return lambda camera: render_clipped(datacube, camera, interpolationMethod)
+	if backend == 'workspace':
+		from volumerender_core import Workspace
+		workspace = Workspace()
+		return lambda camera: workspace.composite(sample_camera(datacube, camera, interpolationMethod)).copy()
+	if backend == 'pipeline':
+		from volumerender_pipeline import render_frame
+		return lambda camera: render_frame(datacube, camera, interpolationMethod)
+	if backend == 'incremental':
+		from volumerender_incremental import ResampleCache, composite_logs
+		cache = ResampleCache()
+		return lambda camera: composite_logs(cache.get(datacube, camera, interpolationMethod))
+	if backend == 'multifield':
+		from volumerender_multifield import Field, render_fields
+		return lambda camera: render_fields([datacube], [Field('density')], camera, interpolationMethod)
+	if backend == 'roi':
+		from volumerender_roi import render_roi
+		window = (N//4, 3*N//4, N//8, 5*N//8)
+		return lambda camera: render_roi(datacube, camera.cropped(window), None, interpolationMethod)
+	if backend == 'morton':
+		from volumerender_morton import BrickedVolume, sample_camera as sample_bricked
+		volume = BrickedVolume(datacube, 8)
+		return lambda camera: composite(sample_bricked(volume, camera, interpolationMethod, tile=8))
+	if backend == 'chunked':
+		from volumerender_core import load_datacube
+		from volumerender_chunked import convert
+		chunked = os.path.join(directory or os.path.dirname(filename), 'chunked.hdf5')
+		convert(filename, chunked, 'density', chunk=16)
+		loaded = load_datacube(chunked, 'density')
+		return lambda camera: composite(sample_camera(loaded, camera, interpolationMethod))
+	if backend == 'bricks':
+		from volumerender_bricks import render_streamed
+		return lambda camera: render_streamed(filename, camera, 'density', 16, interpolationMethod)
+	if backend == 'distributed':
+		from volumerender_distributed import render_distributed
+		return lambda camera: render_distributed(filename, camera, 2, 'density', interpolationMethod)
+	if backend == 'vectorized':
+		import math
+		from volumerender_core import datacube_points
+		from volumerender_vectorized import chunk_plan, make_buffers, render_view
+		points = datacube_points(datacube.shape)
+		chunks = chunk_plan(N, None, interpolationMethod)
+		buffers = make_buffers(N, N)
+		return lambda camera: render_view(points, datacube, 2*math.atan2(camera.orientation[1], camera.orientation[0]),
+		                                  N, interpolationMethod, chunks, buffers)
+	if backend == 'preintegrated':
+		from volumerender_preintegrated import preintegrate, render_preintegrated
+		Nsteps = N//2
+		table = preintegrate(length=(N-1)/(Nsteps-1))
+		return lambda camera: render_preintegrated(
+			sample_camera(datacube, Camera(camera.orientation, N, Nsteps=Nsteps), interpolationMethod), table)
+	if backend == 'quantized':
+		from volumerender_quantized import quantize, transfer_table, render_quantized
+		codes, scale, offset = quantize(datacube, 8)
+		table = transfer_table(scale, offset, 256)
+		return lambda camera: render_quantized(codes, table, camera.points(), camera.shape, interpolationMethod)
+	raise ValueError("unknown backend " + repr(backend) + ", expected one of " + str(BACKENDS))
+
+
+## @brief Error of an image against the reference.
+#  @param image RGB image; clipped to [0, 1] like the reference.
+#  @param expected Reference image.
+#  @return Tuple (max, RMS, PSNR in dB); PSNR is inf for identical images.
+def image_error(image, expected):
+	difference = np.clip(image, 0.0, 1.0) - expected
+	error_max = float(np.max(np.abs(difference)))
+	rms = float(np.sqrt(np.mean(difference**2)))
+	psnr = float('inf') if rms == 0 else float(20*np.log10(1.0/rms))
+	return error_max, rms, psnr
+
+
+## @brief Renders the suite with the reference and every backend.
+#  @param N Image resolution (pixels per side).
+#  @param backends Backends to compare, defaults to BACKENDS.
+#  @param volumes Synthetic volumes, defaults to VOLUMES.
+#  @param methods Interpolation methods.
+#  @param angles Camera angles about x.
+#  @return List of dicts with 'backend', 'method', 'volume', 'max', 'rms', 'psnr'
+#  (worst over the angles) and 'seconds' per frame. Each volume's reference
+#  entries come before its backends'.
+def run_suite(N=48, backends=BACKENDS, volumes=VOLUMES, methods=('linear', 'nearest'), angles=ANGLES):
+	cameras = [Camera.from_angle(angle, N) for angle in angles]
+	size = volume_size(N)
+	stats = {}
+
+	def record(backend, method, error, seconds):
+		entry = stats.setdefault((backend, method, name), {'backend': backend, 'method': method, 'volume': name,
+		                                                  'max': 0.0, 'rms': 0.0, 'psnr': float('inf'), 'seconds': []})
+		entry['max'] = max(entry['max'], error[0])
+		entry['rms'] = max(entry['rms'], error[1])
+		entry['psnr'] = min(entry['psnr'], error[2])
+		entry['seconds'].append(seconds)
+
+	with tempfile.TemporaryDirectory(prefix='volumerender_') as directory:
+		for name in volumes:
+			datacube = synthetic_volume(name, size)
+			filename = os.path.join(directory, name + '.hdf5')
+			with h5.File(filename, 'w') as f:
+				f['density'] = datacube
+
+			for method in methods:
+				references = []
+				for angle in angles:
+					start = timer()
+					references.append(reference_render(datacube, angle, N, method))
+					record('reference', method, (0.0, 0.0, float('inf')), timer() - start)
+
+				for backend in backends:
+					renderer = make_renderer(backend, filename, datacube, N, method, directory)
+					for camera, expected in zip(cameras, references):
+						start = timer()
+						image = renderer(camera)
+						seconds = timer() - start
+						if isinstance(image, tuple):
+							image, (row0, row1, col0, col1) = image
+							expected = expected[row0:row1, col0:col1]
+						record(backend, method, image_error(image, expected), seconds)
+
+	results = list(stats.values())
+	for entry in results:
+		entry['seconds'] = float(np.mean(entry['seconds']))
+	return results
+
+
+## @brief Checks suite results against the stored tolerances.
+#  @param results Results from run_suite().
+#  @param tolerances Dict like TOLERANCES, defaults to it.
+#  @return List of failure messages, empty when every backend conforms.
+def check(results, tolerances=None):
+	failures = []
+	for entry in results:
+		if entry['backend'] == 'reference':
+			continue
+		error_max, rms = tolerance(entry['backend'], entry['method'], entry['volume'], tolerances)
+		if entry['max'] > error_max or entry['rms'] > rms:
+			failures.append(f"{entry['backend']} ({entry['method']}, {entry['volume']}): max {entry['max']:.3g} > "
+			                f"{error_max:.3g} or RMS {entry['rms']:.3g} > {rms:.3g}")
+	return failures
+
+
+## @brief Prints suite results side by side.
+#  @param results Results from run_suite().
+#  @param tolerances Dict like TOLERANCES, defaults to it.
+def report(results, tolerances=None):
+	print(f"{'backend':<14} {'method':<8} {'volume':<7} {'max':>9} {'RMS':>9} {'PSNR dB':>8} {'ms/frame':>9}  status")
+	for entry in results:
+		if entry['backend'] == 'reference':
+			status = 'reference'
+		else:
+			error_max, rms = tolerance(entry['backend'], entry['method'], entry['volume'], tolerances)
+			status = 'ok' if entry['max'] <= error_max and entry['rms'] <= rms else 'FAIL'
+		print(f"{entry['backend']:<14} {entry['method']:<8} {entry['volume']:<7} {entry['max']:>9.2e} {entry['rms']:>9.2e} "
+		      f"{entry['psnr']:>8.1f} {1000*entry['seconds']:>9.1f}  {status}")
+
+
+## @brief Runs the conformance suite and reports it.
+#  @param N Image resolution (pixels per side).
+#  @param backends Backends to compare, defaults to BACKENDS.
+#  @param methods Interpolation methods.
+#  @return List of failure messages from check().
+def main(N=48, backends=BACKENDS, methods=('linear', 'nearest')):
+	""" Volume Rendering """
+
+	results = run_suite(N, backends, methods=methods)
+	report(results)
+	failures = check(results)
+	for failure in failures:
+		print('Conformance failure: ' + failure)
+	checked = sum(entry['backend'] != 'reference' for entry in results)
+	print(f"{len(failures)} of {checked} backend/method/volume combinations outside their tolerances")
+	return failures
+
+if __name__== "__main__":
+	main()
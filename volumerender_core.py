@@ -0,0 +1,354 @@
+# Shared Rendering Helpers
+import struct
+import zlib
+import numpy as np
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_core
+#  Loading, camera grid, sampling and compositing helpers shared by the
+#  volume rendering variants that build on top of the original script.
+
+
+## @brief Transfer function for volume rendering.
+#  @param x Input log-density values.
+#  @return Tuple of RGBA color components.
+def transferFunction(x):
+
+	r = 1.0*np.exp( -(x - 9.0)**2/1.0 ) +  0.1*np.exp( -(x - 3.0)**2/0.1 ) +  0.1*np.exp( -(x - -3.0)**2/0.5 )
+	g = 1.0*np.exp( -(x - 9.0)**2/1.0 ) +  1.0*np.exp( -(x - 3.0)**2/0.1 ) +  0.1*np.exp( -(x - -3.0)**2/0.5 )
+	b = 0.1*np.exp( -(x - 9.0)**2/1.0 ) +  0.1*np.exp( -(x - 3.0)**2/0.1 ) +  1.0*np.exp( -(x - -3.0)**2/0.5 )
+	a = 0.6*np.exp( -(x - 9.0)**2/1.0 ) +  0.1*np.exp( -(x - 3.0)**2/0.1 ) + 0.01*np.exp( -(x - -3.0)**2/0.5 )
+
+	return r,g,b,a
+
+
+## Gaussian centers, widths and RGBA weights of transferFunction, for code
+#  that evaluates it into preallocated buffers.
+TF_CENTERS = (9.0, 3.0, -3.0)
+TF_WIDTHS = (1.0, 0.1, 0.5)
+TF_WEIGHTS = ((1.0, 0.1, 0.1),
+              (1.0, 1.0, 0.1),
+              (0.1, 0.1, 1.0),
+              (0.6, 0.1, 0.01))
+
+
+## @brief Transfer function made of any number of Gaussians in log-density.
+#  Component k is exp(-(x - centers[k])**2/widths[k]), the form used by
+#  transferFunction. Each component is evaluated once and the four channels are
+#  combined with one (4, K) matrix product. Instances compare and hash by their
+#  parameters, so caches and lookup tables can key on them.
+class GaussianTransferFunction:
+	## @brief Creates a transfer function.
+	#  @param centers Gaussian centers, length K.
+	#  @param widths Gaussian widths (the divisor of the squared distance), length K.
+	#  @param rgba_weights Weights of shape (4, K), rows for r, g, b and a.
+	def __init__(self, centers=TF_CENTERS, widths=TF_WIDTHS, rgba_weights=TF_WEIGHTS):
+		self.centers = np.array(centers, dtype=np.float64).ravel()
+		self.widths = np.array(widths, dtype=np.float64).ravel()
+		self.weights = np.array(rgba_weights, dtype=np.float64)
+		K = len(self.centers)
+		if len(self.widths) != K or self.weights.shape != (4, K):
+			raise ValueError("expected K centers, K widths and (4, K) rgba_weights, got " +
+			                 str(len(self.centers)) + ", " + str(len(self.widths)) + " and " + str(self.weights.shape))
+		if np.any(self.widths <= 0):
+			raise ValueError("Gaussian widths must be positive")
+		for array in (self.centers, self.widths, self.weights):
+			array.flags.writeable = False
+		## Hashable parameters; equal keys give equal transfer functions.
+		self.key = (tuple(self.centers), tuple(self.widths), tuple(self.weights.ravel()))
+
+	def __len__(self):
+		return len(self.centers)
+
+	def __eq__(self, other):
+		return isinstance(other, GaussianTransferFunction) and self.key == other.key
+
+	def __hash__(self):
+		return hash(self.key)
+
+	def __repr__(self):
+		return ("GaussianTransferFunction(centers=" + str(self.centers.tolist()) + ", widths=" +
+		        str(self.widths.tolist()) + ", rgba_weights=" + str(self.weights.tolist()) + ")")
+
+	## @brief Gaussian components at the given log-densities.
+	#  @param x Input log-density values.
+	#  @return Array of shape (K,) + x.shape.
+	def basis(self, x):
+		x = np.asarray(x)
+		dtype = x.dtype if x.dtype in (np.float32, np.float64) else np.float64
+		basis = np.empty((len(self),) + x.shape, dtype=dtype)
+		for g, center, width in zip(basis, self.centers, self.widths):
+			np.subtract(x, center, out=g)
+			np.square(g, out=g)
+			np.divide(g, -width, out=g)
+			np.exp(g, out=g)
+		return basis
+
+	## @brief Evaluates the transfer function.
+	#  @param x Input log-density values.
+	#  @return Tuple of RGBA color components.
+	def __call__(self, x):
+		basis = self.basis(x)
+		rgba = np.tensordot(self.weights.astype(basis.dtype), basis, axes=1)
+		return rgba[0], rgba[1], rgba[2], rgba[3]
+
+
+## transferFunction as a GaussianTransferFunction.
+DEFAULT_TRANSFER = GaussianTransferFunction()
+
+
+## @brief Loads the density datacube from an HDF5 file.
+#  @param filename Path of the HDF5 file.
+#  @param dataset Name of the dataset holding the density.
+#  @return The datacube as a NumPy array.
+def load_datacube(filename='datacube.hdf5', dataset='density'):
+	import h5py as h5
+
+	with h5.File(filename, 'r') as f:
+		if f[dataset].chunks is not None:
+			# Chunked (e.g. compressed) datasets are decompressed in parallel
+			from volumerender_chunked import read_dataset
+			return read_dataset(f[dataset])
+		datacube = np.array(f[dataset])
+	return datacube
+
+
+## @brief Builds the datacube grid used by interpn.
+#  @param shape Shape (Nx, Ny, Nz) of the datacube.
+#  @return Tuple of the x, y, z grid coordinates.
+def datacube_points(shape):
+	Nx, Ny, Nz = shape
+	x = np.linspace(-Nx/2, Nx/2, Nx)
+	y = np.linspace(-Ny/2, Ny/2, Ny)
+	z = np.linspace(-Nz/2, Nz/2, Nz)
+	return (x, y, z)
+
+
+## @brief Rotation matrix of the camera in main(), about the x axis.
+#  @param angle Rotation angle in radians.
+#  @return 3x3 rotation matrix.
+def rotation_x(angle):
+	return np.array([[1.0, 0.0, 0.0],
+	                 [0.0, np.cos(angle), -np.sin(angle)],
+	                 [0.0, np.sin(angle),  np.cos(angle)]])
+
+
+## @brief Camera grid query points for an arbitrarily rotated view.
+#  The rays run along axis 0 of the resulting camera grid, exactly as in main().
+#  @param R 3x3 rotation matrix applied to the camera grid.
+#  @param N Image resolution (pixels per side).
+#  @param Nsteps Number of samples per ray, defaults to N.
+#  @return Query points of shape (Nsteps*N*N, 3).
+def view_points(R, N, Nsteps=None):
+	if Nsteps is None:
+		Nsteps = N
+	c = np.linspace(-N/2, N/2, N)
+	cd = np.linspace(-N/2, N/2, Nsteps)
+	qx, qy, qz = np.meshgrid(c,cd,c)
+	qxR = R[0,0]*qx + R[0,1]*qy + R[0,2]*qz
+	qyR = R[1,0]*qx + R[1,1]*qy + R[1,2]*qz
+	qzR = R[2,0]*qx + R[2,1]*qy + R[2,2]*qz
+	qi = np.array([qxR.ravel(), qyR.ravel(), qzR.ravel()]).T
+	return qi
+
+
+## @brief Camera grid query points for a view rotated about the x axis.
+#  @param N Image resolution (pixels per side).
+#  @param angle Rotation angle of the camera in radians.
+#  @param Nsteps Number of samples per ray, defaults to N.
+#  @return Query points of shape (Nsteps*N*N, 3).
+def camera_points(N, angle, Nsteps=None):
+	return view_points(rotation_x(angle), N, Nsteps)
+
+
+## @brief Fractional voxel indices of query points on the datacube grid.
+#  The grid is np.linspace(-Nx/2, Nx/2, Nx) along every axis, as in datacube_points().
+#  @param qi Query points of shape (M, D).
+#  @param shape Shape of the volume along those D axes.
+#  @return Array of shape (D, M) of float indices.
+def grid_index(qi, shape):
+	n = np.array(shape, dtype=np.float64)[:,np.newaxis]
+	u = (qi.T + n/2) * ((n-1)/n)
+	if np.any(u < 0) or np.any(u > n-1):
+		raise ValueError("One of the requested xi is out of bounds")
+	return u
+
+
+## @brief Interpolates the datacube onto the camera grid.
+#  @param points Datacube grid from datacube_points().
+#  @param datacube The density datacube.
+#  @param qi Query points from camera_points().
+#  @param shape Shape of the resulting camera grid.
+#  @param interpolationMethod Method passed to interpn.
+#  @return The camera grid of densities.
+def sample(points, datacube, qi, shape, interpolationMethod='linear'):
+	from scipy.interpolate import interpn
+
+	return interpn(points, datacube, qi, method=interpolationMethod).reshape(shape)
+
+
+## @brief Composites the camera grid slice by slice, back to front.
+#  @param camera_grid Densities with the rays along axis 0.
+#  @param transfer Transfer function mapping log-density to RGBA.
+#  @return RGB image of shape (N, N, 3).
+def composite(camera_grid, transfer=transferFunction):
+	image = np.zeros((camera_grid.shape[1],camera_grid.shape[2],3))
+
+	for dataslice in camera_grid:
+		with np.errstate(divide='ignore'):
+			x = np.log(dataslice)
+		r,g,b,a = transfer(x)
+		image[:,:,0] = a*r + (1-a)*image[:,:,0]
+		image[:,:,1] = a*g + (1-a)*image[:,:,1]
+		image[:,:,2] = a*b + (1-a)*image[:,:,2]
+
+	return image
+
+
+## @brief Composites classified samples back to front.
+#  For callers that classify the whole camera grid at once.
+#  @param r Red of shape (Nsteps, height, width), rays along axis 0.
+#  @param g Green, same shape.
+#  @param b Blue, same shape.
+#  @param a Opacity, same shape.
+#  @return RGB image of shape (height, width, 3).
+def composite_rgba(r, g, b, a):
+	image = np.zeros(a.shape[1:] + (3,))
+
+	for k in range(a.shape[0]):
+		image[:,:,0] = a[k]*r[k] + (1-a[k])*image[:,:,0]
+		image[:,:,1] = a[k]*g[k] + (1-a[k])*image[:,:,1]
+		image[:,:,2] = a[k]*b[k] + (1-a[k])*image[:,:,2]
+
+	return image
+
+
+## @brief Buffers for compositing an image slice by slice without allocating.
+#  Every temporary of the per-slice loop is allocated once per image size and
+#  updated in place; the result matches composite() bit for bit.
+class Workspace:
+	## @brief Creates a workspace.
+	#  @param shape Image shape (height, width), or None to size on first use.
+	#  @param transfer GaussianTransferFunction used for classification. Unlike the
+	#  transfer= parameters elsewhere, arbitrary callables are not supported, since
+	#  the workspace evaluates the Gaussians into its own buffers.
+	def __init__(self, shape=None, transfer=None):
+		if transfer is not None and not isinstance(transfer, GaussianTransferFunction):
+			raise TypeError("Workspace needs a GaussianTransferFunction, got " + type(transfer).__name__ +
+			                "; use composite() for other transfer functions")
+		self.shape = None
+		self.transfer = DEFAULT_TRANSFER if transfer is None else transfer
+		## Buffers allocated over the workspace's lifetime.
+		self.allocations = 0
+		## Buffers allocated since the last begin_frame().
+		self.frame_allocations = 0
+		if shape is not None:
+			self.resize(shape)
+
+	def _empty(self, shape):
+		self.allocations += 1
+		self.frame_allocations += 1
+		return np.empty(shape)
+
+	## @brief (Re)allocates the buffers if the image shape changed.
+	#  @param shape Image shape (height, width).
+	def resize(self, shape):
+		shape = tuple(shape)
+		if shape == self.shape:
+			return
+		self.shape = shape
+		self.x = self._empty(shape)
+		self.gauss = [self._empty(shape) for _ in range(len(self.transfer))]
+		self.a = self._empty(shape)
+		self.one_minus_a = self._empty(shape)
+		self.c = self._empty(shape)
+		self.tmp = self._empty(shape)
+		self.planes = self._empty((3,) + shape)
+		self.image = self._empty(shape + (3,))
+
+	## @brief Starts a new image.
+	#  @param shape Image shape (height, width).
+	def begin_frame(self, shape):
+		self.frame_allocations = 0
+		self.resize(shape)
+		self.planes.fill(0.0)
+
+	def _combine(self, weights, out):
+		np.multiply(self.gauss[0], weights[0], out=out)
+		for g, w in zip(self.gauss[1:], weights[1:]):
+			np.multiply(g, w, out=self.tmp)
+			np.add(out, self.tmp, out=out)
+
+	## @brief Classifies one slice and composites it over the image.
+	#  @param dataslice Densities of shape (height, width).
+	def composite_slice(self, dataslice):
+		with np.errstate(divide='ignore'):
+			np.log(dataslice, out=self.x)
+		for g, center, width in zip(self.gauss, self.transfer.centers, self.transfer.widths):
+			np.subtract(self.x, center, out=g)
+			np.square(g, out=g)
+			np.negative(g, out=g)
+			np.divide(g, width, out=g)
+			np.exp(g, out=g)
+
+		self._combine(self.transfer.weights[3], self.a)
+		np.subtract(1.0, self.a, out=self.one_minus_a)
+		for channel in range(3):
+			plane = self.planes[channel]
+			self._combine(self.transfer.weights[channel], self.c)
+			np.multiply(self.a, self.c, out=self.c)
+			np.multiply(self.one_minus_a, plane, out=self.tmp)
+			np.add(self.c, self.tmp, out=plane)
+
+	## @brief Composites a whole camera grid.
+	#  @param camera_grid Densities with the rays along axis 0.
+	#  @return RGB image of shape (height, width, 3). The buffer is reused by the
+	#  next frame, so copy it to keep it.
+	def composite(self, camera_grid):
+		self.begin_frame(camera_grid.shape[1:])
+		for dataslice in camera_grid:
+			self.composite_slice(dataslice)
+		return self.result()
+
+	## @brief The current image as (height, width, 3), in a reused buffer.
+	def result(self):
+		np.copyto(self.image, np.moveaxis(self.planes, 0, -1))
+		return self.image
+
+
+## @brief Saves a rendered image the same way main() does.
+#  @param image RGB image, clipped to [0, 1] before plotting.
+#  @param filename Output PNG file name.
+def save_image(image, filename):
+	import matplotlib.pyplot as plt
+
+	plt.figure(figsize=(4,4), dpi=80)
+	plt.imshow(np.clip(image,0.0,1.0))
+	plt.axis('off')
+	plt.savefig(filename,dpi=240,  bbox_inches='tight', pad_inches = 0)
+	plt.close()
+
+
+## @brief Encodes an RGB image as PNG bytes without going through matplotlib.
+#  @param image RGB image with values in [0, 1].
+#  @param level zlib compression level.
+#  @return PNG file contents.
+def encode_png(image, level=6):
+	pixels = (np.clip(image,0.0,1.0)*255 + 0.5).astype(np.uint8)
+	height, width = pixels.shape[:2]
+
+	# Every scanline starts with filter type 0 (None)
+	raw = np.zeros((height, width*3 + 1), dtype=np.uint8)
+	raw[:,1:] = pixels[:,:,:3].reshape((height, width*3))
+
+	def chunk(tag, data):
+		return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+	header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+	return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw.tobytes(), level)) + chunk(b'IEND', b'')
@@ -0,0 +1,288 @@
+# Sort-last Distributed Rendering
+import sys
+import queue
+import multiprocessing
+import numpy as np
+import h5py as h5
+from timeit import default_timer as timer
+from volumerender_core import transferFunction, save_image
+from volumerender_camera import orbit
+from volumerender_bricks import brick_box, composite_brick
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_distributed
+#  Sort-last rendering: the volume is split into 2^k sub-volumes by recursive
+#  halving, every rank renders its own sub-volume to premultiplied RGB plus
+#  transmittance, and the partial images are combined by binary-swap
+#  compositing in depth order. The same code runs over plain multiprocessing
+#  queues on one machine or over mpi4py across nodes.
+
+
+## @brief Splits a volume into 2^levels sub-volumes by recursive halving.
+#  Each split halves the longest side, in cells. Ranks are numbered so that the
+#  top bit of a rank picks the side of the first split, the next bit the side
+#  of the second split, and so on.
+#  @param shape Shape (Nx, Ny, Nz) of the datacube.
+#  @param size Number of ranks, a power of two.
+#  @return List over ranks of (lo, hi, splits) with inclusive voxel ranges and
+#  splits a list of (axis, index, side) from the root down.
+def decompose(shape, size):
+	levels = size.bit_length() - 1
+	if size < 1 or 2**levels != size:
+		raise ValueError("binary-swap compositing needs a power-of-two number of ranks")
+
+	def split(lo, hi, depth):
+		if depth == 0:
+			return [(tuple(lo), tuple(hi), [])]
+		cells = [h - l for l, h in zip(lo, hi)]
+		axis = int(np.argmax(cells))
+		if cells[axis] < 2:
+			raise ValueError("volume too small for " + str(size) + " ranks")
+		mid = (lo[axis] + hi[axis]) // 2
+		lower_hi = list(hi)
+		lower_hi[axis] = mid
+		upper_lo = list(lo)
+		upper_lo[axis] = mid
+		lower = [(l, h, [(axis, mid, 0)] + s) for l, h, s in split(lo, lower_hi, depth-1)]
+		upper = [(l, h, [(axis, mid, 1)] + s) for l, h, s in split(upper_lo, hi, depth-1)]
+		return lower + upper
+
+	return split([0, 0, 0], [n - 1 for n in shape], levels)
+
+
+## @brief Whether the lower side of a split plane is in front for a camera.
+#  @param camera Camera from volumerender_camera.
+#  @param axis Axis of the split.
+#  @param coordinate World coordinate of the split plane.
+#  @return True if the lower side is composited over the upper side.
+def lower_in_front(camera, axis, coordinate):
+	origins, directions, t_near, t_far = camera.rays()
+	if camera.perspective:
+		return origins[0,0,axis] < coordinate
+	return directions[0,0,axis] > 0
+
+
+## @brief Composites two partial images, front over back.
+#  @return Tuple (C, T) of the combined premultiplied RGB and transmittance.
+def over(front, back):
+	C_front, T_front = front
+	C_back, T_back = back
+	return C_front + T_front[...,np.newaxis]*C_back, T_front*T_back
+
+
+## @brief Point-to-point transport over multiprocessing queues.
+#  Every rank owns an inbox; messages from other ranks that arrive early are
+#  kept until they are asked for.
+class QueueTransport:
+	def __init__(self, rank, inboxes):
+		self.rank = rank
+		self.size = len(inboxes)
+		self.inboxes = inboxes
+		self.pending = {}
+
+	def send(self, dest, payload):
+		self.inboxes[dest].put((self.rank, payload))
+
+	def recv(self, source):
+		while source not in self.pending:
+			sender, payload = self.inboxes[self.rank].get()
+			self.pending.setdefault(sender, []).append(payload)
+		payload = self.pending[source].pop(0)
+		if not self.pending[source]:
+			del self.pending[source]
+		return payload
+
+	def exchange(self, partner, payload):
+		self.send(partner, payload)
+		return self.recv(partner)
+
+	def gather(self, payload, root=0):
+		if self.rank != root:
+			self.send(root, payload)
+			return None
+		return [payload if source == root else self.recv(source) for source in range(self.size)]
+
+
+## @brief Transport over an mpi4py communicator.
+class MPITransport:
+	def __init__(self, comm=None):
+		if comm is None:
+			from mpi4py import MPI
+			comm = MPI.COMM_WORLD
+		self.comm = comm
+		self.rank = comm.Get_rank()
+		self.size = comm.Get_size()
+
+	def exchange(self, partner, payload):
+		return self.comm.sendrecv(payload, dest=partner, source=partner)
+
+	def gather(self, payload, root=0):
+		return self.comm.gather(payload, root=root)
+
+
+## @brief Binary-swap compositing of the partial images of all ranks.
+#  In round s a rank swaps half of its current rows with the rank differing in
+#  bit s, whose sub-volume is the other side of the matching split plane, and
+#  composites the half it keeps. After k rounds each rank holds 1/2^k of the
+#  final rows, which are gathered on rank 0.
+#  @param transport QueueTransport or MPITransport.
+#  @param C Premultiplied RGB of this rank's sub-volume, shape (height, width, 3).
+#  @param T Transmittance of this rank's sub-volume, shape (height, width).
+#  @param splits Splits of this rank from decompose().
+#  @param camera Camera from volumerender_camera.
+#  @param shape Shape of the datacube.
+#  @return The final image on rank 0, None elsewhere.
+def binary_swap(transport, C, T, splits, camera, shape):
+	rank = transport.rank
+	levels = len(splits)
+	rows = (0, C.shape[0])
+
+	for s in range(levels):
+		axis, index, side = splits[levels - 1 - s]
+		start, stop = rows
+		half = (start + stop) // 2
+		if (rank >> s) & 1 == 0:
+			keep, give = (start, half), (half, stop)
+		else:
+			keep, give = (half, stop), (start, half)
+
+		mine = (C[keep[0]-start:keep[1]-start], T[keep[0]-start:keep[1]-start])
+		theirs = transport.exchange(rank ^ (1 << s), (C[give[0]-start:give[1]-start], T[give[0]-start:give[1]-start]))
+
+		coordinate = brick_box((index,)*3, (index,)*3, shape)[0][axis]
+		if (side == 0) == lower_in_front(camera, axis, coordinate):
+			C, T = over(mine, theirs)
+		else:
+			C, T = over(theirs, mine)
+		rows = keep
+
+	pieces = transport.gather((rows, C))
+	if pieces is None:
+		return None
+	image = np.zeros((camera.height, camera.width, 3))
+	for (start, stop), part in pieces:
+		image[start:stop] = part
+	return image
+
+
+## @brief Renders this rank's sub-volume and joins the binary swap.
+#  @param transport QueueTransport or MPITransport.
+#  @param filename HDF5 file; each rank reads only its own sub-volume.
+#  @param camera Camera from volumerender_camera.
+#  @param dataset Dataset name.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param transfer Transfer function mapping log-density to RGBA.
+#  @return The final image on rank 0, None elsewhere.
+def render_rank(transport, filename, camera, dataset='density', interpolationMethod='linear', transfer=transferFunction):
+	with h5.File(filename, 'r') as f:
+		dset = f[dataset]
+		shape = dset.shape
+		lo, hi, splits = decompose(shape, transport.size)[transport.rank]
+		data = dset[lo[0]:hi[0]+1, lo[1]:hi[1]+1, lo[2]:hi[2]+1]
+
+	C = np.zeros((camera.height, camera.width, 3))
+	T = np.ones((camera.height, camera.width))
+	composite_brick(C, T, camera, data, lo, hi, shape, interpolationMethod, transfer)
+	return binary_swap(transport, C, T, splits, camera, shape)
+
+
+def _worker(rank, inboxes, results, filename, camera, dataset, interpolationMethod):
+	try:
+		image = render_rank(QueueTransport(rank, inboxes), filename, camera, dataset, interpolationMethod)
+	except Exception as error:
+		# Any failing rank reports, since the others may be blocked waiting for it
+		results.put(error)
+		return
+	if rank == 0:
+		results.put(image)
+
+
+## @brief Renders one view with a pool of local processes.
+#  @param filename HDF5 file.
+#  @param camera Camera from volumerender_camera.
+#  @param processes Number of worker processes, a power of two.
+#  @param dataset Dataset name.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param poll Seconds between checks that no worker died without reporting.
+#  @return RGB image of shape (height, width, 3).
+def render_distributed(filename, camera, processes=4, dataset='density', interpolationMethod='linear', poll=1.0):
+	with h5.File(filename, 'r') as f:
+		shape = f[dataset].shape
+	# Fails fast on a bad number of ranks, before any process is started
+	decompose(shape, processes)
+
+	context = multiprocessing.get_context()
+	inboxes = [context.Queue() for _ in range(processes)]
+	results = context.Queue()
+	workers = [context.Process(target=_worker, args=(rank, inboxes, results, filename, camera, dataset, interpolationMethod))
+	           for rank in range(processes)]
+	for worker in workers:
+		worker.start()
+
+	try:
+		while True:
+			try:
+				result = results.get(timeout=poll)
+				break
+			except queue.Empty:
+				for rank, worker in enumerate(workers):
+					if worker.exitcode not in (None, 0):
+						raise RuntimeError("rank " + str(rank) + " exited with code " + str(worker.exitcode))
+		if isinstance(result, Exception):
+			raise result
+	except BaseException:
+		for worker in workers:
+			worker.terminate()
+		raise
+	finally:
+		for worker in workers:
+			worker.join()
+	return result
+
+
+## @brief Distributed volume rendering of datacube.hdf5.
+#  Run directly for local processes, or as `mpirun -n 8 python volumerender_distributed.py --mpi`.
+#  @param Nangles Number of angles for camera rotation.
+#  @param N Image resolution (pixels per side).
+#  @param processes Number of local worker processes (ignored with MPI).
+#  @param mpi Use mpi4py instead of local processes.
+#  @return Total rendering time in seconds (on rank 0).
+def main(Nangles=10, N=180, processes=4, mpi=False):
+	""" Volume Rendering """
+
+	transport = MPITransport() if mpi else None
+	root = transport is None or transport.rank == 0
+	average = np.zeros(Nangles)
+
+	for i, camera in enumerate(orbit(Nangles, width=N)):
+		if root:
+			print('Rendering Scene ' + str(i+1) + ' of ' + str(Nangles) + '.\n')
+		start = timer()
+
+		if transport is None:
+			image = render_distributed('datacube.hdf5', camera, processes)
+		else:
+			image = render_rank(transport, 'datacube.hdf5', camera)
+
+		end = timer()
+		average[i] = end - start
+		if root:
+			print(f"Time to render scene {i+1}: {end - start} seconds")
+			save_image(image, 'volumerender' + str(i) + '.png')
+
+	if root:
+		print(f"Mean rendering time: {np.mean(average)} seconds")
+		print(f"Standard deviation of rendering time: {np.std(average)} seconds")
+		print(f"Max rendering time: {np.max(average)} seconds")
+		print(f"Min rendering time: {np.min(average)} seconds")
+
+	return np.sum(average)
+
+if __name__== "__main__":
+	main(mpi='--mpi' in sys.argv)
@@ -0,0 +1,149 @@
+# Incremental Re-compositing
+import numpy as np
+from collections import OrderedDict
+from timeit import default_timer as timer
+from volumerender_core import transferFunction, load_datacube, save_image
+from volumerender_camera import orbit, sample_camera
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_incremental
+#  Keeps the resampled log-density of the current views, so tuning the transfer
+#  function only re-runs classification and compositing instead of the whole
+#  interpn resampling. Retained samples are float32 and bounded by a byte limit.
+
+
+## @brief Hashable key describing everything that affects a camera's samples.
+#  @param camera Camera from volumerender_camera.
+#  @param interpolationMethod Method used for data interpolation.
+#  @return Tuple key.
+def camera_key(camera, interpolationMethod='linear'):
+	return (camera.orientation.tobytes(), camera.width, camera.height, camera.Nsteps,
+	        camera.extent, camera.depth, camera.fov, camera.distance, camera.window, interpolationMethod)
+
+
+## @brief Least-recently-used store of resampled log-density grids, bounded in bytes.
+#  The cache belongs to one datacube at a time: get() with another array, or
+#  with another version of the same array, drops the retained views first.
+class ResampleCache:
+	## @brief Creates an empty cache.
+	#  @param memory_limit Maximum bytes of retained samples.
+	def __init__(self, memory_limit=1 << 30):
+		self.memory_limit = memory_limit
+		self.nbytes = 0
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		## Datacube and version the retained views were sampled from.
+		self.source = (None, None)
+
+	## @brief Log-density samples of a view, resampling on a miss.
+	#  @param datacube The density datacube. The cache keeps a reference to it, so
+	#  the identity check cannot be fooled by a new array at the same address.
+	#  @param camera Camera from volumerender_camera.
+	#  @param interpolationMethod Method used for data interpolation.
+	#  @param version Token to change after editing the datacube in place, e.g. a
+	#  snapshot number or modification counter.
+	#  @return float32 log-density grid of shape camera.shape.
+	def get(self, datacube, camera, interpolationMethod='linear', version=None):
+		if self.source[0] is not datacube or self.source[1] != version:
+			self.clear()
+			self.source = (datacube, version)
+		key = camera_key(camera, interpolationMethod)
+		if key in self.entries:
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+
+		self.misses += 1
+		with np.errstate(divide='ignore'):
+			logs = np.log(sample_camera(datacube, camera, interpolationMethod)).astype(np.float32)
+		if logs.nbytes <= self.memory_limit:
+			while self.nbytes + logs.nbytes > self.memory_limit:
+				_, evicted = self.entries.popitem(last=False)
+				self.nbytes -= evicted.nbytes
+			self.entries[key] = logs
+			self.nbytes += logs.nbytes
+		return logs
+
+	## @brief Drops every retained view.
+	def clear(self):
+		self.entries.clear()
+		self.nbytes = 0
+		self.source = (None, None)
+
+
+## @brief Classifies and composites log-density samples, back to front.
+#  @param logs Log-density grid with the rays along axis 0.
+#  @param transfer Transfer function mapping log-density to RGBA.
+#  @return RGB image of shape (height, width, 3).
+def composite_logs(logs, transfer=transferFunction):
+	image = np.zeros((logs.shape[1],logs.shape[2],3), dtype=np.float32)
+	for x in logs:
+		r,g,b,a = transfer(x)
+		image[:,:,0] = a*r + (1-a)*image[:,:,0]
+		image[:,:,1] = a*g + (1-a)*image[:,:,1]
+		image[:,:,2] = a*b + (1-a)*image[:,:,2]
+	return image
+
+
+## @brief Renders a fixed set of views for changing transfer functions.
+class Recompositor:
+	## @brief Creates a recompositor.
+	#  @param datacube The density datacube.
+	#  @param cameras Cameras from volumerender_camera.
+	#  @param interpolationMethod Method used for data interpolation.
+	#  @param memory_limit Maximum bytes of retained samples.
+	def __init__(self, datacube, cameras, interpolationMethod='linear', memory_limit=1 << 30):
+		self.datacube = datacube
+		self.cameras = list(cameras)
+		self.interpolationMethod = interpolationMethod
+		self.cache = ResampleCache(memory_limit)
+
+	## @brief Renders every view with a transfer function.
+	#  Views whose samples are retained only re-run classification and compositing.
+	#  @param transfer Transfer function mapping log-density to RGBA.
+	#  @return List of RGB images.
+	def render(self, transfer=transferFunction):
+		return [composite_logs(self.cache.get(self.datacube, camera, self.interpolationMethod), transfer)
+		        for camera in self.cameras]
+
+
+## @brief Renders the orbit of main() twice, with a tweaked transfer function the second time.
+#  @param Nangles Number of angles for camera rotation.
+#  @param N Image resolution (pixels per side).
+#  @param interpolationMethod Method used for data interpolation.
+#  @param memory_limit Maximum bytes of retained samples.
+#  @return Tuple of the first and second render times in seconds.
+def main(Nangles=10, N=180, interpolationMethod='linear', memory_limit=1 << 30):
+	""" Volume Rendering """
+
+	recompositor = Recompositor(load_datacube(), orbit(Nangles, width=N), interpolationMethod, memory_limit)
+
+	start = timer()
+	recompositor.render()
+	first = timer() - start
+	print(f"Full render of {Nangles} views: {first} seconds")
+
+	def brighter(x):
+		r,g,b,a = transferFunction(x)
+		return r, g, b, np.minimum(2*a, 1.0)
+
+	start = timer()
+	images = recompositor.render(brighter)
+	second = timer() - start
+	print(f"Re-composite of {Nangles} views: {second} seconds "
+	      f"({recompositor.cache.hits} cached, {recompositor.cache.misses} resampled)")
+
+	for i, image in enumerate(images):
+		save_image(image, 'volumerender' + str(i) + '.png')
+
+	return first, second
+
+if __name__== "__main__":
+	main()
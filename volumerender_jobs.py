@@ -0,0 +1,235 @@
+# Resumable Batch Rendering
+import os
+import json
+import glob
+from timeit import default_timer as timer
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from volumerender_core import load_datacube, encode_png, Workspace
+from volumerender_camera import Camera, orbit, quaternion_axis_angle, sample_camera
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_jobs
+#  Renders many datacubes along camera paths from a JSON manifest:
+#
+#      {"volumes": "snapshots/datacube_*.hdf5",
+#       "cameras": {"orbit": {"frames": 10, "axis": [1, 0, 0], "start": 0, "stop": 1.5708}},
+#       "camera": {"width": 180, "Nsteps": 180},
+#       "output": "renders/{volume}_{frame:03d}.png",
+#       "dataset": "density", "method": "linear", "workers": 4,
+#       "checkpoint": "renders/checkpoint.jsonl"}
+#
+#  "cameras" is either an orbit or a list of {"angle": a} / {"q": [w, x, y, z]}
+#  entries. Work is scheduled per volume, so a datacube is loaded once for a
+#  run of its pending frames; with fewer volumes than workers each volume's
+#  frames are split into several runs, so every worker has work. Every finished frame
+#  is appended to the checkpoint file, and a rerun skips the frames listed
+#  there, so an interrupted batch resumes where it stopped.
+
+
+## @brief Reads and completes a manifest.
+#  @param manifest File name or dict.
+#  @return Dict with every key filled in. Relative paths resolve against the
+#  manifest's directory; the checkpoint defaults to checkpoint.jsonl next to the output.
+def load_manifest(manifest):
+	base = ''
+	if isinstance(manifest, str):
+		base = os.path.dirname(os.path.abspath(manifest))
+		with open(manifest) as f:
+			manifest = json.load(f)
+	manifest = dict(manifest)
+	for key in ('volumes', 'cameras', 'output'):
+		if key not in manifest:
+			raise ValueError("manifest is missing " + repr(key))
+
+	def resolve(path):
+		return os.path.join(base, path)
+
+	volumes = manifest['volumes']
+	if isinstance(volumes, str):
+		volumes = sorted(glob.glob(resolve(volumes)))
+	else:
+		volumes = [resolve(volume) for volume in volumes]
+	if not volumes:
+		raise FileNotFoundError("no volumes match " + repr(manifest['volumes']))
+
+	manifest['volumes'] = volumes
+	manifest['output'] = resolve(manifest['output'])
+	manifest['checkpoint'] = resolve(manifest.get('checkpoint', os.path.join(os.path.dirname(manifest['output']), 'checkpoint.jsonl')))
+	manifest.setdefault('camera', {})
+	manifest.setdefault('dataset', 'density')
+	manifest.setdefault('method', 'linear')
+	manifest.setdefault('workers', None)
+	return manifest
+
+
+## @brief Cameras described by a manifest.
+#  @param manifest Manifest from load_manifest().
+#  @return List of Cameras.
+def manifest_cameras(manifest):
+	spec = manifest['cameras']
+	options = manifest['camera']
+	if isinstance(spec, dict) and 'orbit' in spec:
+		path = dict(spec['orbit'])
+		frames = path.pop('frames')
+		return orbit(frames, **path, **options)
+
+	cameras = []
+	for entry in spec:
+		if 'q' in entry:
+			orientation = entry['q']
+		else:
+			orientation = quaternion_axis_angle((1.0, 0.0, 0.0), entry.get('angle', 0.0))
+		cameras.append(Camera(orientation, **options))
+	return cameras
+
+
+## @brief Output file of one frame.
+#  @param pattern Output pattern with {volume} (file name without extension), {index} and {frame}.
+#  @param volume Volume file.
+#  @param index Position of the volume in the manifest.
+#  @param frame Frame number.
+#  @return File name.
+def output_name(pattern, volume, index, frame):
+	name = os.path.splitext(os.path.basename(volume))[0]
+	return pattern.format(volume=name, index=index, frame=frame)
+
+
+## @brief Frames already recorded in a checkpoint file.
+#  A partly written last line (from a crash) is ignored and terminated, so the
+#  next entry appended starts on a line of its own.
+#  @param checkpoint Checkpoint file.
+#  @return Set of (volume, frame).
+def completed_frames(checkpoint):
+	done = set()
+	if not os.path.exists(checkpoint):
+		return done
+	with open(checkpoint, 'rb') as f:
+		data = f.read()
+	for line in data.splitlines():
+		try:
+			entry = json.loads(line)
+		except ValueError:
+			continue
+		done.add((entry['volume'], entry['frame']))
+	if data and not data.endswith(b'\n'):
+		with open(checkpoint, 'ab') as f:
+			f.write(b'\n')
+	return done
+
+
+## @brief Appends one finished frame to the checkpoint file.
+#  Each entry is a single O_APPEND write, so concurrent workers do not interleave.
+#  @param checkpoint Checkpoint file.
+#  @param volume Volume file.
+#  @param frame Frame number.
+#  @param seconds Render time of the frame.
+def record_frame(checkpoint, volume, frame, seconds):
+	line = json.dumps({'volume': volume, 'frame': frame, 'seconds': seconds}) + '\n'
+	fd = os.open(checkpoint, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+	try:
+		os.write(fd, line.encode())
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+
+## @brief Splits the pending frames of each volume into tasks for the workers.
+#  Volumes keep all their frames in one task while there are enough volumes to
+#  go round; otherwise each volume's frames are shared out among several
+#  contiguous tasks, each of which loads the datacube once.
+#  @param pending List of (volume index, frame numbers).
+#  @param workers Number of worker processes.
+#  @return List of (volume index, frame numbers), one per task.
+def split_tasks(pending, workers):
+	parts = -(-workers // max(len(pending), 1))
+	tasks = []
+	for index, frames in pending:
+		count = min(parts, len(frames))
+		for k in range(count):
+			tasks.append((index, frames[k*len(frames)//count:(k+1)*len(frames)//count]))
+	return tasks
+
+
+## @brief Renders pending frames of one volume (runs in a worker process).
+#  @param manifest Manifest from load_manifest().
+#  @param index Position of the volume in the manifest.
+#  @param frames Frame numbers to render.
+#  @return Tuple (volume, number of frames rendered, seconds including the load).
+def render_volume(manifest, index, frames):
+	start = timer()
+	volume = manifest['volumes'][index]
+	cameras = manifest_cameras(manifest)
+	datacube = load_datacube(volume, manifest['dataset'])
+	workspace = Workspace()
+
+	for frame in frames:
+		frame_start = timer()
+		image = workspace.composite(sample_camera(datacube, cameras[frame], manifest['method']))
+		name = output_name(manifest['output'], volume, index, frame)
+		directory = os.path.dirname(name)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		# Write then rename, so a crash never leaves a truncated image behind
+		with open(name + '.part', 'wb') as f:
+			f.write(encode_png(image))
+		os.replace(name + '.part', name)
+		record_frame(manifest['checkpoint'], volume, frame, timer() - frame_start)
+
+	return volume, len(frames), timer() - start
+
+
+## @brief Runs a manifest, skipping frames in its checkpoint.
+#  @param manifest File name or dict.
+#  @param workers Number of worker processes, overriding the manifest.
+#  @return Dict with frames rendered, frames skipped, seconds and frames per second.
+def run_jobs(manifest, workers=None):
+	manifest = load_manifest(manifest)
+	Nframes = len(manifest_cameras(manifest))
+	done = completed_frames(manifest['checkpoint'])
+
+	pending = []
+	for index, volume in enumerate(manifest['volumes']):
+		frames = [frame for frame in range(Nframes) if (volume, frame) not in done]
+		if frames:
+			pending.append((index, frames))
+	total = len(manifest['volumes'])*Nframes
+	remaining = sum(len(frames) for _, frames in pending)
+	print(f"{total - remaining} of {total} frames already done, {remaining} to render "
+	      f"from {len(pending)} volume(s)")
+
+	start = timer()
+	rendered = 0
+	workers = workers or manifest['workers'] or os.cpu_count()
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		futures = [pool.submit(render_volume, manifest, index, frames) for index, frames in split_tasks(pending, workers)]
+		for future in as_completed(futures):
+			volume, count, seconds = future.result()
+			rendered += count
+			elapsed = timer() - start
+			print(f"{os.path.basename(volume)}: {count} frames in {seconds:.2f} s; "
+			      f"{rendered}/{remaining} done, {rendered/elapsed:.2f} frames/s")
+
+	elapsed = timer() - start
+	fps = rendered/elapsed if rendered else 0.0
+	print(f"Rendered {rendered} frames in {elapsed} seconds ({fps} frames/s)")
+	return {'rendered': rendered, 'skipped': total - remaining, 'seconds': elapsed, 'fps': fps}
+
+
+## @brief Runs a manifest from the command line.
+#  @param manifest Manifest file.
+#  @param workers Number of worker processes.
+#  @return Result of run_jobs().
+def main(manifest='manifest.json', workers=None):
+	""" Volume Rendering """
+
+	return run_jobs(manifest, workers)
+
+if __name__== "__main__":
+	import sys
+	main(*sys.argv[1:2], *[int(workers) for workers in sys.argv[2:3]])
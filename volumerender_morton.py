@@ -0,0 +1,244 @@
+# Bricked Z-order Layout
+import numpy as np
+from timeit import default_timer as timer
+from volumerender_core import load_datacube, composite, grid_index
+from volumerender_camera import Camera, quaternion_axis_angle
+from volumerender_clip import clipped_points
+from volumerender_sampling import nearest_index, nearest_voxel, sample_uniform
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_morton
+#  In-memory datacube layout made of small cubic bricks stored contiguously,
+#  with the bricks in Z-order (Morton order). Neighbouring voxels along any
+#  axis then lie close together in memory, so rays rotated away from the
+#  datacube axes touch fewer cache lines than on the C-ordered array, where a
+#  step along x jumps Ny*Nz voxels.
+#
+#  The address of voxel (i, j, k) is
+#      offset[brick(i) + brick(j) + brick(k)] + local(i) + local(j) + local(k)
+#  with one small lookup table per axis for the brick and local parts, so the
+#  samplers below cost two gathers per voxel instead of one, plus table lookups.
+
+
+## @brief Interleaves the bits of three integer coordinates.
+#  @param i, j, k Integer arrays of the same shape.
+#  @return Morton codes, i in the most significant position.
+def morton_code(i, j, k):
+	code = np.zeros(np.shape(i), dtype=np.int64)
+	for bit in range(21):
+		for shift, axis in ((2, i), (1, j), (0, k)):
+			code |= ((np.asarray(axis, dtype=np.int64) >> bit) & 1) << (3*bit + shift)
+	return code
+
+
+## @brief Datacube stored as Z-ordered cubic bricks.
+class BrickedVolume:
+	## @brief Rearranges a datacube into the bricked layout.
+	#  @param datacube The density datacube.
+	#  @param brick Brick side in voxels, a power of two.
+	def __init__(self, datacube, brick=8):
+		if brick < 1 or brick & (brick - 1):
+			raise ValueError("brick must be a power of two, got " + str(brick))
+		self.shape = datacube.shape
+		self.dtype = datacube.dtype
+		self.brick = brick
+		nb = [-(-n // brick) for n in self.shape]
+		padded = np.pad(datacube, [(0, b*brick - n) for b, n in zip(nb, self.shape)], mode='edge')
+		bricks = padded.reshape(nb[0], brick, nb[1], brick, nb[2], brick).transpose(0, 2, 4, 1, 3, 5)
+		bricks = bricks.reshape(-1, brick**3)
+
+		bi, bj, bk = np.meshgrid(*[np.arange(n) for n in nb], indexing='ij')
+		order = np.argsort(morton_code(bi, bj, bk).ravel(), kind='stable')
+		## Voxels, brick after brick in Z-order, each brick in C order.
+		self.data = np.ascontiguousarray(bricks[order]).ravel()
+		## Start of each brick in data, indexed by the C-order brick number.
+		self.offset = np.empty(len(order), dtype=np.intp)
+		self.offset[order] = np.arange(len(order)) * brick**3
+
+		shift = brick.bit_length() - 1
+		strides = (nb[1]*nb[2], nb[2], 1)
+		local = (brick*brick, brick, 1)
+		self._brick_table = [(np.arange(n) >> shift) * s for n, s in zip(self.shape, strides)]
+		self._local_table = [(np.arange(n) & (brick - 1)) * s for n, s in zip(self.shape, local)]
+
+	@property
+	def nbytes(self):
+		return self.data.nbytes + self.offset.nbytes
+
+	## @brief Addresses of voxels in data.
+	#  @param i, j, k Integer voxel indices.
+	#  @return Indices into data.
+	def address(self, i, j, k):
+		bx, by, bz = self._brick_table
+		lx, ly, lz = self._local_table
+		return self.offset[bx[i] + by[j] + bz[k]] + (lx[i] + ly[j] + lz[k])
+
+	## @brief Converts back to a C-ordered array.
+	def to_array(self):
+		i, j, k = np.meshgrid(*[np.arange(n) for n in self.shape], indexing='ij')
+		return self.data[self.address(i, j, k)]
+
+
+## @brief Loads a datacube straight into the bricked layout.
+#  @param filename HDF5 file.
+#  @param dataset Dataset name.
+#  @param brick Brick side in voxels.
+#  @return BrickedVolume.
+def load_bricked(filename='datacube.hdf5', dataset='density', brick=8):
+	return BrickedVolume(load_datacube(filename, dataset), brick)
+
+
+## @brief Nearest-neighbour samples of a bricked volume.
+#  Ties round down, as in interpn.
+#  @param volume BrickedVolume.
+#  @param qi Query points of shape (M, 3).
+#  @return Samples of shape (M,).
+def sample_nearest(volume, qi):
+	i = nearest_voxel(qi, volume.shape)
+	return volume.data[volume.address(i[0], i[1], i[2])]
+
+
+## @brief Trilinearly interpolated samples of a bricked volume.
+#  Same weights and summation order as volumerender_sampling.sample_linear.
+#  @param volume BrickedVolume.
+#  @param qi Query points of shape (M, 3).
+#  @param dtype Float type of the weights and result.
+#  @return Samples of shape (M,).
+def sample_linear(volume, qi, dtype=np.float64):
+	u = grid_index(qi, volume.shape)
+	i0 = np.minimum(np.floor(u).astype(np.intp), np.array(volume.shape)[:,np.newaxis]-2)
+	wi, wj, wk = (u - i0).astype(dtype)
+	# Brick and local parts of the lower and upper index on each axis
+	brick = [(table[i], table[i+1]) for table, i in zip(volume._brick_table, i0)]
+	local = [(table[i], table[i+1]) for table, i in zip(volume._local_table, i0)]
+
+	out = np.zeros(len(wi), dtype=dtype)
+	for di in (0, 1):
+		for dj in (0, 1):
+			for dk in (0, 1):
+				weight = (wi if di else 1-wi) * (wj if dj else 1-wj) * (wk if dk else 1-wk)
+				index = volume.offset[brick[0][di] + brick[1][dj] + brick[2][dk]]
+				index += local[0][di] + local[1][dj] + local[2][dk]
+				out += volume.data[index] * weight
+	return out
+
+
+## @brief Order in which to gather the inside samples of a camera grid.
+#  @param inside Mask of shape (Nsteps, height, width) from clipped_points().
+#  @param tile Side of the square pixel tiles, or None for the C order of the
+#  grid (slice after slice). With tiles, all samples of a tile's rays are
+#  gathered together, so consecutive gathers stay within a narrow column of the volume.
+#  @return Permutation of the inside samples, or None for C order.
+def traversal_order(inside, tile=None):
+	if tile is None:
+		return None
+	_, i, j = np.nonzero(inside)
+	columns = -(-inside.shape[2] // tile)
+	return np.argsort((i // tile)*columns + j // tile, kind='stable')
+
+
+## @brief Resamples a bricked volume onto a camera grid.
+#  Samples outside the volume are transparent, as in sample_clipped.
+#  @param volume BrickedVolume.
+#  @param camera Camera.
+#  @param interpolationMethod 'nearest' or 'linear'.
+#  @param tile Pixel tile side for traversal_order(), or None.
+#  @return Camera grid of shape camera.shape.
+def sample_camera(volume, camera, interpolationMethod='linear', tile=None):
+	if interpolationMethod == 'nearest':
+		sampler = sample_nearest
+	elif interpolationMethod == 'linear':
+		sampler = sample_linear
+	else:
+		raise ValueError("interpolationMethod must be 'nearest' or 'linear'")
+	inside, qi = clipped_points(camera, volume.shape)
+	return _gather(inside, qi, lambda q: sampler(volume, q), traversal_order(inside, tile))
+
+
+def _gather(inside, qi, sampler, order):
+	camera_grid = np.zeros(inside.shape)
+	if not len(qi):
+		return camera_grid
+	if order is None:
+		camera_grid[inside] = sampler(qi)
+	else:
+		values = np.empty(len(qi))
+		values[order] = sampler(qi[order])
+		camera_grid[inside] = values
+	return camera_grid
+
+
+## @brief Locality of a sequence of memory accesses.
+#  @param addresses Element indices in access order.
+#  @param itemsize Bytes per element.
+#  @param window Number of consecutive accesses per window.
+#  @param block Cache line (64) or page (4096) size in bytes.
+#  @return Mean number of distinct blocks touched per window; lower is better.
+def distinct_blocks(addresses, itemsize=8, window=4096, block=64):
+	blocks = np.asarray(addresses, dtype=np.int64) * itemsize // block
+	blocks = blocks[:len(blocks) // window * window].reshape(-1, window)
+	if not len(blocks):
+		return 0.0
+	blocks = np.sort(blocks, axis=1)
+	return float(np.mean(1 + np.count_nonzero(np.diff(blocks, axis=1), axis=1)))
+
+
+## @brief Compares the bricked layout with the C-ordered datacube across rotation angles.
+#  Both layouts use the same arithmetic samplers on the same clipped camera
+#  points, so the difference is the memory layout (and traversal) alone. Locality
+#  is measured on the nearest-voxel addresses as distinct 64-byte lines and
+#  4 KiB pages per 4096 consecutive gathers. With 8-voxel float64 bricks a brick
+#  row is exactly one line, so the line counts of both layouts agree and the
+#  layouts differ at page (TLB) granularity.
+#  @param N Image resolution (pixels per side).
+#  @param angles Rotation angles in radians.
+#  @param axis Rotation axis.
+#  @param brick Brick side in voxels.
+#  @param tile Pixel tile side for traversal_order(), or None for slice order.
+#  @param interpolationMethod 'nearest' or 'linear'.
+#  @return List of dicts with the angle and, per layout, seconds per frame, lines and pages per window.
+def main(N=180, angles=(0.0, np.pi/8, np.pi/4, 3*np.pi/8, np.pi/2), axis=(1.0, 0.0, 0.0), brick=8, tile=None,
+         interpolationMethod='linear'):
+	""" Volume Rendering """
+
+	datacube = load_datacube()
+	start = timer()
+	volume = BrickedVolume(datacube, brick)
+	print(f"Bricked layout ({brick}^3 bricks) built in {timer() - start} seconds")
+	results = []
+
+	for angle in angles:
+		camera = Camera(quaternion_axis_angle(axis, angle), width=N)
+		inside, qi = clipped_points(camera, datacube.shape)
+		order = traversal_order(inside, tile)
+
+		start = timer()
+		image = composite(_gather(inside, qi, lambda q: sample_uniform(datacube, q, (len(q),), interpolationMethod), order))
+		linear = timer() - start
+
+		start = timer()
+		bricked = composite(sample_camera(volume, camera, interpolationMethod, tile))
+		morton = timer() - start
+
+		visited = qi if order is None else qi[order]
+		i = nearest_voxel(visited, datacube.shape)
+		result = {'angle': angle, 'linear': linear, 'bricked': morton}
+		for layout, addresses in (('linear', nearest_index(visited, datacube.shape)), ('bricked', volume.address(*i))):
+			result[layout + '_lines'] = distinct_blocks(addresses, datacube.itemsize, block=64)
+			result[layout + '_pages'] = distinct_blocks(addresses, datacube.itemsize, block=4096)
+
+		print(f"angle {angle:.3f}: linear layout {linear} s ({result['linear_lines']:.0f} lines, "
+		      f"{result['linear_pages']:.0f} pages), bricked {morton} s ({result['bricked_lines']:.0f} lines, "
+		      f"{result['bricked_pages']:.0f} pages), max image difference {np.max(np.abs(image - bricked))}")
+		results.append(result)
+
+	return results
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,157 @@
+# Multi-field Rendering
+import numpy as np
+from timeit import default_timer as timer
+from volumerender_core import load_datacube, composite_rgba, save_image, GaussianTransferFunction, DEFAULT_TRANSFER
+from volumerender_camera import orbit
+from volumerender_clip import clipped_points
+from volumerender_sampling import sample_fields
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_multifield
+#  Renders several datasets of the same file (density, potential, velocity
+#  magnitude, ...) in one pass. The rays are clipped and the interpolation
+#  weights computed once, every field is sampled with them, classified with
+#  its own transfer function, and then either mixed into one image or
+#  composited into one image per field.
+
+
+## @brief A dataset and how to classify it.
+class Field:
+	## @brief Describes a field.
+	#  @param dataset Dataset name in the HDF5 file.
+	#  @param transfer Transfer function mapping the (log-)value to RGBA.
+	#  @param log Classify log(value) like the density (True), or the value itself, e.g. for a signed potential.
+	def __init__(self, dataset, transfer=DEFAULT_TRANSFER, log=True):
+		self.dataset = dataset
+		self.transfer = transfer
+		self.log = log
+
+	def __repr__(self):
+		return 'Field(' + repr(self.dataset) + ', log=' + str(self.log) + ')'
+
+	## @brief Classifies samples of the field.
+	#  @param values Samples; non-positive ones are transparent when log is True.
+	#  @return Tuple (r, g, b, a).
+	def classify(self, values):
+		if self.log:
+			with np.errstate(divide='ignore', invalid='ignore'):
+				values = np.log(values)
+			values[np.isnan(values)] = -np.inf
+		return self.transfer(values)
+
+
+## @brief Transfer function with bands at the quartiles of a field, for linear classification.
+#  @param volume Datacube of the field.
+#  @return GaussianTransferFunction with the colours of DEFAULT_TRANSFER.
+def quartile_transfer(volume):
+	centers = np.percentile(volume, [75, 50, 25])
+	spread = max(float(centers[0] - centers[2]), np.finfo(np.float64).tiny)
+	return GaussianTransferFunction(centers, [(0.05*spread)**2]*3, DEFAULT_TRANSFER.weights)
+
+
+## @brief Loads several datasets that share a grid.
+#  @param filename HDF5 file.
+#  @param fields Fields (or dataset names).
+#  @return List of datacubes, in the order of fields.
+def load_fields(filename, fields):
+	volumes = [load_datacube(filename, getattr(field, 'dataset', field)) for field in fields]
+	if any(volume.shape != volumes[0].shape for volume in volumes):
+		raise ValueError("fields must share the grid, got shapes " + str([volume.shape for volume in volumes]))
+	return volumes
+
+
+## @brief Mixes the classified samples of several fields at each sample.
+#  Opacities combine as 1 - prod(1 - a_i) and colours are averaged with
+#  weights a_i, so a single field is unchanged.
+#  @param classified List of (r, g, b, a) tuples.
+#  @return Tuple (r, g, b, a).
+def mix(classified):
+	transparency = np.ones_like(classified[0][3])
+	total = np.zeros_like(transparency)
+	colour = [np.zeros_like(transparency) for _ in range(3)]
+	for r, g, b, a in classified:
+		transparency *= 1 - a
+		total += a
+		for channel, c in zip(colour, (r, g, b)):
+			channel += a*c
+	for channel in colour:
+		np.divide(channel, total, out=channel, where=total > 0)
+	return colour[0], colour[1], colour[2], 1 - transparency
+
+
+## @brief Samples and classifies several fields along the same rays in one pass.
+#  Samples outside the volume are transparent, as in volumerender_clip.
+#  @param volumes Datacubes on a common grid, e.g. from load_fields().
+#  @param fields Fields, one per volume.
+#  @param camera Camera from volumerender_camera.
+#  @param interpolationMethod 'nearest' or 'linear'.
+#  @return List of (r, g, b, a) tuples of shape camera.shape, in the order of fields.
+def classify_fields(volumes, fields, camera, interpolationMethod='linear'):
+	inside, qi = clipped_points(camera, volumes[0].shape)
+	grids = [np.zeros(camera.shape) for _ in volumes]
+	if len(qi):
+		for grid, samples in zip(grids, sample_fields(volumes, qi, interpolationMethod)):
+			grid[inside] = samples
+	return [field.classify(grid) for field, grid in zip(fields, grids)]
+
+
+## @brief Renders several fields along the same rays in one pass.
+#  @param volumes Datacubes on a common grid, e.g. from load_fields().
+#  @param fields Fields, one per volume.
+#  @param camera Camera from volumerender_camera.
+#  @param interpolationMethod 'nearest' or 'linear'.
+#  @param combine Mix the fields into one image (True) or return one image per field.
+#  @return RGB image of shape (height, width, 3), or a list of them in the order of fields.
+def render_fields(volumes, fields, camera, interpolationMethod='linear', combine=True):
+	classified = classify_fields(volumes, fields, camera, interpolationMethod)
+	if combine:
+		return composite_rgba(*mix(classified))
+	return [composite_rgba(*rgba) for rgba in classified]
+
+
+## @brief Compares one-pass multi-field rendering with one render per field.
+#  @param datasets Dataset names. The first is classified like the density, the
+#  others linearly with quartile_transfer().
+#  @param Nangles Number of angles for camera rotation.
+#  @param N Image resolution (pixels per side).
+#  @param interpolationMethod 'nearest' or 'linear'.
+#  @return Tuple (seconds for separate renders, seconds for one pass).
+def main(datasets=('density',), Nangles=3, N=180, interpolationMethod='linear'):
+	""" Volume Rendering """
+
+	volumes = load_fields('datacube.hdf5', datasets)
+	fields = [Field(datasets[0])] + [Field(name, quartile_transfer(volume), log=False)
+	                                 for name, volume in zip(datasets[1:], volumes[1:])]
+	separate = 0.0
+	single = 0.0
+
+	for i, camera in enumerate(orbit(Nangles, width=N)):
+		print('Rendering Scene ' + str(i+1) + ' of ' + str(Nangles) + '.\n')
+		start = timer()
+		for field, volume in zip(fields, volumes):
+			render_fields([volume], [field], camera, interpolationMethod, combine=False)
+		separate += timer() - start
+
+		# Per-field and combined images from the same traversal
+		start = timer()
+		classified = classify_fields(volumes, fields, camera, interpolationMethod)
+		images = [composite_rgba(*rgba) for rgba in classified]
+		combined = composite_rgba(*mix(classified))
+		single += timer() - start
+
+		for field, image in zip(fields, images):
+			save_image(image, 'volumerender_' + field.dataset + str(i) + '.png')
+		save_image(combined, 'volumerender_fields' + str(i) + '.png')
+
+	print(f"One render per field: {separate} seconds")
+	print(f"One pass, per-field and combined images: {single} seconds")
+	return separate, single
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,84 @@
+# Instrumented Rendering Pipeline
+import numpy as np
+from volumerender_core import transferFunction, load_datacube, composite_rgba, encode_png
+from volumerender_camera import orbit, uses_slab_path
+from volumerender_slab import sample_slabs
+from volumerender_clip import clipped_points, sample_inside
+from volumerender_profile import Profiler, NULL_PROFILER
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_pipeline
+#  The rendering pipeline split into the stages the profiler reports:
+#  load, grid, sample, classify, composite and encode.
+
+
+## @brief Renders one camera view, reporting each stage to a profiler.
+#  @param datacube The density datacube.
+#  @param camera Camera from volumerender_camera.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param transfer Transfer function mapping log-density to RGBA.
+#  @param profiler Profiler receiving the grid, sample, classify and composite stages.
+#  @return RGB image of shape (height, width, 3).
+def render_frame(datacube, camera, interpolationMethod='linear', transfer=transferFunction, profiler=NULL_PROFILER):
+	with profiler.stage('grid'):
+		slab = uses_slab_path(camera, datacube.shape, interpolationMethod)
+		if not slab:
+			inside, qi = clipped_points(camera, datacube.shape)
+
+	with profiler.stage('sample'):
+		if slab:
+			camera_grid = sample_slabs(datacube, camera.matrix, camera.width, camera.Nsteps, interpolationMethod)
+		else:
+			camera_grid = sample_inside(datacube, camera, inside, qi, interpolationMethod)
+
+	with profiler.stage('classify'):
+		with np.errstate(divide='ignore'):
+			r,g,b,a = transfer(np.log(camera_grid))
+
+	with profiler.stage('composite'):
+		image = composite_rgba(r, g, b, a)
+
+	return image
+
+
+## @brief Renders an orbit with per-stage profiling.
+#  @param Nangles Number of angles for camera rotation.
+#  @param N Image resolution (pixels per side).
+#  @param interpolationMethod Method used for data interpolation.
+#  @param profile Record stages; False leaves a no-op profiler in place.
+#  @param memory Track peak memory per stage.
+#  @return The Profiler.
+def main(Nangles=10, N=180, interpolationMethod='linear', profile=True, memory=True):
+	""" Volume Rendering """
+
+	profiler = Profiler(enabled=profile, memory=memory)
+
+	with profiler.stage('load'):
+		datacube = load_datacube()
+
+	for i, camera in enumerate(orbit(Nangles, width=N)):
+		print('Rendering Scene ' + str(i+1) + ' of ' + str(Nangles) + '.\n')
+		profiler.frame = i
+
+		image = render_frame(datacube, camera, interpolationMethod, profiler=profiler)
+
+		with profiler.stage('encode'):
+			with open('volumerender' + str(i) + '.png', 'wb') as f:
+				f.write(encode_png(image))
+
+	profiler.close()
+	if profile:
+		profiler.print_summary()
+		profiler.to_json('profile.json')
+		profiler.to_chrome_trace('profile_trace.json')
+
+	return profiler
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,142 @@
+# Pre-integrated Classification
+import numpy as np
+from functools import lru_cache
+from timeit import default_timer as timer
+from volumerender_core import transferFunction, load_datacube, camera_points, save_image
+from volumerender_sampling import sample_uniform
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_preintegrated
+#  Pre-integrated classification: the transfer function is integrated once over
+#  every (front, back) pair of log-density values, so a ray can be sampled with
+#  far fewer steps than the output resolution without banding around the narrow
+#  Gaussian peaks of transferFunction.
+
+# Log-density range covered by the table. transferFunction is ~0 outside it.
+XMIN = -8.0
+XMAX = 14.0
+
+
+## @brief Builds the pre-integrated transfer function table.
+#  Entry [f, b] holds the premultiplied RGB and the opacity of one ray segment
+#  whose log-density goes linearly from bin b (back) to bin f (front).
+#  Opacities are corrected for the segment length, so a segment of `length`
+#  reference steps is equivalent to `length` samples of the dense renderer.
+#  @param transfer Transfer function mapping log-density to RGBA. Tables are cached
+#  per transfer function, so equal GaussianTransferFunction instances share one.
+#  @param length Segment length in reference (N-sample) steps.
+#  @param Nsub Sub-samples integrated per segment, defaults to 4*ceil(length).
+#  @param Nbins Number of log-density bins per table axis.
+#  @param xmin Lowest log-density in the table.
+#  @param xmax Highest log-density in the table.
+#  @return float32 table of shape (Nbins, Nbins, 4).
+@lru_cache(maxsize=8)
+def preintegrate(transfer=transferFunction, length=1.0, Nsub=None, Nbins=512, xmin=XMIN, xmax=XMAX):
+	if Nsub is None:
+		Nsub = 4*max(1, int(np.ceil(length)))
+	x = np.linspace(xmin, xmax, Nbins)
+	front = x[:,np.newaxis]
+	back = x[np.newaxis,:]
+
+	table = np.zeros((Nbins,Nbins,4))
+	for j in range(1, Nsub+1):
+		r,g,b,a = transfer(back + (front - back)*j/Nsub)
+		a = 1.0 - (1.0 - np.clip(a,0.0,1.0))**(length/Nsub)
+		table[:,:,0] = a*r + (1-a)*table[:,:,0]
+		table[:,:,1] = a*g + (1-a)*table[:,:,1]
+		table[:,:,2] = a*b + (1-a)*table[:,:,2]
+		table[:,:,3] = a   + (1-a)*table[:,:,3]
+
+	table = table.astype(np.float32)
+	table.flags.writeable = False
+	return table
+
+
+## @brief Maps log-density values to table bins.
+#  @param x Log-density values.
+#  @param Nbins Number of table bins.
+#  @param xmin Lowest log-density in the table.
+#  @param xmax Highest log-density in the table.
+#  @return Integer bin indices.
+def table_index(x, Nbins, xmin=XMIN, xmax=XMAX):
+	idx = np.rint((x - xmin) * ((Nbins-1)/(xmax - xmin)))
+	np.clip(idx, 0, Nbins-1, out=idx)
+	idx[np.isnan(idx)] = 0
+	return idx.astype(np.intp)
+
+
+## @brief Composites a camera grid using a pre-integrated table.
+#  @param camera_grid Densities with the rays along axis 0 (back to front).
+#  @param table Table from preintegrate().
+#  @param transfer Transfer function used for the first sample of each ray.
+#  @param xmin Lowest log-density in the table.
+#  @param xmax Highest log-density in the table.
+#  @return RGB image of shape (N, N, 3).
+def render_preintegrated(camera_grid, table, transfer=transferFunction, xmin=XMIN, xmax=XMAX):
+	Nbins = table.shape[0]
+	with np.errstate(divide='ignore'):
+		logs = np.log(camera_grid)
+
+	image = np.zeros((camera_grid.shape[1],camera_grid.shape[2],3))
+	r,g,b,a = transfer(logs[0])
+	image[:,:,0] = a*r
+	image[:,:,1] = a*g
+	image[:,:,2] = a*b
+
+	back = table_index(logs[0], Nbins, xmin, xmax)
+	for k in range(1, camera_grid.shape[0]):
+		front = table_index(logs[k], Nbins, xmin, xmax)
+		segment = table[front, back]
+		image *= 1 - segment[:,:,3:]
+		image += segment[:,:,:3]
+		back = front
+
+	return image
+
+
+## @brief Volume rendering with pre-integrated classification.
+#  @param N Image resolution (pixels per side).
+#  @param Nsteps Samples per ray, independent of N (e.g. N//2 or N//4).
+#  @param Nangles Number of angles for camera rotation.
+#  @param interpolationMethod Method used for data interpolation.
+#  @return Total rendering time in seconds.
+def main(N=180, Nsteps=60, Nangles=10, interpolationMethod='linear'):
+	""" Volume Rendering """
+
+	datacube = load_datacube()
+
+	# Segment length in units of the dense (N samples per ray) renderer
+	table = preintegrate(length=(N-1)/(Nsteps-1))
+
+	average = np.zeros(Nangles)
+
+	for i in range(Nangles):
+		print('Rendering Scene ' + str(i+1) + ' of ' + str(Nangles) + '.\n')
+		start = timer()
+
+		angle = np.pi/2 * i / Nangles
+		qi = camera_points(N, angle, Nsteps)
+		camera_grid = sample_uniform(datacube, qi, (Nsteps,N,N), interpolationMethod)
+		image = render_preintegrated(camera_grid, table)
+
+		end = timer()
+		print(f"Time to render scene {i+1}: {end - start} seconds")
+		average[i] = end - start
+
+		save_image(image, 'volumerender' + str(i) + '.png')
+
+	print(f"Mean rendering time: {np.mean(average)} seconds")
+	print(f"Standard deviation of rendering time: {np.std(average)} seconds")
+	print(f"Max rendering time: {np.max(average)} seconds")
+	print(f"Min rendering time: {np.min(average)} seconds")
+
+	return np.sum(average)
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,150 @@
+# Per-stage Profiling
+import os
+import sys
+import json
+import time
+import tracemalloc
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_profile
+#  Records wall time, CPU time and peak memory of every pipeline stage (load,
+#  grid, sample, classify, composite, encode) per frame, and exports them as
+#  JSON or in the Chrome trace event format (chrome://tracing, Perfetto).
+#  A disabled Profiler hands out one shared no-op context, so instrumented code
+#  pays a method call per stage and nothing else.
+
+
+## @brief Maximum resident set size of the process so far, in bytes.
+#  @return Bytes, or None where the resource module is unavailable.
+def max_rss():
+	if resource is None:
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes, macOS bytes
+	return rss if sys.platform == 'darwin' else rss*1024
+
+
+class _NullStage:
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+	def __init__(self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+
+	def __enter__(self):
+		if self.profiler.memory:
+			tracemalloc.reset_peak()
+			self.traced = tracemalloc.get_traced_memory()[0]
+		self.cpu = time.process_time()
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		wall = time.perf_counter() - self.start
+		cpu = time.process_time() - self.cpu
+		record = {'frame': self.profiler.frame, 'stage': self.name,
+		          'start': self.start - self.profiler.origin, 'wall': wall, 'cpu': cpu}
+		if self.profiler.memory:
+			# Peak bytes allocated on top of what was live when the stage began
+			record['peak_bytes'] = tracemalloc.get_traced_memory()[1] - self.traced
+			record['max_rss_bytes'] = max_rss()
+		self.profiler.records.append(record)
+		return False
+
+
+class Profiler:
+	## @brief Creates a profiler.
+	#  Stages must not be nested when memory tracking is on, since the
+	#  tracemalloc peak is process wide.
+	#  @param enabled Record stages; a disabled profiler is a no-op.
+	#  @param memory Track peak memory with tracemalloc (slows allocation-heavy code).
+	def __init__(self, enabled=True, memory=True):
+		self.enabled = enabled
+		self.memory = enabled and memory
+		self.records = []
+		self.frame = None
+		self.origin = time.perf_counter()
+		self._tracing = False
+		if self.memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self._tracing = True
+
+	## @brief Context manager timing one stage of the current frame.
+	#  @param name Stage name, e.g. 'sample'.
+	#  @return Context manager.
+	def stage(self, name):
+		if not self.enabled:
+			return _NULL_STAGE
+		return _Stage(self, name)
+
+	## @brief Stops tracemalloc if this profiler started it.
+	def close(self):
+		if self._tracing:
+			tracemalloc.stop()
+			self._tracing = False
+
+	## @brief Totals per stage over all frames.
+	#  @return Dict mapping stage name to calls, wall, cpu and peak_bytes.
+	def summary(self):
+		totals = {}
+		for record in self.records:
+			total = totals.setdefault(record['stage'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_bytes': 0})
+			total['calls'] += 1
+			total['wall'] += record['wall']
+			total['cpu'] += record['cpu']
+			total['peak_bytes'] = max(total['peak_bytes'], record.get('peak_bytes', 0))
+		return totals
+
+	## @brief Prints the per-stage totals.
+	def print_summary(self):
+		for name, total in self.summary().items():
+			print(f"{name:>10}: {total['wall']:.4f} s wall, {total['cpu']:.4f} s CPU, "
+			      f"{total['calls']} calls, peak {total['peak_bytes']/2**20:.1f} MiB")
+
+	## @brief Exports the records as JSON.
+	#  @param filename File to write, or None to return the string.
+	#  @return JSON string when filename is None.
+	def to_json(self, filename=None):
+		text = json.dumps({'records': self.records, 'summary': self.summary()}, indent=1)
+		if filename is None:
+			return text
+		with open(filename, 'w') as f:
+			f.write(text)
+
+	## @brief Exports the records in the Chrome trace event format.
+	#  @param filename File to write, or None to return the string.
+	#  @return JSON string when filename is None.
+	def to_chrome_trace(self, filename=None):
+		pid = os.getpid()
+		events = []
+		for record in self.records:
+			args = {key: value for key, value in record.items() if key not in ('stage', 'start', 'wall')}
+			events.append({'name': record['stage'], 'cat': 'render', 'ph': 'X', 'pid': pid, 'tid': 0,
+			               'ts': record['start']*1e6, 'dur': record['wall']*1e6, 'args': args})
+		text = json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'})
+		if filename is None:
+			return text
+		with open(filename, 'w') as f:
+			f.write(text)
+
+## Shared disabled profiler used as the default everywhere.
+NULL_PROFILER = Profiler(enabled=False)
@@ -0,0 +1,197 @@
+# Projection Render Modes
+import weakref
+import numpy as np
+from timeit import default_timer as timer
+from volumerender_core import load_datacube
+from volumerender_camera import orbit, uses_slab_path
+from volumerender_slab import sample_slabs
+from volumerender_clip import clipped_points, sample_inside
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_projection
+#  Maximum-, minimum- and average-intensity projections for any camera. The
+#  camera grid comes from the same sampling engine as the composited renders
+#  and is reduced along the rays instead of being classified and composited.
+#  Projections along the datacube axes skip resampling and are cached per datacube;
+#  project_camera() uses them for orthographic cameras whose grid is the voxel grid.
+
+
+## Projection modes.
+MODES = ('max', 'min', 'mean')
+
+# id(datacube) -> (weak reference, {(mode, axis): projection})
+_axis_cache = {}
+
+
+def _check_mode(mode):
+	if mode not in MODES:
+		raise ValueError("unknown projection mode " + repr(mode) + ", expected one of " + str(MODES))
+
+
+## @brief Reduces a camera grid along the rays.
+#  @param camera_grid Densities with the rays along axis 0.
+#  @param mode 'max', 'min' or 'mean'.
+#  @param inside Mask of the samples inside the volume, or None if all are.
+#  Samples outside it are left out, so they do not pull min and mean to the fill.
+#  @return Projected densities of shape camera_grid.shape[1:]; 0 where a ray misses the volume.
+def project(camera_grid, mode='max', inside=None):
+	_check_mode(mode)
+	if inside is None:
+		return getattr(np, mode)(camera_grid, axis=0)
+
+	if mode == 'mean':
+		count = inside.sum(axis=0)
+		total = np.sum(camera_grid, axis=0, where=inside)
+		return np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+
+	initial = -np.inf if mode == 'max' else np.inf
+	result = getattr(np, mode)(camera_grid, axis=0, where=inside, initial=initial)
+	result[~np.isfinite(result)] = 0.0
+	return result
+
+
+## @brief Datacube axes of a camera whose grid is the voxel grid.
+#  That is an orthographic camera whose rows, rays and columns each run along
+#  a datacube axis (either way), with one pixel and one sample per voxel.
+#  @param camera Camera from volumerender_camera.
+#  @param shape Shape of the datacube.
+#  @return Tuple (axes, signs) for the rows, rays and columns, or None.
+def axis_view(camera, shape):
+	if camera.perspective:
+		return None
+	R = camera.matrix
+	axes = np.argmax(np.abs(R), axis=0)
+	signs = np.sign(R[axes, range(3)])
+	# Columns of R are unit vectors, so one entry of 1 leaves the others at 0
+	if not np.allclose(np.abs(R[axes, range(3)]), 1.0, atol=1e-9) or len(set(axes)) < 3:
+		return None
+	height, width = camera.frame
+	rows, rays, columns = (shape[axis] for axis in axes)
+	if (height, width, camera.Nsteps) != (rows, columns, rays):
+		return None
+	if camera.extent != height or camera.depth != rays:
+		return None
+	return axes, signs
+
+
+## @brief Projects the datacube for a camera.
+#  Cameras looking along a datacube axis on the voxel grid (see axis_view())
+#  reduce the datacube directly with axis_projection(), without resampling.
+#  @param datacube The density datacube.
+#  @param camera Camera from volumerender_camera.
+#  @param mode 'max', 'min' or 'mean'.
+#  @param interpolationMethod Method used for data interpolation.
+#  @return Projected densities of shape (height, width).
+def project_camera(datacube, camera, mode='max', interpolationMethod='linear'):
+	_check_mode(mode)
+	view = axis_view(camera, datacube.shape)
+	if view is not None:
+		(rows, rays, columns), signs = view
+		projection = axis_projection(datacube, mode, rays)
+		if rows > columns:
+			projection = projection.T
+		projection = projection[::int(signs[0]), ::int(signs[2])]
+		row0, row1, col0, col1 = camera.window or (0, camera.height, 0, camera.width)
+		return projection[row0:row1, col0:col1]
+	if uses_slab_path(camera, datacube.shape, interpolationMethod):
+		camera_grid = sample_slabs(datacube, camera.matrix, camera.width, camera.Nsteps, interpolationMethod)
+		return project(camera_grid, mode)
+	inside, qi = clipped_points(camera, datacube.shape)
+	camera_grid = sample_inside(datacube, camera, inside, qi, interpolationMethod)
+	return project(camera_grid, mode, inside)
+
+
+## @brief Projects the datacube along one of its own axes, without resampling.
+#  Results are cached for as long as the datacube is alive; call
+#  clear_axis_cache() after modifying a datacube in place.
+#  @param datacube The density datacube.
+#  @param mode 'max', 'min' or 'mean'.
+#  @param axis Axis to project along.
+#  @return Projected densities; np.log(axis_projection(datacube)) is the
+#  comparison projection of main().
+def axis_projection(datacube, mode='mean', axis=0):
+	_check_mode(mode)
+	entry = _axis_cache.get(id(datacube))
+	if entry is None or entry[0]() is not datacube:
+		key = id(datacube)
+		entry = (weakref.ref(datacube, lambda _: _axis_cache.pop(key, None)), {})
+		_axis_cache[key] = entry
+
+	projections = entry[1]
+	if (mode, axis) not in projections:
+		projections[(mode, axis)] = getattr(np, mode)(datacube, axis=axis)
+	return projections[(mode, axis)]
+
+
+## @brief Drops all cached axis projections.
+def clear_axis_cache():
+	_axis_cache.clear()
+
+
+## @brief Grayscale image of a projection's log-density.
+#  @param projection Projected densities.
+#  @param clim Log-density mapped to black and white.
+#  @return RGB image with values in [0, 1].
+def projection_image(projection, clim=(-5, 5)):
+	with np.errstate(divide='ignore'):
+		level = (np.log(projection) - clim[0])/(clim[1] - clim[0])
+	return np.repeat(np.clip(level, 0.0, 1.0)[:,:,np.newaxis], 3, axis=2)
+
+
+## @brief Saves a projection the way main() saves its comparison projection.
+#  @param projection Projected densities.
+#  @param filename Output PNG file name.
+#  @param clim Color limits of the log-density.
+def save_projection(projection, filename, clim=(-5, 5)):
+	import matplotlib.pyplot as plt
+
+	plt.figure(figsize=(4,4), dpi=80)
+	with np.errstate(divide='ignore'):
+		plt.imshow(np.log(projection), cmap = 'viridis')
+	plt.clim(*clim)
+	plt.axis('off')
+	plt.savefig(filename,dpi=240,  bbox_inches='tight', pad_inches = 0)
+	plt.close()
+
+
+## @brief Quick-look projections along the orbit of main().
+#  @param Nangles Number of angles for camera rotation.
+#  @param N Image resolution (pixels per side).
+#  @param mode 'max', 'min' or 'mean'.
+#  @param interpolationMethod Method used for data interpolation.
+#  @return Total rendering time in seconds.
+def main(Nangles=10, N=180, mode='max', interpolationMethod='linear'):
+	""" Volume Rendering """
+
+	datacube = load_datacube()
+	average = np.zeros(Nangles)
+
+	for i, camera in enumerate(orbit(Nangles, width=N)):
+		print('Rendering Scene ' + str(i+1) + ' of ' + str(Nangles) + '.\n')
+		start = timer()
+
+		projection = project_camera(datacube, camera, mode, interpolationMethod)
+
+		end = timer()
+		print(f"Time to render scene {i+1}: {end - start} seconds")
+		average[i] = end - start
+
+		save_projection(projection, 'projection_' + mode + str(i) + '.png')
+
+	print(f"Mean rendering time: {np.mean(average)} seconds")
+	print(f"Standard deviation of rendering time: {np.std(average)} seconds")
+	print(f"Max rendering time: {np.max(average)} seconds")
+	print(f"Min rendering time: {np.min(average)} seconds")
+
+	save_projection(axis_projection(datacube, 'mean'), 'projection.png')
+
+	return np.sum(average)
+
+if __name__== "__main__":
+	main()
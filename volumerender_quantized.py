@@ -0,0 +1,176 @@
+# Quantized Log-Density Volume
+import numpy as np
+import h5py as h5
+from timeit import default_timer as timer
+from volumerender_core import transferFunction, load_datacube, camera_points, save_image
+from volumerender_sampling import sample_nearest, sample_linear
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_quantized
+#  Stores log-density quantized to uint8/uint16 with scale/offset metadata, so
+#  the renderer samples a 4-8x smaller volume and looks colors up in a table
+#  indexed by the code instead of calling np.log on every sample.
+
+
+## @brief Quantizes the log of a density datacube.
+#  log(density) is recovered as offset + scale*code for codes 1 and up. Code 0
+#  is reserved for empty voxels (density <= 0), which stay transparent.
+#  @param datacube The density datacube.
+#  @param bits 8 or 16.
+#  @return Tuple (codes, scale, offset).
+def quantize(datacube, bits=8):
+	if bits not in (8, 16):
+		raise ValueError("bits must be 8 or 16")
+	dtype = np.uint8 if bits == 8 else np.uint16
+	levels = 2**bits - 1
+
+	empty = ~(datacube > 0)
+	if np.all(empty):
+		raise ValueError("datacube has no positive densities to quantize")
+	positive = datacube[~empty]
+	lo = np.log(positive.min())
+	hi = np.log(positive.max())
+	scale = float(hi - lo) / (levels - 1) if hi > lo else 1.0
+	offset = float(lo) - scale
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		logs = np.log(datacube)
+	codes = np.rint((logs - offset) / scale)
+	np.clip(codes, 1, levels, out=codes)
+	codes[empty] = 0
+	return codes.astype(dtype), scale, offset
+
+
+## @brief Name of the HDF5 dataset holding the quantized log-density.
+#  @param bits 8 or 16.
+#  @return Dataset name.
+def dataset_name(bits):
+	return 'log_density_u' + str(bits)
+
+
+## @brief Sidecar file holding the quantized volumes of an HDF5 file.
+def quantized_file(filename='datacube.hdf5'):
+	return filename + '.quantized.hdf5'
+
+
+## @brief Quantizes f['density'] and stores it in a sidecar file.
+#  The source file is only written to when passed as output explicitly.
+#  @param filename HDF5 file holding the density.
+#  @param bits 8 or 16.
+#  @param output File to write to, defaults to quantized_file(filename).
+#  @return Name of the written dataset.
+def quantize_file(filename='datacube.hdf5', bits=8, output=None):
+	codes, scale, offset = quantize(load_datacube(filename), bits)
+	name = dataset_name(bits)
+	with h5.File(quantized_file(filename) if output is None else output, 'a') as f:
+		if name in f:
+			del f[name]
+		dset = f.create_dataset(name, data=codes)
+		dset.attrs['scale'] = scale
+		dset.attrs['offset'] = offset
+		dset.attrs['bits'] = bits
+	return name
+
+
+## @brief Loads a quantized log-density volume.
+#  @param filename HDF5 file (or sidecar) written by quantize_file().
+#  @param bits 8 or 16.
+#  @return Tuple (codes, scale, offset).
+def load_quantized(filename='datacube.hdf5', bits=8):
+	with h5.File(filename, 'r') as f:
+		dset = f[dataset_name(bits)]
+		codes = np.array(dset)
+		scale = float(dset.attrs['scale'])
+		offset = float(dset.attrs['offset'])
+	return codes, scale, offset
+
+
+## @brief Evaluates the transfer function once for every code.
+#  @param scale Log-density per code step.
+#  @param offset Log-density offset; code 0 itself is empty.
+#  @param levels Number of codes (256 or 65536).
+#  @param transfer Transfer function mapping log-density to RGBA.
+#  @return float32 table of shape (levels, 4); row 0 (empty) is transparent.
+def transfer_table(scale, offset, levels, transfer=transferFunction):
+	r,g,b,a = transfer(offset + scale*np.arange(levels))
+	table = np.stack([r,g,b,a], axis=-1).astype(np.float32)
+	table[0] = 0.0
+	return table
+
+
+## @brief Renders a view of the quantized volume.
+#  @param codes Quantized volume.
+#  @param table Table from transfer_table().
+#  @param qi Query points from camera_points().
+#  @param shape Shape of the camera grid, rays along axis 0.
+#  @param interpolationMethod 'nearest' or 'linear'.
+#  @return RGB image.
+def render_quantized(codes, table, qi, shape, interpolationMethod='linear'):
+	if interpolationMethod == 'nearest':
+		camera_grid = sample_nearest(codes, qi).reshape(shape)
+	elif interpolationMethod == 'linear':
+		camera_grid = np.rint(sample_linear(codes, qi, np.float32)).astype(np.intp).reshape(shape)
+	else:
+		raise ValueError("interpolationMethod must be 'nearest' or 'linear'")
+
+	image = np.zeros((shape[1],shape[2],3), dtype=np.float32)
+	for dataslice in camera_grid:
+		rgba = table[dataslice]
+		a = rgba[:,:,3:]
+		image *= 1-a
+		image += a*rgba[:,:,:3]
+
+	return image
+
+
+## @brief Volume rendering from the quantized log-density volume.
+#  @param N Image resolution (pixels per side).
+#  @param Nangles Number of angles for camera rotation.
+#  @param bits 8 or 16.
+#  @param interpolationMethod 'nearest' or 'linear'.
+#  @return Total rendering time in seconds.
+def main(N=180, Nangles=10, bits=8, interpolationMethod='linear'):
+	""" Volume Rendering """
+
+	sidecar = quantized_file('datacube.hdf5')
+	try:
+		with h5.File(sidecar, 'r') as f:
+			quantized = dataset_name(bits) in f
+	except OSError:
+		quantized = False
+	if not quantized:
+		quantize_file('datacube.hdf5', bits)
+
+	codes, scale, offset = load_quantized(sidecar, bits)
+	table = transfer_table(scale, offset, 2**bits)
+
+	average = np.zeros(Nangles)
+
+	for i in range(Nangles):
+		print('Rendering Scene ' + str(i+1) + ' of ' + str(Nangles) + '.\n')
+		start = timer()
+
+		angle = np.pi/2 * i / Nangles
+		image = render_quantized(codes, table, camera_points(N, angle), (N,N,N), interpolationMethod)
+
+		end = timer()
+		print(f"Time to render scene {i+1}: {end - start} seconds")
+		average[i] = end - start
+
+		save_image(image, 'volumerender' + str(i) + '.png')
+
+	print(f"Mean rendering time: {np.mean(average)} seconds")
+	print(f"Standard deviation of rendering time: {np.std(average)} seconds")
+	print(f"Max rendering time: {np.max(average)} seconds")
+	print(f"Min rendering time: {np.min(average)} seconds")
+
+	return np.sum(average)
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,130 @@
+# Region-of-interest Rendering
+import numpy as np
+from timeit import default_timer as timer
+from volumerender_core import load_datacube, transferFunction
+from volumerender_camera import Camera
+from volumerender_clip import clip_bounds, render_clipped
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_roi
+#  Renders part of a view: an image-space window (Camera(window=...) or
+#  camera.cropped()), a world-space clipping box, or both. Only the window's
+#  rays are generated and only samples inside the box are interpolated; slices
+#  in front of and behind the box are not composited, so the cost follows the
+#  size of the region instead of the full N^3 grid. A box on its own also
+#  restricts the rays, to the window its projection covers.
+
+
+## @brief Smallest pixel window whose rays cover a world-space box.
+#  @param camera Camera from volumerender_camera; any window of it is ignored.
+#  @param box Tuple (lo, hi) of world-space corners.
+#  @param shape Shape of the datacube; the box is first clipped to the volume.
+#  @return Window (row0, row1, col0, col1) of the full image.
+#  @throws ValueError if the box misses the volume or the image.
+def box_window(camera, box, shape):
+	lo, hi = clip_bounds(shape, box)
+	if np.any(lo > hi):
+		raise ValueError("box " + str(box) + " does not overlap the volume")
+	corners = np.array(np.meshgrid(*zip(lo, hi), indexing='ij')).reshape(3, -1).T
+	local = corners @ camera.matrix
+	height, width = camera.frame
+	half_h = camera.extent/2
+	half_w = half_h * width/height
+
+	if camera.perspective:
+		in_front = camera.distance - local[:,1]
+		if np.any(in_front <= 0):
+			return (0, height, 0, width)
+		scale = np.tan(np.radians(camera.fov)/2) / half_h
+		u = local[:,0] / (in_front*scale)
+		v = local[:,2] / (in_front*scale)
+	else:
+		u = local[:,0]
+		v = local[:,2]
+
+	rows = (u + half_h) * ((height-1)/(2*half_h)) if height > 1 else np.zeros_like(u)
+	cols = (v + half_w) * ((width-1)/(2*half_w)) if width > 1 else np.zeros_like(v)
+	row0 = max(0, int(np.floor(rows.min())))
+	row1 = min(height, int(np.ceil(rows.max())) + 1)
+	col0 = max(0, int(np.floor(cols.min())))
+	col1 = min(width, int(np.ceil(cols.max())) + 1)
+	if row0 >= row1 or col0 >= col1:
+		raise ValueError("box " + str(box) + " is outside the image")
+	return (row0, row1, col0, col1)
+
+
+## @brief Renders a region of interest of a view.
+#  @param datacube The density datacube.
+#  @param camera Camera, optionally with a window.
+#  @param box World-space clipping box (lo, hi), or None. Without a window on
+#  the camera, the window is fitted to the box with box_window().
+#  @param interpolationMethod Method used for data interpolation.
+#  @param transfer Transfer function mapping log-density to RGBA.
+#  @return Tuple (image, window): the RGB image of the window and the window
+#  (row0, row1, col0, col1) of the full image, None for the full image.
+def render_roi(datacube, camera, box=None, interpolationMethod='linear', transfer=transferFunction):
+	if box is not None and camera.window is None:
+		camera = camera.cropped(box_window(camera, box, datacube.shape))
+	return render_clipped(datacube, camera, interpolationMethod, transfer=transfer, box=box), camera.window
+
+
+## @brief Places a window's image in an otherwise black full-size image.
+#  @param image RGB image of the window.
+#  @param window Window (row0, row1, col0, col1), or None for the full image.
+#  @param frame Full image size (height, width).
+#  @return RGB image of shape frame + (3,).
+def full_image(image, window, frame):
+	if window is None:
+		return image
+	full = np.zeros(tuple(frame) + (3,))
+	row0, row1, col0, col1 = window
+	full[row0:row1, col0:col1] = image
+	return full
+
+
+## @brief Compares full-frame renders with a window and with a clipping box.
+#  @param N Image resolution (pixels per side).
+#  @param angle Rotation angle about x in radians.
+#  @param window Pixel window, defaults to the central quarter of the image.
+#  @param box World-space box, defaults to the central eighth of the volume.
+#  @param interpolationMethod Method used for data interpolation.
+#  @return Dict of seconds for 'full', 'window' and 'box'.
+def main(N=180, angle=np.pi/4, window=None, box=None, interpolationMethod='linear'):
+	""" Volume Rendering """
+
+	datacube = load_datacube()
+	if window is None:
+		window = (N//4, 3*N//4, N//4, 3*N//4)
+	if box is None:
+		half = np.array(datacube.shape)/4
+		box = (-half, half)
+	camera = Camera.from_angle(angle, N)
+	results = {}
+
+	start = timer()
+	full = render_clipped(datacube, camera, interpolationMethod)
+	results['full'] = timer() - start
+
+	start = timer()
+	image, _ = render_roi(datacube, camera.cropped(window), None, interpolationMethod)
+	results['window'] = timer() - start
+	row0, row1, col0, col1 = window
+	difference = np.max(np.abs(image - full[row0:row1, col0:col1]))
+
+	start = timer()
+	render_roi(datacube, camera, box, interpolationMethod)
+	results['box'] = timer() - start
+
+	print(f"Full frame: {results['full']} seconds")
+	print(f"Window {window}: {results['window']} seconds, max difference from the full frame {difference}")
+	print(f"Box {np.asarray(box[0]).tolist()} to {np.asarray(box[1]).tolist()}: {results['box']} seconds")
+	return results
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,171 @@
+# Uniform-grid Samplers
+import numpy as np
+from timeit import default_timer as timer
+from volumerender_core import load_datacube, datacube_points, camera_points, grid_index, sample
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_sampling
+#  Nearest-neighbour and trilinear samplers for the uniform datacube grid
+#  np.linspace(-Nx/2, Nx/2, Nx). Voxel indices are computed arithmetically and
+#  voxels are gathered with np.take from the flattened volume, so there is no
+#  searchsorted and none of interpn's rectilinear bookkeeping. Any volume dtype
+#  works, including the quantized codes of volumerender_quantized.
+
+
+## @brief Nearest voxels of query points, picked exactly as interpn picks them.
+#  The voxel below is found arithmetically, then the side is decided with
+#  interpn's own normalized distance (x - grid[i]) / (grid[i+1] - grid[i]),
+#  ties rounding down. Points that lie halfway between voxels up to rounding
+#  (common for rotations by pi/4) thus go the same way as in interpn.
+#  @param qi Query points of shape (M, D).
+#  @param shape Shape of the volume along those D axes.
+#  @return Integer array of shape (D, M) of voxel indices.
+def nearest_voxel(qi, shape):
+	u = grid_index(qi, shape)
+	i = np.empty(u.shape, dtype=np.intp)
+	for axis, n in enumerate(shape):
+		grid = np.linspace(-n/2, n/2, n)
+		lower = np.clip(np.floor(u[axis]).astype(np.intp), 0, max(n-2, 0))
+		upper = np.minimum(lower + 1, n-1)
+		with np.errstate(invalid='ignore', divide='ignore'):
+			distance = (qi[:,axis] - grid[lower]) / (grid[upper] - grid[lower])
+		i[axis] = lower + (distance > 0.5)
+	return i
+
+
+## @brief Flat indices of the nearest voxels.
+#  Ties round down, as in interpn; see nearest_voxel().
+#  @param qi Query points of shape (M, 3).
+#  @param shape Shape (Nx, Ny, Nz) of the volume.
+#  @return Array of M indices into the flattened volume.
+def nearest_index(qi, shape):
+	i = nearest_voxel(qi, shape)
+	return (i[0]*shape[1] + i[1])*shape[2] + i[2]
+
+
+## @brief Nearest-neighbour samples of a volume.
+#  @param volume Volume on the datacube_points() grid, any dtype.
+#  @param qi Query points of shape (M, 3).
+#  @return Samples of shape (M,), in the volume's dtype.
+def sample_nearest(volume, qi):
+	return np.take(volume.ravel(), nearest_index(qi, volume.shape))
+
+
+## @brief Corners and weights of trilinear interpolation on the datacube grid.
+#  Computed once per set of query points, they serve every volume on that grid.
+#  Corners are generated one at a time, so only one index array is alive at once.
+#  @param qi Query points of shape (M, 3).
+#  @param shape Shape (Nx, Ny, Nz) of the grid.
+#  @param dtype Float type of the weights.
+#  @return Generator of 8 (flat indices, weights) pairs.
+def linear_corners(qi, shape, dtype=np.float64):
+	Nx, Ny, Nz = shape
+	u = grid_index(qi, shape)
+	# The last cell also holds the upper face, so i0+1 is always a voxel
+	i0 = np.minimum(np.floor(u).astype(np.intp), np.array(shape)[:,np.newaxis]-2)
+	wi, wj, wk = (u - i0).astype(dtype)
+	flat = (i0[0]*Ny + i0[1])*Nz + i0[2]
+	for di in (0, 1):
+		for dj in (0, 1):
+			for dk in (0, 1):
+				weight = (wi if di else 1-wi) * (wj if dj else 1-wj) * (wk if dk else 1-wk)
+				yield flat + (di*Ny + dj)*Nz + dk, weight
+
+
+## @brief Trilinearly interpolated samples of a volume.
+#  @param volume Volume on the datacube_points() grid, any dtype.
+#  @param qi Query points of shape (M, 3).
+#  @param dtype Float type of the weights and result.
+#  @return Samples of shape (M,).
+def sample_linear(volume, qi, dtype=np.float64):
+	voxels = volume.ravel()
+	out = np.zeros(len(qi), dtype=dtype)
+	tmp = np.empty(len(qi), dtype=dtype)
+	for index, weight in linear_corners(qi, volume.shape, dtype):
+		if voxels.dtype == dtype:
+			# Indices are in range; mode='clip' lets take write straight into tmp
+			np.take(voxels, index, out=tmp, mode='clip')
+		else:
+			tmp[:] = voxels.take(index)
+		tmp *= weight
+		out += tmp
+	return out
+
+
+## @brief Samples several volumes on the same grid at the same points.
+#  Voxel indices and interpolation weights are computed once and shared.
+#  @param volumes Volumes of shape (Nx, Ny, Nz) or (Nx, Ny, Nz, C), any dtypes.
+#  @param qi Query points of shape (M, 3).
+#  @param interpolationMethod 'nearest' or 'linear'.
+#  @param dtype Float type of the linear weights and results.
+#  @return List of samples of shape (M,) or (M, C), one per volume. Nearest
+#  samples keep each volume's dtype; linear ones are in dtype and, for
+#  single-component volumes, equal sample_linear() bit for bit.
+def sample_fields(volumes, qi, interpolationMethod='linear', dtype=np.float64):
+	shape = volumes[0].shape[:3]
+	if any(volume.shape[:3] != shape for volume in volumes):
+		raise ValueError("volumes must share the grid " + str(shape))
+	voxels = [volume.reshape(np.prod(shape), -1) for volume in volumes]
+	if interpolationMethod == 'nearest':
+		index = nearest_index(qi, shape)
+		samples = [v[index] for v in voxels]
+	elif interpolationMethod == 'linear':
+		samples = [np.zeros((len(qi), v.shape[1]), dtype=dtype) for v in voxels]
+		for index, weight in linear_corners(qi, shape, dtype):
+			for v, out in zip(voxels, samples):
+				out += v[index] * weight[:,np.newaxis]
+	else:
+		raise ValueError("interpolationMethod must be 'nearest' or 'linear'")
+	return [out.reshape((len(qi),) + volume.shape[3:]) for out, volume in zip(samples, volumes)]
+
+
+## @brief Drop-in replacement for volumerender_core.sample on the full datacube grid.
+#  'nearest' and 'linear' use the uniform-grid samplers; other methods go to interpn.
+#  @param datacube The density datacube.
+#  @param qi Query points of shape (M, 3).
+#  @param shape Shape of the resulting camera grid.
+#  @param interpolationMethod Method used for data interpolation.
+#  @return The camera grid of densities.
+def sample_uniform(datacube, qi, shape, interpolationMethod='linear'):
+	if interpolationMethod == 'nearest':
+		return sample_nearest(datacube, qi).reshape(shape)
+	if interpolationMethod == 'linear':
+		return sample_linear(datacube, qi).reshape(shape)
+	return sample(datacube_points(datacube.shape), datacube, qi, shape, interpolationMethod)
+
+
+## @brief Compares the uniform-grid samplers with interpn on the camera grid of main().
+#  @param N Image resolution (pixels per side).
+#  @param angle Camera angle in radians.
+#  @return Dict of (interpn seconds, uniform seconds, max abs difference) per method.
+def main(N=180, angle=np.pi/4):
+	""" Volume Rendering """
+
+	datacube = load_datacube()
+	points = datacube_points(datacube.shape)
+	qi = camera_points(N, angle)
+	results = {}
+
+	for method in ('nearest', 'linear'):
+		start = timer()
+		expected = sample(points, datacube, qi, (N,N,N), method)
+		reference = timer() - start
+
+		start = timer()
+		actual = sample_uniform(datacube, qi, (N,N,N), method)
+		uniform = timer() - start
+
+		error = np.max(np.abs(actual - expected))
+		print(f"{method}: interpn {reference} seconds, uniform grid {uniform} seconds, max difference {error}")
+		results[method] = (reference, uniform, error)
+
+	return results
+
+if __name__== "__main__":
+	main()
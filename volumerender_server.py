@@ -0,0 +1,267 @@
+# Render Server
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import multiprocessing
+import numpy as np
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from volumerender_core import load_datacube, composite, encode_png, GaussianTransferFunction, DEFAULT_TRANSFER
+from volumerender_camera import Camera, quaternion_axis_angle, sample_camera
+from volumerender_projection import MODES, project_camera, projection_image
+from volumerender_incremental import camera_key
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_server
+#  Local HTTP render server. The datacube is loaded once and shared read-only
+#  with a pool of worker processes through a memory-mapped .npy file, so
+#  requests pay neither the HDF5 load nor the import cost. Identical requests
+#  in flight are rendered once, and encoded PNGs are kept in an LRU cache
+#  bounded in bytes.
+#
+#  GET /render?angle=0.3&N=180&method=linear&mode=composite
+#  Other parameters: q=w,x,y,z (instead of angle), Nsteps, fov, and
+#  tf={"centers": [...], "widths": [...], "rgba_weights": [[...], ...]}.
+#  mode is 'composite' or one of the projection modes 'max', 'min', 'mean'.
+#  GET /stats returns the cache and request counters as JSON.
+
+## Largest image side accepted.
+MAX_N = 2048
+
+## Render modes.
+RENDER_MODES = ('composite',) + MODES
+
+
+## @brief Least-recently-used store of encoded images, bounded in bytes.
+class FrameCache:
+	## @brief Creates an empty cache.
+	#  @param memory_limit Maximum bytes of retained images.
+	def __init__(self, memory_limit=256 << 20):
+		self.memory_limit = memory_limit
+		self.nbytes = 0
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	## @brief Cached image for a key, or None.
+	def get(self, key):
+		if key in self.entries:
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+		self.misses += 1
+		return None
+
+	## @brief Stores an image, evicting the least recently used ones.
+	def put(self, key, data):
+		if len(data) > self.memory_limit:
+			return
+		if key in self.entries:
+			self.nbytes -= len(self.entries.pop(key))
+		while self.nbytes + len(data) > self.memory_limit:
+			_, evicted = self.entries.popitem(last=False)
+			self.nbytes -= len(evicted)
+		self.entries[key] = data
+		self.nbytes += len(data)
+
+
+## @brief Parses the query string of a render request.
+#  @param query URL query string.
+#  @return Tuple (camera, interpolationMethod, mode, transfer).
+#  @throws ValueError, KeyError or TypeError for missing or invalid parameters.
+def parse_query(query):
+	params = {name: values[-1] for name, values in parse_qs(query, strict_parsing=False).items()}
+
+	N = int(params.get('N', 180))
+	if not 1 <= N <= MAX_N:
+		raise ValueError("N must be between 1 and " + str(MAX_N))
+	Nsteps = int(params['Nsteps']) if 'Nsteps' in params else None
+	if Nsteps is not None and not 2 <= Nsteps <= MAX_N:
+		raise ValueError("Nsteps must be between 2 and " + str(MAX_N))
+	fov = float(params['fov']) if 'fov' in params else None
+	if fov is not None and not 0 < fov < 180:
+		raise ValueError("fov must be between 0 and 180 degrees")
+
+	if 'q' in params:
+		orientation = [float(v) for v in params['q'].split(',')]
+		if len(orientation) != 4 or not np.any(orientation):
+			raise ValueError("q must be four comma-separated numbers, not all zero")
+	else:
+		orientation = quaternion_axis_angle((1.0, 0.0, 0.0), float(params.get('angle', 0.0)))
+
+	method = params.get('method', 'linear')
+	if method not in ('nearest', 'linear'):
+		raise ValueError("method must be 'nearest' or 'linear'")
+	mode = params.get('mode', 'composite')
+	if mode not in RENDER_MODES:
+		raise ValueError("mode must be one of " + str(RENDER_MODES))
+
+	transfer = DEFAULT_TRANSFER
+	if 'tf' in params:
+		tf = json.loads(params['tf'])
+		if not isinstance(tf, dict):
+			raise ValueError("tf must be a JSON object with centers, widths and rgba_weights")
+		transfer = GaussianTransferFunction(tf['centers'], tf['widths'], tf['rgba_weights'])
+
+	return Camera(orientation, width=N, Nsteps=Nsteps, fov=fov), method, mode, transfer
+
+
+## @brief Cache key of a parsed request.
+def request_key(camera, interpolationMethod, mode, transfer):
+	return camera_key(camera, interpolationMethod) + (mode, transfer.key if mode == 'composite' else None)
+
+
+# The datacube of a worker process, memory-mapped read-only
+_datacube = None
+
+
+def _init_worker(path):
+	global _datacube
+	_datacube = np.load(path, mmap_mode='r')
+
+
+## @brief Renders and encodes one request in a worker process.
+#  @return PNG file contents.
+def render_request(camera, interpolationMethod, mode, transfer):
+	if mode == 'composite':
+		image = composite(sample_camera(_datacube, camera, interpolationMethod), transfer)
+	else:
+		image = projection_image(project_camera(_datacube, camera, mode, interpolationMethod))
+	return encode_png(image)
+
+
+## @brief Render server keeping the datacube resident between requests.
+class RenderServer:
+	## @brief Loads the datacube and starts the worker pool.
+	#  @param filename HDF5 file.
+	#  @param dataset Dataset name.
+	#  @param workers Number of worker processes, defaults to os.cpu_count().
+	#  @param cache_bytes Maximum bytes of cached PNGs.
+	def __init__(self, filename='datacube.hdf5', dataset='density', workers=None, cache_bytes=256 << 20):
+		self.directory = tempfile.TemporaryDirectory(prefix='volumerender_')
+		self.path = os.path.join(self.directory.name, 'datacube.npy')
+		np.save(self.path, load_datacube(filename, dataset))
+		# Workers are started lazily from inside the event loop, where forking the
+		# running process can deadlock, so they come from a fork server (or spawn)
+		methods = multiprocessing.get_all_start_methods()
+		context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+		self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context,
+		                                initializer=_init_worker, initargs=(self.path,))
+		self.cache = FrameCache(cache_bytes)
+		self.inflight = {}
+		## Requests served by joining an identical request in flight.
+		self.coalesced = 0
+		## Renders run by the worker pool.
+		self.rendered = 0
+
+	## @brief Renders a request, from the cache or an identical request in flight if possible.
+	#  @param camera Camera.
+	#  @param interpolationMethod Method used for data interpolation.
+	#  @param mode Render mode.
+	#  @param transfer GaussianTransferFunction.
+	#  @return PNG file contents.
+	async def render(self, camera, interpolationMethod='linear', mode='composite', transfer=DEFAULT_TRANSFER):
+		key = request_key(camera, interpolationMethod, mode, transfer)
+		data = self.cache.get(key)
+		if data is not None:
+			return data
+
+		future = self.inflight.get(key)
+		if future is not None:
+			self.coalesced += 1
+			return await asyncio.shield(future)
+
+		loop = asyncio.get_running_loop()
+		future = loop.run_in_executor(self.pool, render_request, camera, interpolationMethod, mode, transfer)
+		self.inflight[key] = future
+		self.rendered += 1
+		try:
+			data = await asyncio.shield(future)
+		finally:
+			del self.inflight[key]
+		self.cache.put(key, data)
+		return data
+
+	## @brief Request and cache counters.
+	def stats(self):
+		return {'hits': self.cache.hits, 'misses': self.cache.misses, 'coalesced': self.coalesced,
+		        'rendered': self.rendered, 'cached_images': len(self.cache.entries),
+		        'cached_bytes': self.cache.nbytes, 'inflight': len(self.inflight)}
+
+	## @brief Serves one HTTP connection (one request, then close).
+	async def handle(self, reader, writer):
+		try:
+			request = await reader.readline()
+			while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+				pass
+			parts = request.decode('latin-1').split()
+			if len(parts) < 2 or parts[0] != 'GET':
+				status, content_type, body = '405 Method Not Allowed', 'text/plain', b'only GET is supported\n'
+			else:
+				url = urlsplit(parts[1])
+				if url.path == '/render':
+					try:
+						parsed = parse_query(url.query)
+					except (ValueError, KeyError, TypeError) as error:
+						status, content_type, body = '400 Bad Request', 'text/plain', (str(error) + '\n').encode()
+					else:
+						status, content_type, body = '200 OK', 'image/png', await self.render(*parsed)
+				elif url.path == '/stats':
+					status, content_type, body = '200 OK', 'application/json', json.dumps(self.stats()).encode()
+				else:
+					status, content_type, body = '404 Not Found', 'text/plain', b'not found\n'
+		except Exception as error:
+			status, content_type, body = '500 Internal Server Error', 'text/plain', (repr(error) + '\n').encode()
+
+		writer.write(('HTTP/1.1 ' + status + '\r\nContent-Type: ' + content_type + '\r\nContent-Length: ' +
+		              str(len(body)) + '\r\nConnection: close\r\n\r\n').encode('latin-1') + body)
+		try:
+			await writer.drain()
+		finally:
+			writer.close()
+
+	## @brief Starts listening.
+	#  @return asyncio.Server.
+	async def start(self, host='127.0.0.1', port=8000):
+		return await asyncio.start_server(self.handle, host, port)
+
+	## @brief Stops the worker pool and removes the memory-mapped datacube.
+	def close(self):
+		self.pool.shutdown()
+		self.directory.cleanup()
+
+
+## @brief Runs the render server until interrupted.
+#  @param host Interface to listen on.
+#  @param port TCP port.
+#  @param workers Number of worker processes, defaults to os.cpu_count().
+#  @param cache_bytes Maximum bytes of cached PNGs.
+def main(host='127.0.0.1', port=8000, workers=None, cache_bytes=256 << 20):
+	""" Volume Rendering """
+
+	server = RenderServer(workers=workers, cache_bytes=cache_bytes)
+
+	async def serve():
+		listener = await server.start(host, port)
+		print(f"Serving on http://{host}:{port}/render?angle=0.3&N=180")
+		async with listener:
+			await listener.serve_forever()
+
+	try:
+		asyncio.run(serve())
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.close()
+
+if __name__== "__main__":
+	main(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
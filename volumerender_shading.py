@@ -0,0 +1,178 @@
+# Gradient Shading
+import os
+import numpy as np
+from timeit import default_timer as timer
+from volumerender_core import load_datacube, composite_rgba, save_image, DEFAULT_TRANSFER
+from volumerender_camera import orbit
+from volumerender_clip import clipped_points
+from volumerender_sampling import sample_fields
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_shading
+#  Lit rendering with Blinn-Phong shading on the gradient of the log-density.
+#  The gradient is computed once per datacube and stored compactly, as int8
+#  unit normals (scaled by 127) and a float16 magnitude, in a sidecar file
+#  next to the HDF5 file. Renders sample the normals and magnitude alongside
+#  the density with the same interpolation weights, so shading costs no
+#  finite differences per frame.
+#
+#  Where the gradient is weak (smooth interiors) samples keep their emission;
+#  the shading strength 1 - exp(-|grad|/edge) grows towards sharp,
+#  isosurface-like structure.
+
+
+## @brief Gradient of the log-density as compact normals and magnitudes.
+#  Derivatives are per world unit of the datacube_points() grid.
+#  @param datacube The density datacube; non-positive densities count as the smallest positive one.
+#  @return Tuple (normals, magnitude): int8 unit vectors*127 of shape datacube.shape + (3,)
+#  (zero where the gradient vanishes) and float16 magnitudes of shape datacube.shape.
+def gradient_volume(datacube):
+	logs = np.log(np.maximum(datacube, np.finfo(np.float64).tiny))
+	spacing = [n/(n-1) for n in datacube.shape]
+	gradient = np.stack(np.gradient(logs, *spacing), axis=-1)
+	magnitude = np.sqrt(np.sum(gradient**2, axis=-1))
+	with np.errstate(invalid='ignore', divide='ignore'):
+		unit = np.where(magnitude[...,np.newaxis] > 0, gradient/magnitude[...,np.newaxis], 0.0)
+	normals = np.rint(unit*127).astype(np.int8)
+	magnitude = np.minimum(magnitude, np.finfo(np.float16).max).astype(np.float16)
+	return normals, magnitude
+
+
+## @brief Sidecar file holding the precomputed gradient of a dataset.
+def gradient_file(filename, dataset='density'):
+	return filename + '.' + dataset + '.gradient.npz'
+
+
+## @brief Loads the gradient of a dataset from its sidecar, computing and saving it if needed.
+#  The sidecar is tied to the size and modification time of the HDF5 file
+#  and recomputed when either changes. If it cannot be written (e.g. a
+#  read-only directory) the gradient is still returned.
+#  @param filename HDF5 file.
+#  @param dataset Dataset name.
+#  @param datacube The dataset if already loaded, to avoid reading it again.
+#  @return Tuple (normals, magnitude) from gradient_volume().
+def load_gradient(filename='datacube.hdf5', dataset='density', datacube=None):
+	sidecar = gradient_file(filename, dataset)
+	stat = os.stat(filename)
+	source = np.array([stat.st_size, stat.st_mtime_ns])
+	try:
+		with np.load(sidecar) as f:
+			if np.array_equal(f['source'], source):
+				return f['normals'], f['magnitude']
+	except (OSError, KeyError, ValueError):
+		pass
+
+	if datacube is None:
+		datacube = load_datacube(filename, dataset)
+	normals, magnitude = gradient_volume(datacube)
+	try:
+		with open(sidecar + '.part', 'wb') as f:
+			np.savez(f, normals=normals, magnitude=magnitude, source=source)
+		os.replace(sidecar + '.part', sidecar)
+	except OSError:
+		pass
+	return normals, magnitude
+
+
+## @brief Applies Blinn-Phong shading to classified colours.
+#  Normals are two-sided, so surfaces are lit from either side.
+#  @param r, g, b Colours of shape (..., ).
+#  @param normals Interpolated normals of shape (..., 3), any length.
+#  @param magnitude Gradient magnitudes of shape (...).
+#  @param view Unit vectors towards the viewer, broadcastable to normals.
+#  @param light Unit vectors towards the light, broadcastable to normals; defaults to view (headlight).
+#  @param ambient Ambient term.
+#  @param diffuse Diffuse term.
+#  @param specular Specular term.
+#  @param shininess Specular exponent.
+#  @param edge Gradient magnitude at which shading reaches 63% strength.
+#  @return Tuple (r, g, b) of shaded colours.
+def shade(r, g, b, normals, magnitude, view, light=None, ambient=0.3, diffuse=0.7, specular=0.2, shininess=16.0, edge=1.0):
+	if light is None:
+		light = view
+	half = light + view
+	half = half / np.linalg.norm(half, axis=-1, keepdims=True)
+	length = np.linalg.norm(normals, axis=-1)
+	length[length == 0] = 1.0
+	n_dot_l = np.abs(np.sum(normals*light, axis=-1)) / length
+	n_dot_h = np.abs(np.sum(normals*half, axis=-1)) / length
+
+	strength = 1.0 - np.exp(-np.asarray(magnitude, dtype=np.float64)/edge)
+	factor = 1.0 - strength + strength*(ambient + diffuse*n_dot_l)
+	highlight = strength*specular*n_dot_h**shininess
+	return r*factor + highlight, g*factor + highlight, b*factor + highlight
+
+
+## @brief Renders one shaded view.
+#  Samples outside the volume are transparent, as in volumerender_clip.
+#  @param datacube The density datacube.
+#  @param gradient Tuple (normals, magnitude) from gradient_volume() or load_gradient().
+#  @param camera Camera from volumerender_camera.
+#  @param interpolationMethod 'nearest' or 'linear'.
+#  @param transfer Transfer function mapping log-density to RGBA.
+#  @param light World-space direction towards the light, or None for a headlight.
+#  @param kwargs Shading terms passed to shade().
+#  @return RGB image of shape (height, width, 3).
+def render_shaded(datacube, gradient, camera, interpolationMethod='linear', transfer=DEFAULT_TRANSFER, light=None, **kwargs):
+	normals, magnitude = gradient
+	inside, qi = clipped_points(camera, datacube.shape)
+	density = np.zeros(camera.shape)
+	normal_grid = np.zeros(camera.shape + (3,), dtype=np.float32)
+	magnitude_grid = np.zeros(camera.shape, dtype=np.float32)
+	if len(qi):
+		d, n, m = sample_fields((datacube, normals, magnitude), qi, interpolationMethod, np.float64)
+		density[inside] = d
+		normal_grid[inside] = n
+		magnitude_grid[inside] = m
+
+	with np.errstate(divide='ignore'):
+		r,g,b,a = transfer(np.log(density))
+	view = -camera.rays()[1]
+	if light is not None:
+		light = np.asarray(light, dtype=np.float64)
+		light = light / np.linalg.norm(light)
+	r,g,b = shade(r, g, b, normal_grid, magnitude_grid, view, light, **kwargs)
+	return composite_rgba(r, g, b, a)
+
+
+## @brief Shaded volume rendering along the orbit of main().
+#  @param Nangles Number of angles for camera rotation.
+#  @param N Image resolution (pixels per side).
+#  @param interpolationMethod 'nearest' or 'linear'.
+#  @return Total rendering time in seconds.
+def main(Nangles=10, N=180, interpolationMethod='linear'):
+	""" Volume Rendering """
+
+	datacube = load_datacube()
+	start = timer()
+	gradient = load_gradient('datacube.hdf5', 'density', datacube)
+	print(f"Gradient ready in {timer() - start} seconds ({gradient_file('datacube.hdf5')})")
+	average = np.zeros(Nangles)
+
+	for i, camera in enumerate(orbit(Nangles, width=N)):
+		print('Rendering Scene ' + str(i+1) + ' of ' + str(Nangles) + '.\n')
+		start = timer()
+
+		image = render_shaded(datacube, gradient, camera, interpolationMethod)
+
+		end = timer()
+		print(f"Time to render scene {i+1}: {end - start} seconds")
+		average[i] = end - start
+
+		save_image(image, 'volumerender_shaded' + str(i) + '.png')
+
+	print(f"Mean rendering time: {np.mean(average)} seconds")
+	print(f"Standard deviation of rendering time: {np.std(average)} seconds")
+	print(f"Max rendering time: {np.max(average)} seconds")
+	print(f"Min rendering time: {np.min(average)} seconds")
+
+	return np.sum(average)
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,143 @@
+# Per-slab Resampling for x-axis Rotations
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+from volumerender_core import load_datacube, rotation_x, view_points, grid_index, composite, save_image
+from volumerender_sampling import sample_uniform, nearest_voxel
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_slab
+#  The camera in main() only rotates about x (qxR = qx), so every x-slab of the
+#  camera grid is a 2D rotation of the matching slab of the datacube. The 2D
+#  indices and weights are the same for every slab, so they are computed once
+#  and each slab is resampled with a 2D bilinear/nearest gather, in parallel.
+
+
+## @brief Checks whether a rotation leaves the x axis fixed.
+#  @param R 3x3 rotation matrix.
+#  @param tol Absolute tolerance on the matrix entries.
+#  @return True if the per-slab fast path applies.
+def is_x_rotation(R, tol=1e-12):
+	return abs(R[0,0] - 1.0) <= tol and np.all(np.abs(R[0,1:]) <= tol) and np.all(np.abs(R[1:,0]) <= tol)
+
+
+## @brief Resamples the datacube slab by slab for a rotation about x.
+#  Linear mode first interpolates the datacube along x, then bilinearly in the
+#  slab, which is exactly the trilinear result of interpn.
+#  @param datacube The density datacube.
+#  @param R 3x3 rotation matrix about the x axis.
+#  @param N Image resolution (pixels per side).
+#  @param Nsteps Number of samples per ray, defaults to N.
+#  @param interpolationMethod 'nearest' or 'linear'.
+#  @param workers Number of threads, defaults to os.cpu_count().
+#  @param out Camera grid of shape (Nsteps, N, N) to fill, e.g. reused across frames.
+#  @return Camera grid of shape (Nsteps, N, N).
+def sample_slabs(datacube, R, N, Nsteps=None, interpolationMethod='linear', workers=None, out=None):
+	if Nsteps is None:
+		Nsteps = N
+	if interpolationMethod not in ('nearest', 'linear'):
+		raise ValueError("interpolationMethod must be 'nearest' or 'linear'")
+	Nx, Ny, Nz = datacube.shape
+	c = np.linspace(-N/2, N/2, N)
+	cd = np.linspace(-N/2, N/2, Nsteps)
+
+	# In-slab positions, shared by all slabs, computed as in view_points()
+	qy, qz = np.meshgrid(cd, c, indexing='ij')
+	qyz = np.array([(R[1,1]*qy + R[1,2]*qz).ravel(), (R[2,1]*qy + R[2,2]*qz).ravel()]).T
+
+	camera_grid = np.empty((Nsteps, N, N), dtype=datacube.dtype) if out is None else out
+
+	if interpolationMethod == 'nearest':
+		# Camera x-slab of every image row, and in-slab voxels, as interpn picks them
+		ix = nearest_voxel(c[:,np.newaxis], (Nx,))[0]
+		iy, iz = nearest_voxel(qyz, (Ny, Nz))
+		flat = iy*Nz + iz
+
+		def work(b):
+			camera_grid[:,b,:] = datacube[ix[b]].ravel().take(flat).reshape((Nsteps, N))
+	else:
+		# Position of every camera x-slab in the datacube, and in-slab positions
+		ux = grid_index(c[:,np.newaxis], (Nx,))[0]
+		uy, uz = grid_index(qyz, (Ny, Nz))
+		ix = np.minimum(np.floor(ux).astype(np.intp), Nx-2)
+		wx = ux - ix
+		iy = np.minimum(np.floor(uy).astype(np.intp), Ny-2)
+		iz = np.minimum(np.floor(uz).astype(np.intp), Nz-2)
+		wy = uy - iy
+		wz = uz - iz
+		flat = iy*Nz + iz
+		corners = ((flat, (1-wy)*(1-wz)), (flat+1, (1-wy)*wz), (flat+Nz, wy*(1-wz)), (flat+Nz+1, wy*wz))
+
+		def work(b):
+			slab = (1-wx[b])*datacube[ix[b]] + wx[b]*datacube[ix[b]+1]
+			slab = slab.ravel()
+			out = np.zeros(Nsteps*N)
+			for index, weight in corners:
+				out += weight*slab.take(index)
+			camera_grid[:,b,:] = out.reshape((Nsteps, N))
+
+	with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+		list(pool.map(work, range(N)))
+
+	return camera_grid
+
+
+## @brief Resamples the datacube onto a rotated camera grid.
+#  Uses sample_slabs() for rotations about x and sample_uniform() otherwise.
+#  @param datacube The density datacube.
+#  @param R 3x3 rotation matrix.
+#  @param N Image resolution (pixels per side).
+#  @param Nsteps Number of samples per ray, defaults to N.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param workers Number of threads for the per-slab path.
+#  @return Camera grid of shape (Nsteps, N, N).
+def sample_view(datacube, R, N, Nsteps=None, interpolationMethod='linear', workers=None):
+	if Nsteps is None:
+		Nsteps = N
+	if is_x_rotation(R) and interpolationMethod in ('nearest', 'linear'):
+		return sample_slabs(datacube, R, N, Nsteps, interpolationMethod, workers)
+	return sample_uniform(datacube, view_points(R, N, Nsteps), (Nsteps,N,N), interpolationMethod)
+
+
+## @brief Volume rendering using the per-slab sampler.
+#  @param N Image resolution (pixels per side).
+#  @param Nangles Number of angles for camera rotation.
+#  @param interpolationMethod Method used for data interpolation.
+#  @return Total rendering time in seconds.
+def main(N=180, Nangles=10, interpolationMethod='linear'):
+	""" Volume Rendering """
+
+	datacube = load_datacube()
+
+	average = np.zeros(Nangles)
+
+	for i in range(Nangles):
+		print('Rendering Scene ' + str(i+1) + ' of ' + str(Nangles) + '.\n')
+		start = timer()
+
+		angle = np.pi/2 * i / Nangles
+		camera_grid = sample_view(datacube, rotation_x(angle), N, interpolationMethod=interpolationMethod)
+		image = composite(camera_grid)
+
+		end = timer()
+		print(f"Time to render scene {i+1}: {end - start} seconds")
+		average[i] = end - start
+
+		save_image(image, 'volumerender' + str(i) + '.png')
+
+	print(f"Mean rendering time: {np.mean(average)} seconds")
+	print(f"Standard deviation of rendering time: {np.std(average)} seconds")
+	print(f"Max rendering time: {np.max(average)} seconds")
+	print(f"Min rendering time: {np.min(average)} seconds")
+
+	return np.sum(average)
+
+if __name__== "__main__":
+	main()
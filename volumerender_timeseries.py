@@ -0,0 +1,197 @@
+# Time-series Rendering
+import os
+import glob
+import queue
+import threading
+import numpy as np
+import h5py as h5
+from timeit import default_timer as timer
+from volumerender_core import Workspace, encode_png
+from volumerender_camera import orbit, uses_slab_path
+from volumerender_slab import sample_slabs
+from volumerender_clip import clipped_points, sample_inside
+from volumerender_profile import NULL_PROFILER
+
+"""
+Create Your Own Volume Rendering (With Python)
+Philip Mocz (2020) Princeton Univeristy, @PMocz
+
+Simulate the Schrodinger-Poisson system with the Spectral method
+"""
+
+## @package volumerender_timeseries
+#  Renders a series of Schrodinger-Poisson snapshots (datacube_0000.hdf5, ...).
+#  The next snapshot is read in a background thread into one of two reused
+#  volume buffers while the current one renders, and the camera rays, clipped
+#  sample positions, camera grids and compositing workspace are built once for
+#  the series.
+
+
+## @brief Expands a glob pattern or list of snapshot files.
+#  @param snapshots Glob pattern or list of file names.
+#  @return Sorted list of file names.
+def snapshot_files(snapshots):
+	if isinstance(snapshots, str):
+		files = sorted(glob.glob(snapshots))
+	else:
+		files = list(snapshots)
+	if not files:
+		raise FileNotFoundError("no snapshot files match " + repr(snapshots))
+	return files
+
+
+## @brief Loads snapshots ahead of the renderer into reused buffers.
+#  Two buffers are cycled: the reader fills one while the renderer uses the
+#  other, and a buffer goes back to the reader when release() is called.
+#  Use it as a context manager (or call close()) so the reader thread stops
+#  when rendering stops early.
+class SnapshotPrefetcher:
+	## @brief Starts reading.
+	#  @param files Snapshot files, in order.
+	#  @param dataset Dataset name.
+	#  @param buffers Number of volume buffers (2 = double buffering).
+	def __init__(self, files, dataset='density', buffers=2):
+		with h5.File(files[0], 'r') as f:
+			self.shape = f[dataset].shape
+			self.dtype = f[dataset].dtype
+		self.free = queue.Queue()
+		for _ in range(max(2, buffers)):
+			self.free.put(np.empty(self.shape, dtype=self.dtype))
+		self.ready = queue.Queue()
+		self.stop = threading.Event()
+		self.thread = threading.Thread(target=self._run, args=(files, dataset), daemon=True)
+		self.thread.start()
+
+	def _run(self, files, dataset):
+		try:
+			for filename in files:
+				buffer = self._free_buffer()
+				if buffer is None:
+					return
+				with h5.File(filename, 'r') as f:
+					dset = f[dataset]
+					if dset.shape != self.shape:
+						raise ValueError(filename + " has shape " + str(dset.shape) + ", expected " + str(self.shape))
+					dset.read_direct(buffer)
+				self.ready.put((filename, buffer))
+		except Exception as error:
+			self.ready.put(error)
+			return
+		self.ready.put(None)
+
+	def _free_buffer(self):
+		while not self.stop.is_set():
+			try:
+				return self.free.get(timeout=0.1)
+			except queue.Empty:
+				pass
+		return None
+
+	## @brief Hands a volume buffer back to the reader.
+	#  @param buffer Buffer yielded by the iterator.
+	def release(self, buffer):
+		self.free.put(buffer)
+
+	def __iter__(self):
+		while True:
+			item = self.ready.get()
+			if item is None:
+				return
+			if isinstance(item, Exception):
+				raise item
+			yield item
+
+	## @brief Stops the reader, drops the snapshots loaded ahead and waits for it to finish.
+	def close(self):
+		self.stop.set()
+		while self.thread.is_alive():
+			try:
+				while True:
+					self.ready.get_nowait()
+			except queue.Empty:
+				pass
+			self.thread.join(0.1)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+## @brief Per-camera sampling plan, built once for a series.
+#  @param cameras Cameras from volumerender_camera.
+#  @param shape Shape of the datacubes.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param dtype Dtype of the datacubes, for the slab path's camera grids.
+#  @return List of (camera, slab, inside, qi, camera_grid) with inside/qi None on the
+#  slab path, and camera_grid a buffer every frame of the camera is sampled into.
+def plan_cameras(cameras, shape, interpolationMethod='linear', dtype=np.float64):
+	plans = []
+	for camera in cameras:
+		if uses_slab_path(camera, shape, interpolationMethod):
+			plans.append((camera, True, None, None, np.empty(camera.shape, dtype=dtype)))
+		else:
+			plans.append((camera, False) + clipped_points(camera, shape) + (np.empty(camera.shape),))
+	return plans
+
+
+## @brief Renders every camera for every snapshot.
+#  @param snapshots Glob pattern or list of snapshot files.
+#  @param cameras Cameras from volumerender_camera.
+#  @param output Output file pattern with {snapshot} and {frame} fields.
+#  @param dataset Dataset name.
+#  @param interpolationMethod Method used for data interpolation.
+#  @param profiler Profiler receiving the load, sample, composite and encode stages.
+#  @return List of written file names.
+def render_series(snapshots, cameras, output='volumerender_{snapshot:04d}_{frame}.png', dataset='density', interpolationMethod='linear', profiler=NULL_PROFILER):
+	files = snapshot_files(snapshots)
+	written = []
+
+	with SnapshotPrefetcher(files, dataset) as prefetcher:
+		plans = plan_cameras(cameras, prefetcher.shape, interpolationMethod, prefetcher.dtype)
+		workspace = Workspace()
+		loaded = iter(prefetcher)
+		for s in range(len(files)):
+			# Time spent waiting here is load time the prefetch did not hide
+			with profiler.stage('load'):
+				filename, datacube = next(loaded)
+			print('Rendering ' + os.path.basename(filename) + ' (' + str(s+1) + ' of ' + str(len(files)) + ')')
+
+			for i, (camera, slab, inside, qi, camera_grid) in enumerate(plans):
+				profiler.frame = (s, i)
+				with profiler.stage('sample'):
+					if slab:
+						sample_slabs(datacube, camera.matrix, camera.width, camera.Nsteps, interpolationMethod, out=camera_grid)
+					else:
+						sample_inside(datacube, camera, inside, qi, interpolationMethod, out=camera_grid)
+				with profiler.stage('composite'):
+					image = workspace.composite(camera_grid)
+				with profiler.stage('encode'):
+					name = output.format(snapshot=s, frame=i)
+					with open(name, 'wb') as f:
+						f.write(encode_png(image))
+				written.append(name)
+
+			prefetcher.release(datacube)
+
+	return written
+
+
+## @brief Time-series volume rendering.
+#  @param snapshots Glob pattern or list of snapshot files.
+#  @param Nangles Number of angles for camera rotation.
+#  @param N Image resolution (pixels per side).
+#  @param interpolationMethod Method used for data interpolation.
+#  @return Total rendering time in seconds.
+def main(snapshots='datacube_*.hdf5', Nangles=10, N=180, interpolationMethod='linear'):
+	""" Volume Rendering """
+
+	start = timer()
+	written = render_series(snapshots, orbit(Nangles, width=N), interpolationMethod=interpolationMethod)
+	end = timer()
+	print(f"Rendered {len(written)} images in {end - start} seconds")
+	return end - start
+
+if __name__== "__main__":
+	main()
@@ -1,10 +1,7 @@
 # Original with Vectorization
 import numpy as np
-import matplotlib.pyplot as plt
 from timeit import default_timer as timer
-import h5py as h5
-from scipy.interpolate import interpn
-from line_profiler import LineProfiler
+from volumerender_core import TF_CENTERS, TF_WIDTHS, TF_WEIGHTS
 
 """
 Create Your Own Volume Rendering (With Python)
@@ -28,21 +25,133 @@ def transferFunction(x):
 
 	return r,g,b,a
 
+## Estimated bytes per camera grid sample held at once: the query points,
+#  interpn's indices/weights/result and the classification buffers. Measured
+#  with tracemalloc; interpn's linear path keeps more per sample than nearest.
+BYTES_PER_SAMPLE = {'nearest': 176, 'linear': 232}
+
+## Conservative estimate for the other interpn methods.
+BYTES_PER_SAMPLE_OTHER = 512
+
+## @brief Splits the camera grid into depth slabs that fit a memory budget.
+#  @param N Image resolution (pixels per side, and samples per ray).
+#  @param memory_budget Budget in bytes, or None for a single slab.
+#  @param interpolationMethod Method used for interpolation, which sets the bytes per sample.
+#  @return List of (start, stop) depth ranges.
+def chunk_plan(N, memory_budget=None, interpolationMethod='linear'):
+  per_sample = BYTES_PER_SAMPLE.get(interpolationMethod, BYTES_PER_SAMPLE_OTHER)
+  if memory_budget is None:
+    depth = N
+  else:
+    depth = int(max(1, min(N, memory_budget // (N*N*per_sample))))
+  chunks = [(k, min(k + depth, N)) for k in range(0, N, depth)]
+  print(f"Chunk plan: {len(chunks)} slab(s) of up to {depth} x {N} x {N} samples, "
+        f"~{depth*N*N*per_sample/2**20:.1f} MiB each")
+  return chunks
+
+## @brief Preallocates the buffers reused by every slab of every frame.
+#  @param N Image resolution.
+#  @param depth Largest slab depth from chunk_plan().
+#  @return Dict of named buffers.
+def make_buffers(N, depth):
+  shape = (depth, N, N)
+  return {
+    'qi': np.empty((depth*N*N, 3)),
+    'gauss': [np.empty(shape) for _ in TF_CENTERS],
+    'a': np.empty(shape),
+    'c': np.empty(shape),
+    'tmp': np.empty(shape),
+    'plane': np.empty((N, N)),
+  }
+
+## @brief Interpolates and classifies one depth slab, adding it to the image.
+#  All full-size temporaries except interpn's own live in the preallocated buffers.
+#  @param image Image of shape (N, N, 3) accumulated in place.
+#  @param points Datacube grid.
+#  @param datacube The density datacube.
+#  @param angle Camera rotation about x in radians.
+#  @param start First depth index of the slab.
+#  @param stop Depth index one past the slab.
+#  @param N Image resolution.
+#  @param interpolationMethod Method used for interpolation.
+#  @param buffers Buffers from make_buffers().
+def render_chunk(image, points, datacube, angle, start, stop, N, interpolationMethod, buffers):
+  from scipy.interpolate import interpn
+
+  depth = stop - start
+  n = depth*N*N
+  c = np.linspace(-N/2, N/2, N)
+  cd = c[start:stop]
+
+  # Camera Grid / Query Points -- rotate camera view (same layout as np.meshgrid(c,c,c))
+  qi = buffers['qi'][:n]
+  q = qi.reshape((depth, N, N, 3))
+  q[..., 0] = c[np.newaxis, :, np.newaxis]
+  np.subtract((cd*np.cos(angle))[:, np.newaxis, np.newaxis], (c*np.sin(angle))[np.newaxis, np.newaxis, :], out=q[..., 1])
+  np.add((cd*np.sin(angle))[:, np.newaxis, np.newaxis], (c*np.cos(angle))[np.newaxis, np.newaxis, :], out=q[..., 2])
+
+  # Interpolate onto Camera Grid, then take the log in place
+  x = interpn(points, datacube, qi, method=interpolationMethod).reshape((depth, N, N))
+  np.log(x, out=x)
+
+  gauss = [g[:depth] for g in buffers['gauss']]
+  a = buffers['a'][:depth]
+  col = buffers['c'][:depth]
+  tmp = buffers['tmp'][:depth]
+  plane = buffers['plane']
+
+  for g, center, width in zip(gauss, TF_CENTERS, TF_WIDTHS):
+    np.subtract(x, center, out=g)
+    np.multiply(g, g, out=g)
+    np.multiply(g, -1.0/width, out=g)
+    np.exp(g, out=g)
+
+  def combine(weights, out):
+    np.multiply(gauss[0], weights[0], out=out)
+    for g, w in zip(gauss[1:], weights[1:]):
+      np.multiply(g, w, out=tmp)
+      np.add(out, tmp, out=out)
+
+  combine(TF_WEIGHTS[3], a)
+  for channel in range(3):
+    combine(TF_WEIGHTS[channel], col)
+    np.multiply(a, col, out=col)
+    np.sum(col, axis=0, out=plane)
+    image[:, :, channel] += plane
+
+## @brief Renders one view, slab by slab.
+#  @param points Datacube grid.
+#  @param datacube The density datacube.
+#  @param angle Camera rotation about x in radians.
+#  @param N Image resolution.
+#  @param interpolationMethod Method used for interpolation.
+#  @param chunks Depth ranges from chunk_plan().
+#  @param buffers Buffers from make_buffers().
+#  @return Image of shape (N, N, 3).
+def render_view(points, datacube, angle, N, interpolationMethod, chunks, buffers):
+  image = np.zeros((N, N, 3))
+  for start, stop in chunks:
+    render_chunk(image, points, datacube, angle, start, stop, N, interpolationMethod, buffers)
+  return image
+
 ## @brief Main function to perform volume rendering.
 #  @param Nangles Number of angles to render.
 #  @param num_runs Number of runs for each angle.
 #  @param interpolationMethod Method used for interpolation.
+#  @param memory_budget Peak bytes for the camera grid work, or None for one slab.
 #  This function loads a 3D data cube, performs volume rendering from different angles,
 #  and visualizes the results. It utilizes numpy and matplotlib for computation and visualization.
-def main(Nangles, num_runs, interpolationMethod):
-	""" 
-    Main function for volume rendering.
-    
-    @param Nangles Number of angles for rendering.
-    @param num_runs Number of runs for rendering.
-    @param interpolationMethod Method used for interpolation.
-    """
-  """ Volume Rendering """
+def main(Nangles, num_runs, interpolationMethod, memory_budget=None):
+  """ 
+  Main function for volume rendering.
+  
+  @param Nangles Number of angles for rendering.
+  @param num_runs Number of runs for rendering.
+  @param interpolationMethod Method used for interpolation.
+  @param memory_budget Peak bytes for the camera grid work, or None for one slab.
+  """
+  import h5py as h5
+  import matplotlib.pyplot as plt
   
   # Load Datacube
   with h5.File('datacube.hdf5', 'r') as f:
@@ -55,6 +164,10 @@ def main(Nangles, num_runs, interpolationMethod):
   z = np.linspace(-Nz/2, Nz/2, Nz)
   points = (x, y, z)
 
+  N = 180
+  chunks = chunk_plan(N, memory_budget, interpolationMethod)
+  buffers = make_buffers(N, chunks[0][1] - chunks[0][0])
+
   average_times = []
   total_time = np.zeros(num_runs)
   scene_times_all_runs = [[] for _ in range(Nangles)]
@@ -71,26 +184,9 @@ def main(Nangles, num_runs, interpolationMethod):
 
       # Camera Grid / Query Points -- rotate camera view
       angle = np.pi/2 * i / Nangles
-      N = 180
-      c = np.linspace(-N/2, N/2, N)
-      qx, qy, qz = np.meshgrid(c,c,c)
-      qxR = qx
-      qyR = qy * np.cos(angle) - qz * np.sin(angle)
-      qzR = qy * np.sin(angle) + qz * np.cos(angle)
-      qi = np.array([qxR.ravel(), qyR.ravel(), qzR.ravel()]).T
-
-      # Interpolate onto Camera Grid
-      camera_grid = interpn(points, datacube, qi, method=interpolationMethod).reshape((N,N,N))
-    
-      # Do Volume Rendering
-      image = np.zeros((camera_grid.shape[1],camera_grid.shape[2],3))
-
-      r, g, b, a = transferFunction(np.log(camera_grid))
-    
-      # Apply transfer function to each slice of camera_grid
-      image[:, :, 0] = np.sum(a * r, axis=0)
-      image[:, :, 1] = np.sum(a * g, axis=0)
-      image[:, :, 2] = np.sum(a * b, axis=0)
+
+      # Interpolate and classify slab by slab into the reused buffers
+      image = render_view(points, datacube, angle, N, interpolationMethod, chunks, buffers)
 
       end = timer()
       print(f"Time to render scene {i+1}: {end - start} seconds")
@@ -159,6 +255,8 @@ def main(Nangles, num_runs, interpolationMethod):
 ## @brief Profiles the `main` function using LineProfiler.
 #  This function is intended for performance analysis and optimization.
 def profile_line_profiler():
+    from line_profiler import LineProfiler
+
     profiler = LineProfiler()
     profiler.add_function(main)
     profiler.run('main(10, 1, "nearest")')